@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Audit a collection of `xrandr -q --verbose` dumps (e.g. from all machines and projectors of a company): for which ones does
+# lilass find the screens, which ones cannot be mirrored, which setups can be derived? Run from the source directory:
+#   ./audit.py dumps/ -o results.jsonl --report report.json
+#   ./audit.py dumps.tar.gz -j 8
+# Every dump gets one JSON line in the results; the report aggregates them.
+
+'''
+The dumps are read by the main process, one at a time, and evaluated by a pool of worker processes. At most a few batches of dumps per
+worker are in flight at any time, and results are written out as soon as they come in, so memory stays bounded no matter how
+many dumps there are. Results therefore come in the order they are done, not in the order of the input.
+'''
+import argparse, collections, concurrent.futures, contextlib, io, json, os, sys, tarfile, zipfile
+import screen
+
+## reading the dumps
+
+def _readDirectory(path):
+    for directory, subdirectories, files in os.walk(path):
+        subdirectories.sort()
+        for name in sorted(files):
+            filename = os.path.join(directory, name)
+            with open(filename, "rb") as f:
+                yield (os.path.relpath(filename, path), f.read())
+
+def _readTar(path):
+    with tarfile.open(path, "r|*") as archive: # streaming: members are read in order, without an index
+        for member in archive:
+            if member.isfile():
+                yield (member.name, archive.extractfile(member).read())
+
+def _readZip(path):
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield (info.filename, archive.read(info))
+
+def readDumps(path):
+    '''Yields (name, bytes) for every dump in <path>: a directory (searched recursively), a tar or zip archive, or a single file'''
+    if os.path.isdir(path):
+        return _readDirectory(path)
+    if zipfile.is_zipfile(path):
+        return _readZip(path)
+    if tarfile.is_tarfile(path):
+        return _readTar(path)
+    with open(path, "rb") as f:
+        return iter([(os.path.basename(path), f.read())])
+
+## evaluating a dump (in a worker process)
+
+def _screenInfo(connector):
+    info = collections.OrderedDict([("connector", connector.name), ("preferred", connector.getPreferredResolution().forDatabase()),
+                                    ("modes", len(connector.getResolutionList()))])
+    if connector.edid is not None:
+        info["screen"] = connector.edid.fingerprint()
+        info["name"] = connector.edid.name()
+        info["edid-valid"] = connector.edid.isValid() # lilass uses it anyway, but it may be the reason for odd modes
+    return info
+
+def auditDump(name, data):
+    '''Evaluates one dump; returns a dict that can be turned into JSON. Never raises.'''
+    result = collections.OrderedDict([("name", name)])
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # ScreenSituation reports what it detected
+            situation = screen.ScreenSituation(None, xrandrSource = io.BytesIO(data))
+        result["connectors"] = len(situation.connectors)
+        result["connected"] = [c.name for c in situation.connectedConnectors()]
+        result["internal"] = _screenInfo(situation.internalConnector)
+        if situation.externalConnector is None:
+            result["external"] = None
+            return result
+        result["external"] = _screenInfo(situation.externalConnector)
+        common = situation.commonResolutions()
+        result["common"] = len(common)
+        result["mirror"] = common[0].forDatabase() if common else None
+        # derive the setups lilass would use with -r, and check that they can be applied
+        setups, problems = collections.OrderedDict(), collections.OrderedDict()
+        for relPos in screen.RelativeScreenPosition:
+            try:
+                if relPos == screen.RelativeScreenPosition.MIRROR:
+                    if not common:
+                        raise Exception("no common resolution")
+                    setup = screen.ScreenSetup(common[0], common[0], relPos)
+                else:
+                    setup = screen.ScreenSetup(situation.internalConnector.getPreferredResolution(), situation.externalConnector.getPreferredResolution(), relPos)
+                situation.forXrandr(setup)
+                setups[relPos.name.lower()] = str(setup)
+            except Exception as e:
+                problems[relPos.name.lower()] = str(e)
+        result["setups"] = setups
+        if problems:
+            result["problems"] = problems
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    return result
+
+def auditDumps(batch):
+    return [auditDump(name, data) for name, data in batch]
+
+## running it all
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def audit(dumps, workers = None, batchSize = 16, maxPending = None):
+    '''Evaluates the (name, bytes) pairs of <dumps> on a pool of <workers> processes, and yields the results as they are done.
+       The dumps are sent to the workers in batches of <batchSize> (which saves a lot of inter-process communication); at most
+       <maxPending> batches are handed to the pool at any time.'''
+    workers = workers or os.cpu_count() or 1
+    maxPending = maxPending or 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for batch in _batches(dumps, batchSize):
+            if len(pending) >= maxPending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(pool.submit(auditDumps, batch))
+        for future in concurrent.futures.as_completed(pending):
+            yield from future.result()
+
+class Report:
+    '''Aggregates the results'''
+    def __init__(self, top = 20):
+        self._top = top
+        self.dumps = 0
+        self.errors = collections.Counter() # maps error messages to how often they occurred
+        self.withExternal = 0
+        self.noCommon = collections.Counter() # maps (internal, external) screens without common resolution to how often we saw them
+        self.problems = collections.Counter() # maps (position, problem) to how often it occurred
+        self.screens = collections.Counter() # external screens, by name
+        self.invalidEdids = collections.Counter() # external screens with an invalid EDID, by name
+
+    def add(self, result):
+        self.dumps += 1
+        if "error" in result:
+            self.errors[result["error"]] += 1
+            return
+        external = result.get("external")
+        if external is None:
+            return
+        self.withExternal += 1
+        self.screens[external.get("name") or external.get("screen") or "(no EDID)"] += 1
+        if external.get("edid-valid") is False:
+            self.invalidEdids[external.get("name") or external["screen"]] += 1
+        if not result["common"]:
+            internal = result["internal"]
+            self.noCommon["%s + %s" % (internal.get("name") or internal["connector"], external.get("name") or external["connector"])] += 1
+        for relPos, problem in result.get("problems", {}).items():
+            self.problems["%s: %s" % (relPos, problem)] += 1
+
+    def summary(self):
+        return collections.OrderedDict([
+            ("dumps", self.dumps),
+            ("errors", sum(self.errors.values())),
+            ("with-external", self.withExternal),
+            ("no-common-resolution", sum(self.noCommon.values())),
+            ("invalid-edids", sum(self.invalidEdids.values())),
+            ("top-errors", self.errors.most_common(self._top)),
+            ("top-no-common-resolution", self.noCommon.most_common(self._top)),
+            ("top-problems", self.problems.most_common(self._top)),
+            ("top-external-screens", self.screens.most_common(self._top)),
+            ("top-invalid-edids", self.invalidEdids.most_common(self._top)),
+        ])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Audit a collection of xrandr dumps')
+    parser.add_argument("input", metavar="PATH",
+                        help="A directory (searched recursively), a tar or zip archive, or a single file of `xrandr -q --verbose` dumps")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Number of worker processes (default: one per CPU)")
+    parser.add_argument("-o", "--output",
+                        help="Write the result of every dump as a JSON line to this file")
+    parser.add_argument("--report",
+                        help="Write the aggregate report as JSON to this file (default: stdout)")
+    parser.add_argument("--top", type=int, default=20,
+                        help="How many entries to list in the top-N parts of the report")
+    args = parser.parse_args()
+
+    report = Report(args.top)
+    with (open(args.output, "w") if args.output else contextlib.nullcontext()) as output:
+        for result in audit(readDumps(args.input), args.jobs):
+            report.add(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+            if report.dumps % 1000 == 0:
+                print("%d dumps done" % report.dumps, file=sys.stderr)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report.summary(), f, indent=2)
+    else:
+        json.dump(report.summary(), sys.stdout, indent=2)
+        print()
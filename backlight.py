@@ -0,0 +1,185 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Make sure the backlight of the internal screen is on. The kernel exposes it in /sys/class/backlight, which is much cheaper
+# than starting xbacklight (which, in turn, asks the X server); xbacklight is only used if that does not work.
+
+'''
+A device in /sys/class/backlight/<name>/ has:
+
+  type            "firmware" (e.g. ACPI), "platform" (a platform driver) or "raw" (the GPU driver writing the registers)
+  brightness      the brightness, from 0 to max_brightness
+  max_brightness
+  bl_power        0 if the backlight is powered, 4 if it is powered down (FB_BLANK_UNBLANK and FB_BLANK_POWERDOWN)
+
+If there are several devices, the kernel documentation says to prefer firmware over platform over raw, as the firmware knows
+best how to control the machine's panel.
+
+A backend implements:
+
+def read(self):
+    Reads the current state, and returns self. This may take a while, so it can be done in the background.
+
+def brightness(self):
+    The brightness in percent, or None if it is unknown.
+
+def turnOn(self):
+    Makes sure the backlight is on, using the state read before if read() was called.
+'''
+import os, subprocess
+
+SYSFS_ROOT = "/sys/class/backlight"
+_typePriority = {"firmware": 0, "platform": 1, "raw": 2}
+
+def _readInt(path):
+    with open(path) as f:
+        return int(f.read().strip())
+
+def _writeInt(path, value):
+    with open(path, "w") as f:
+        f.write("%d\n" % value)
+
+class SysfsBacklight:
+    '''The backlight device at <path> (a directory in /sys/class/backlight)'''
+    def __init__(self, path):
+        self.path = path
+        self._state = None # (brightness, max_brightness, bl_power) once read
+
+    def read(self):
+        power = os.path.join(self.path, "bl_power")
+        self._state = (_readInt(os.path.join(self.path, "brightness")), _readInt(os.path.join(self.path, "max_brightness")),
+                       _readInt(power) if os.path.exists(power) else 0)
+        return self
+
+    def brightness(self):
+        if self._state is None:
+            self.read()
+        brightness, maxBrightness, power = self._state
+        return 100.0 * brightness / maxBrightness if maxBrightness else None
+
+    def isOn(self):
+        if self._state is None:
+            self.read()
+        brightness, maxBrightness, power = self._state
+        return brightness > 0 and power == 0
+
+    def turnOn(self):
+        '''Raises PermissionError if we may not change the backlight'''
+        if self.isOn():
+            return
+        brightness, maxBrightness, power = self._state
+        if power != 0:
+            _writeInt(os.path.join(self.path, "bl_power"), 0)
+        if brightness == 0: # it's completely turned off, we better enable it
+            _writeInt(os.path.join(self.path, "brightness"), maxBrightness)
+        self._state = None
+
+class XBacklight:
+    '''Runs xbacklight for the given display (default: $DISPLAY)'''
+    def __init__(self, display = None):
+        self._display = display
+        self._brightness = None
+        self._read = False
+
+    def _args(self, *args):
+        return ["xbacklight"] + (["-display", self._display] if self._display is not None else []) + list(args)
+
+    def read(self):
+        self._read = True
+        self._brightness = None
+        try:
+            self._brightness = float(subprocess.check_output(self._args("-get")).strip())
+        except FileNotFoundError:
+            print("xbacklight has not been found, unable to turn your laptop backlight on.")
+        except subprocess.CalledProcessError:
+            print("xbacklight returned an error while attempting to turn your laptop backlight on.")
+        return self
+
+    def brightness(self):
+        if not self._read:
+            self.read()
+        return self._brightness
+
+    def turnOn(self):
+        if self.brightness() == 0: # it's completely turned off, we better enable it
+            try:
+                subprocess.check_call(self._args("-set", "100"))
+            except (FileNotFoundError, subprocess.CalledProcessError):
+                print("xbacklight returned an error while attempting to turn your laptop backlight on.")
+        self._read = False
+
+class _FallbackBacklight:
+    '''Uses the sysfs device, unless we cannot read or change it'''
+    def __init__(self, device, display):
+        self._device = device
+        self._display = display
+
+    def _fallBack(self):
+        self._device = XBacklight(self._display)
+
+    def read(self):
+        try:
+            self._device.read()
+        except (OSError, ValueError): # ValueError: the file is empty or garbled
+            self._fallBack()
+            self._device.read()
+        return self
+
+    def brightness(self):
+        try:
+            return self._device.brightness()
+        except (OSError, ValueError):
+            self._fallBack()
+            return self._device.brightness()
+
+    def turnOn(self):
+        try:
+            self._device.turnOn()
+        except (OSError, ValueError): # usually, only root may write to sysfs, unless a udev rule allows it
+            self._fallBack()
+            self._device.turnOn()
+
+def findDevice(root = SYSFS_ROOT):
+    '''The path of the backlight device to use, or None if there is none'''
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return None
+    candidates = []
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            with open(os.path.join(path, "type")) as f:
+                kind = f.read().strip()
+        except OSError:
+            continue # not a backlight device
+        candidates.append((_typePriority.get(kind, len(_typePriority)), name, path))
+    return min(candidates)[2] if candidates else None
+
+def getBacklight(display = None, root = SYSFS_ROOT):
+    '''The backlight backend for <display>. The sysfs devices belong to the machine's own panel, so they are only used for the
+       X server we are running in.'''
+    if display is None or display == os.environ.get("DISPLAY"):
+        path = findDevice(root)
+        if path is not None:
+            return _FallbackBacklight(SysfsBacklight(path), display)
+    return XBacklight(display)
+
+def turnOn(display = None, root = SYSFS_ROOT):
+    '''Make sure the backlight of <display> is turned on'''
+    getBacklight(display, root).turnOn()
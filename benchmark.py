@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Benchmarks for everything that happens when a screen is plugged in. Run from the source directory:
+#   ./benchmark.py -o before.json
+#   (change something)
+#   ./benchmark.py -o after.json --compare before.json
+# All times are in seconds.
+
+import argparse, collections, contextlib, json, os, platform, subprocess, sys, tempfile, time
+import screen, database, synthetic, xrandr_parser, simulator
+
+sourceDirectory = os.path.dirname(os.path.abspath(__file__))
+
+def percentile(sortedValues, p):
+    # nearest-rank percentile
+    idx = max(0, min(len(sortedValues) - 1, int(round(p / 100.0 * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[idx]
+
+def summarize(times):
+    times = sorted(times)
+    return collections.OrderedDict([
+        ("runs", len(times)),
+        ("min", times[0]),
+        ("p50", percentile(times, 50)),
+        ("p90", percentile(times, 90)),
+        ("p99", percentile(times, 99)),
+        ("max", times[-1]),
+        ("mean", sum(times) / len(times)),
+    ])
+
+def measure(func, runs):
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): # lilass is chatty
+        for i in range(runs):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    return summarize(times)
+
+## the benchmarks
+
+benchmarks = collections.OrderedDict()
+def benchmark(name):
+    def register(func):
+        benchmarks[name] = func
+        return func
+    return register
+
+class Fixtures:
+    '''Test data shared by the benchmarks, created on first use'''
+    def __init__(self, args):
+        self.args = args
+        self.tmp = tempfile.TemporaryDirectory(prefix="lilass-bench-")
+        self._dump = None
+
+    def dump(self):
+        if self._dump is None:
+            self._dump = synthetic.xrandrDump(connectors = self.args.connectors, modes = self.args.modes, extensions = self.args.edid_extensions)
+        return self._dump
+
+    def dumpFile(self):
+        path = os.path.join(self.tmp.name, "xrandr-dump")
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.writelines(self.dump())
+        return path
+
+    def dataHome(self):
+        return os.path.join(self.tmp.name, "data")
+
+    def situation(self):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return screen.ScreenSituation(["eDP-1"], xrandrSource = self.dump())
+
+    def setupFor(self, situation):
+        res = situation.commonResolutions()[0]
+        return screen.ScreenSetup(res, situation.externalConnector.getPreferredResolution(), screen.RelativeScreenPosition.LEFT)
+
+    def database(self):
+        '''A database with args.db_rows known screens, among them the external screen of our situation'''
+        path = os.path.join(self.dataHome(), "lilass", "collected_data.sqlite") # where lilass will look for it
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            situation = self.situation()
+            setup = self.setupFor(situation)
+            with database.Database(path) as db:
+                for serial in range(self.args.db_rows):
+                    db.putConfig(synthetic.edid(100000 + serial).hex(), setup)
+                situation.putDBInfo(db, setup)
+                db.maintain(maxRows = None) # so that the runs we measure do not do it
+        return path
+
+    def stubXrandr(self):
+        '''A directory with an xrandr that prints our dump, and accepts any other call'''
+        path = os.path.join(self.tmp.name, "bin")
+        if not os.path.exists(path):
+            os.makedirs(path)
+            with open(os.path.join(path, "xrandr"), "w") as f:
+                f.write('#!/bin/sh\nsleep %f\nfor arg in "$@"; do if [ "$arg" = "-q" ]; then exec cat "%s"; fi; done\nexit 0\n' % (self.args.xrandr_delay, self.dumpFile()))
+            os.chmod(os.path.join(path, "xrandr"), 0o755)
+        return path
+
+@benchmark("parse-str")
+def benchParseStr(fixtures):
+    lines = fixtures.dump()
+    return measure(lambda: xrandr_parser.parse(lines), fixtures.args.runs)
+
+@benchmark("parse-bytes")
+def benchParseBytes(fixtures):
+    lines = [l.encode("utf-8") for l in fixtures.dump()]
+    return measure(lambda: xrandr_parser.parse(lines), fixtures.args.runs)
+
+@benchmark("parse-output")
+def benchParseOutput(fixtures):
+    # what XrandrProbe does with the output of xrandr
+    output = "".join(fixtures.dump()).encode("utf-8")
+    return measure(lambda: xrandr_parser.parse(output.decode("utf-8").split("\n")), fixtures.args.runs)
+
+@benchmark("situation")
+def benchSituation(fixtures):
+    lines = fixtures.dump()
+    return measure(lambda: screen.ScreenSituation(["eDP-1"], xrandrSource = lines), fixtures.args.runs)
+
+@benchmark("common-resolutions")
+def benchCommonResolutions(fixtures):
+    situation = fixtures.situation()
+    return measure(situation.commonResolutions, fixtures.args.runs)
+
+@benchmark("for-xrandr")
+def benchForXrandr(fixtures):
+    situation = fixtures.situation()
+    setup = fixtures.setupFor(situation)
+    return measure(lambda: situation.forXrandr(setup), fixtures.args.runs)
+
+@benchmark("db-get")
+def benchDbGet(fixtures):
+    path = fixtures.database()
+    edid = fixtures.situation().externalConnector.edid
+    def run():
+        with database.Database(path) as db:
+            db.getConfig(edid)
+    return measure(run, fixtures.args.runs)
+
+@benchmark("db-get-readonly")
+def benchDbGetReadOnly(fixtures):
+    # what `lilass -s` does
+    path = fixtures.database()
+    edid = fixtures.situation().externalConnector.edid
+    def run():
+        with database.Database(path, readOnly = True) as db:
+            db.getConfig(edid)
+    return measure(run, fixtures.args.runs)
+
+@benchmark("db-put")
+def benchDbPut(fixtures):
+    path = fixtures.database()
+    situation = fixtures.situation()
+    setup = fixtures.setupFor(situation)
+    def run():
+        with database.Database(path) as db:
+            situation.putDBInfo(db, setup)
+    return measure(run, fixtures.args.runs)
+
+def coldStartCommand(fixtures):
+    '''The command line and environment for a `lilass -s` run for a known screen, against our xrandr and our files'''
+    fixtures.database()
+    env = dict(os.environ)
+    env.pop("DISPLAY", None) # make sure we use our xrandr
+    env.pop("LILASS_TRACE", None)
+    env.update(PATH = fixtures.stubXrandr() + os.pathsep + env.get("PATH", ""), HOME = fixtures.tmp.name,
+               XDG_DATA_HOME = fixtures.dataHome(), XDG_CONFIG_HOME = os.path.join(fixtures.tmp.name, "config"),
+               XDG_RUNTIME_DIR = os.path.join(fixtures.tmp.name, "run"))
+    return ([sys.executable, os.path.join(sourceDirectory, "lilass"), "-s", "--frontend", "cli"], env)
+
+def benchColdStart(fixtures, replayCache):
+    # a complete `lilass -s` run for a known screen, in a fresh interpreter
+    cmd, env = coldStartCommand(fixtures)
+    cacheFile = os.path.join(fixtures.dataHome(), "lilass", "replay_cache.json")
+    def run():
+        if not replayCache and os.path.exists(cacheFile):
+            os.remove(cacheFile)
+        p = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        # lilass reports errors on stderr, but does not fail unless -v is given
+        if p.returncode != 0 or p.stderr:
+            raise Exception("lilass failed: " + p.stderr.decode("utf-8", "replace"))
+    return measure(run, max(1, fixtures.args.runs // 10))
+
+@benchmark("cold-start")
+def benchColdStartCached(fixtures):
+    # the same screens as last time: applied straight from the replay cache
+    return benchColdStart(fixtures, True)
+
+@benchmark("cold-start-nocache")
+def benchColdStartUncached(fixtures):
+    return benchColdStart(fixtures, False)
+
+@benchmark("replay")
+def benchReplay(fixtures):
+    # hotplug events through the daemon's event handling, the database and the apply path, against the simulator; per event
+    path = fixtures.database()
+    events = simulator.randomTrace(fixtures.args.runs * 10)
+    sim = simulator.Simulator()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), database.Database(path, readOnly = True) as db:
+        summary = summarize(simulator.replay(events, sim, db = db))
+    summary["xrandr-calls"] = sim.xrandrCalls
+    summary["modesets"] = sim.modesets
+    return summary
+
+# imports everything `lilass -s` imports, and reports how long that took and whether any toolkit was loaded
+importScript = """
+import sys, time, json, importlib.util, importlib.machinery
+start = time.perf_counter()
+loader = importlib.machinery.SourceFileLoader("lilass", sys.argv[1])
+spec = importlib.util.spec_from_loader("lilass", loader)
+loader.exec_module(importlib.util.module_from_spec(spec))
+elapsed = time.perf_counter() - start
+print(json.dumps({"time": elapsed, "toolkits": [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+toolkitModules = ["PyQt5", "qt_frontend", "zenity_frontend"]
+
+@benchmark("import-silent")
+def benchImportSilent(fixtures):
+    # this runs on every hotplug, so it has a budget (see --import-budget)
+    times = []
+    toolkits = set()
+    for i in range(max(1, fixtures.args.runs // 10)):
+        out = subprocess.check_output([sys.executable, "-c", importScript, os.path.join(sourceDirectory, "lilass")] + toolkitModules, cwd=sourceDirectory)
+        result = json.loads(out.decode("utf-8"))
+        times.append(result["time"])
+        toolkits.update(result["toolkits"])
+    summary = summarize(times)
+    summary["toolkits"] = sorted(toolkits)
+    return summary
+
+# shows the Qt dialog for a known situation, and reports how long it took until the dialog was visible
+qtDialogScript = """
+import sys, os, time, json
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import screen, qt_frontend
+from PyQt5 import QtWidgets
+if sys.argv[2] == "compile":
+    qt_frontend.compileUi()
+    sys.exit(0)
+app = QtWidgets.QApplication(sys.argv[:1])
+with open(os.path.join(sys.argv[1], "xrandr-tests", "with-extern")) as f:
+    situation = screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = f)
+dialog = qt_frontend.PositionSelection(situation, useCompiledUi = (sys.argv[2] == "compiled"))
+dialog.show()
+app.processEvents()
+assert dialog.isVisible()
+print(json.dumps({"time": time.perf_counter() - start}))
+"""
+
+def benchQtDialog(fixtures, mode):
+    import importlib.util
+    if importlib.util.find_spec("PyQt5") is None:
+        return {"skipped": "PyQt5 is not installed"}
+    env = dict(os.environ)
+    env.update(QT_QPA_PLATFORM = "offscreen", XDG_CACHE_HOME = os.path.join(fixtures.tmp.name, "cache"))
+    def run(mode):
+        return subprocess.check_output([sys.executable, "-c", qtDialogScript, sourceDirectory, mode], env=env, stderr=subprocess.DEVNULL)
+    if mode == "compiled":
+        run("compile")
+    times = []
+    for i in range(max(1, fixtures.args.runs // 10)):
+        times.append(json.loads(run(mode).decode("utf-8").splitlines()[-1])["time"])
+    return summarize(times)
+
+@benchmark("qt-dialog")
+def benchQtDialogCompiled(fixtures):
+    # time until the dialog is visible, from the start of the interpreter, with the compiled dialog in the cache
+    return benchQtDialog(fixtures, "compiled")
+
+@benchmark("qt-dialog-loadui")
+def benchQtDialogLoadUi(fixtures):
+    # the same, parsing the .ui file
+    return benchQtDialog(fixtures, "loadui")
+
+def checkImportBudget(result, budget):
+    '''Returns a list of problems with the import time of the silent path'''
+    problems = []
+    if result["p50"] > budget:
+        problems.append("importing lilass took %.3fs (p50), the budget is %.3fs" % (result["p50"], budget))
+    if result["toolkits"]:
+        problems.append("importing lilass loaded " + ", ".join(result["toolkits"]))
+    return problems
+
+## reporting
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=sourceDirectory, stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    print("%-20s %12s %12s %8s" % ("benchmark", "old p50", "new p50", "ratio"))
+    for name, result in new["results"].items():
+        if "p50" not in result or "p50" not in old["results"].get(name, {}):
+            continue # not run, or skipped
+        oldP50, newP50 = old["results"][name]["p50"], result["p50"]
+        print("%-20s %12.6f %12.6f %7.2fx" % (name, oldP50, newP50, newP50 / oldP50 if oldP50 else float("inf")))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks for lilass')
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help="Benchmarks to run (default: all of them): "+", ".join(benchmarks.keys()))
+    parser.add_argument("-n", "--runs", type=int, default=100,
+                        help="How often to run each benchmark (the cold start runs a tenth of that)")
+    parser.add_argument("--connectors", type=int, default=8,
+                        help="Number of external connectors in the synthetic xrandr dump")
+    parser.add_argument("--modes", type=int, default=300,
+                        help="Number of modes per connector in the synthetic xrandr dump")
+    parser.add_argument("--edid-extensions", type=int, default=1,
+                        help="Number of extension blocks of the synthetic EDIDs")
+    parser.add_argument("--xrandr-delay", type=float, default=0,
+                        help="Seconds the xrandr of the cold start takes for every call (a real one talks to the hardware)")
+    parser.add_argument("--db-rows", type=int, default=2000,
+                        help="Number of known screens in the database")
+    parser.add_argument("--import-budget", type=float, default=0.05,
+                        help="Fail if importing lilass for a silent run takes longer than this many seconds (p50)")
+    parser.add_argument("-o", "--output",
+                        help="Write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--compare", metavar="JSON",
+                        help="Compare the results with those in the given file")
+    args = parser.parse_args()
+
+    names = args.benchmarks or list(benchmarks.keys())
+    for name in names:
+        if name not in benchmarks:
+            parser.error("Unknown benchmark %s" % name)
+    fixtures = Fixtures(args)
+    results = collections.OrderedDict()
+    for name in names:
+        print("Running", name, file=sys.stderr)
+        results[name] = benchmarks[name](fixtures)
+    report = collections.OrderedDict([
+        ("commit", gitCommit()),
+        ("python", platform.python_version()),
+        ("machine", platform.machine()),
+        ("parameters", dict((key, getattr(args, key)) for key in ("runs", "connectors", "modes", "edid_extensions", "xrandr_delay", "db_rows"))),
+        ("results", results),
+    ])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    if "import-silent" in results:
+        problems = checkImportBudget(results["import-silent"], args.import_budget)
+        for problem in problems:
+            print("Import budget exceeded:", problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
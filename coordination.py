@@ -0,0 +1,148 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Coordinate lilass runs for the same display: A dock fires several events within a few hundred milliseconds, and
+# x-on-resize starts a lilass for each of them. Only one of them should set up the screens.
+
+'''
+Every run that wants the screens to be set up counts up the request counter (a file next to the lock file), and then tries to
+get the lock of the display. The run holding the lock does the work for everyone: It probes and applies right away, and
+repeats that as long as new requests came in meanwhile; before repeating, it waits until no request came in for a moment (the
+debounce window), so that a burst of requests is handled by one more round. Runs that do not get the lock hand off to the one
+holding it, and exit.
+
+After releasing the lock, the holder looks at the counter once more: A run may have counted up after the last check, but tried
+to get the lock before it was released. In that case, the holder takes the lock again (unless that run got it).
+
+The holder redoes the work with its own options, so a run may only hand off if its options are the same. The options are
+given as a <key>: every key has its own request counter, and the holder writes its key into the lock file while it holds the
+lock. A run with another key (e.g. `lilass -s -i` from a keybinding during a hotplug run) waits for the lock and does its own
+work.
+'''
+import fcntl, os, time, hashlib
+import util, tracing
+
+class RunLock:
+    '''The lock and request counter of a display, for runs with the options described by <key>'''
+    def __init__(self, display = None, directory = None, key = ""):
+        if display is None:
+            display = os.environ.get("DISPLAY", "")
+        if directory is None:
+            directory = util.getRuntimeDirectory()
+        util.mkdirP(directory)
+        name = "lilass-" + display.replace("/", "_")
+        self._lockPath = os.path.join(directory, name + ".lock")
+        if key:
+            name += "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        self._requestsPath = os.path.join(directory, name + ".requests")
+        self._key = key
+        self._lockFile = None
+
+    def acquire(self, blocking = True):
+        '''Returns whether we got the lock (which can only be False if not <blocking>)'''
+        assert self._lockFile is None
+        f = open(self._lockPath, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._lockFile = f
+        f.truncate(0)
+        f.write(self._key + "\n") # the newline says that the key is complete
+        f.flush()
+        return True
+
+    def release(self):
+        self._lockFile.truncate(0) # nobody must hand off to us any more
+        self._lockFile.close() # also releases the lock
+        self._lockFile = None
+
+    def _holderKey(self):
+        '''The key of the run holding the lock, or None if we do not know'''
+        try:
+            with open(self._lockPath) as f:
+                key = f.read()
+        except FileNotFoundError:
+            return None
+        return key[:-1] if key.endswith("\n") else None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+
+    def _openRequests(self):
+        fd = os.open(self._requestsPath, os.O_RDWR | os.O_CREAT, 0o600)
+        return os.fdopen(fd, "r+")
+
+    def request(self):
+        '''Count up the request counter, and return the new value'''
+        with self._openRequests() as f:
+            fcntl.flock(f, fcntl.LOCK_EX) # only held for a moment
+            value = int(f.read() or "0") + 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(value))
+        return value
+
+    def requests(self):
+        '''The current value of the request counter'''
+        with self._openRequests() as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return int(f.read() or "0")
+
+    def debounce(self, window, maxWait = 5):
+        '''Wait until there was no request for <window> seconds (but at most <maxWait> seconds), and return the request counter'''
+        seen = self.requests()
+        if window <= 0:
+            return seen
+        with tracing.span("debounce"):
+            deadline = time.monotonic() + maxWait
+            while time.monotonic() < deadline:
+                time.sleep(min(window, max(0, deadline - time.monotonic())))
+                now = self.requests()
+                if now == seen:
+                    break
+                tracing.count("coalesced-requests", now - seen)
+                seen = now
+        return seen
+
+    def run(self, work, rerun, window = 0, handOff = True):
+        '''Handle a request: If we get the lock (or, unless <handOff> and the holder has the same key, once we got it), call <work>
+           right away, and then <rerun> as long as other runs with the same key requested something meanwhile, each time after
+           waiting for the debounce <window>. Returns False if we handed off to another run holding the lock.'''
+        seen = self.request()
+        if not self.acquire(blocking = False):
+            if handOff and self._holderKey() == self._key:
+                return False
+            self.acquire()
+        func = work
+        while True:
+            try:
+                seen = self.requests() if func is work else self.debounce(window)
+                func()
+                func = rerun
+                while self.requests() != seen:
+                    seen = self.debounce(window)
+                    rerun()
+            finally:
+                self.release()
+            if self.requests() == seen or not self.acquire(blocking = False):
+                return True
@@ -0,0 +1,132 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Resident hotplug mode: wait for RandR output change notifications and handle them in the same process,
+# so that config, database and the parsed connector state stay warm between events.
+
+import collections, time, sys
+
+# An event source yields HotplugEvent objects. <output> and <connected> are None if unknown.
+HotplugEvent = collections.namedtuple("HotplugEvent", ["output", "connected"])
+
+class ScriptedEventSource:
+    '''Yields a pre-defined list of events, optionally with a delay in between. Used for testing.'''
+    def __init__(self, events, delay = 0):
+        self._events = list(events)
+        self._delay = delay
+
+    def __iter__(self):
+        for event in self._events:
+            if self._delay:
+                time.sleep(self._delay)
+            yield event
+
+class RandREventSource:
+    '''Yields an event whenever the X server tells us that the connection status of an output changed.'''
+    def __init__(self, display = None):
+        import xcffib, xcffib.randr
+        self._randr_mod = xcffib.randr
+        self._conn = xcffib.connect(display=display)
+        self._randr = self._conn(xcffib.randr.key)
+        self._randr.QueryVersion(1, 2).reply()
+        root = self._conn.get_setup().roots[self._conn.pref_screen].root
+        # We only care about connection changes, which come in as output change notifications.
+        # Mode and CRTC changes (e.g. caused by our own xrandr calls) also come in this way, we filter them below.
+        self._randr.SelectInput(root, xcffib.randr.NotifyMask.OutputChange)
+        self._conn.flush()
+        self._connection = {} # maps output IDs to their last known connection status
+
+    @staticmethod
+    def isAvailable():
+        try:
+            import xcffib, xcffib.randr
+            return True
+        except ImportError:
+            return False
+
+    def _toEvent(self, ev):
+        if not isinstance(ev, self._randr_mod.NotifyEvent) or ev.subCode != self._randr_mod.Notify.OutputChange:
+            return None
+        oc = ev.u.oc
+        connected = (oc.connection == self._randr_mod.Connection.Connected)
+        if self._connection.get(oc.output) == connected:
+            return None # nothing changed about the connection, e.g. just a new mode
+        self._connection[oc.output] = connected
+        return HotplugEvent(oc.output, connected)
+
+    def __iter__(self):
+        try:
+            while True:
+                event = self._toEvent(self._conn.wait_for_event())
+                if event is None:
+                    continue
+                # coalesce whatever else is already queued: one probe is enough for all of them
+                while True:
+                    ev = self._conn.poll_for_event()
+                    if ev is None:
+                        break
+                    event = self._toEvent(ev) or event
+                yield event
+        finally:
+            self._conn.disconnect()
+
+# get an event source; <name> is one of the keys of <eventSources>
+eventSources = collections.OrderedDict()
+eventSources["randr"] = RandREventSource
+
+def getEventSource(name = "randr", display = None):
+    if name not in eventSources:
+        raise Exception("Event source %s not found" % name)
+    if not eventSources[name].isAvailable():
+        raise Exception("Event source %s not available, please install xcffib" % name)
+    return eventSources[name](display)
+
+def connectorState(situation):
+    '''The part of the situation that a hotplug event can change'''
+    return tuple((c.name, c.isConnected(), c.edid) for c in situation.connectors)
+
+class Daemon:
+    '''Calls <probe> to obtain a ScreenSituation, and <handler> with that situation every time it differs from the last one.'''
+    def __init__(self, probe, handler):
+        self._probe = probe
+        self._handler = handler
+        self.situation = None # the last probed ScreenSituation
+        self._state = None
+
+    def handleEvent(self, event = None):
+        '''Returns whether the handler was called'''
+        situation = self._probe()
+        state = connectorState(situation)
+        self.situation = situation
+        if state == self._state:
+            return False # not a change we care about
+        self._handler(situation)
+        self._state = state # only remember this once it was handled successfully
+        return True
+
+    def run(self, source):
+        # handle the initial situation, then all the events
+        self._handleSafely(None)
+        for event in source:
+            self._handleSafely(event)
+
+    def _handleSafely(self, event):
+        # the daemon must survive errors, e.g. an unknown screen that cannot be handled
+        try:
+            self.handleEvent(event)
+        except Exception as e:
+            print("Error handling hotplug event {}: {}".format(event, e), file=sys.stderr)
@@ -1,13 +1,52 @@
 import sqlite3
-import os.path
-from binascii import hexlify, unhexlify
+import os.path, urllib.parse, threading, time
 from screen import ScreenSetup, Resolution, RelativeScreenPosition
+from edid import Edid, toEdid
+import tracing
 
 class InvalidDBFile(Exception):
     pass
 
+CURRENT_VERSION = 5
+BUSY_TIMEOUT = 10 # seconds to wait for another lilass to finish writing, before giving up with "database is locked"
+SEEN_INTERVAL = 24*60*60 # last_seen is only updated once it is this old (in seconds), so using the same screens all day writes once
+MAINTENANCE_INTERVAL = 7*24*60*60 # how often maintain() evicts and compacts
+MAX_ROWS = 1000 # default bound on the number of rows per table
+
+def edidFingerprint(b_edid):
+    '''The key of a binary EDID in the database, see Edid.fingerprint'''
+    return Edid(b_edid).fingerprint()
+
+# The queries we run; sqlite3 keeps them prepared, as long as we always use the same strings
+def _upsert(table, columns, key, condition = ""):
+    # like INSERT OR REPLACE, but keeps the columns that are not given (last_seen and use_count)
+    return """INSERT INTO %s (%s) VALUES (%s) ON CONFLICT(%s) DO UPDATE SET %s%s""" % (table, ", ".join(columns), ",".join("?" * len(columns)), key,
+        ", ".join("%s=excluded.%s" % (col, col) for col in columns if col != key), condition)
+
+_selectConfig = """SELECT resinternal, resexternal, mode, ext_is_primary, last_seen FROM known_configs WHERE fingerprint=?"""
+_configColumns = ("fingerprint", "edid", "resinternal", "resexternal", "mode", "ext_is_primary", "updated")
+_replaceConfig = _upsert("known_configs", _configColumns, "fingerprint")
+_selectLayout = """SELECT layout, last_seen FROM known_layouts WHERE screens=?"""
+_layoutColumns = ("screens", "layout", "updated")
+_replaceLayout = _upsert("known_layouts", _layoutColumns, "screens")
+_tables = (("known_configs", "fingerprint"), ("known_layouts", "screens")) # with their keys
+
+# How rows from elsewhere (see Database.importRows) are written if there already is a row with the same key:
+# "newest" keeps the row that was updated last, "local" keeps the row that is already there, "incoming" takes the new row.
+_conflictPolicies = ("newest", "local", "incoming")
+def _importStatement(table, columns, key, policy):
+    if policy == "local":
+        return """INSERT OR IGNORE INTO %s (%s) VALUES (%s)""" % (table, ", ".join(columns), ",".join("?" * len(columns)))
+    return _upsert(table, columns, key, """ WHERE excluded.updated > %s.updated""" % table if policy == "newest" else "")
+
+# When a row was used last, for eviction: rows that were written but not looked up since count as used back then
+_recency = """max(last_seen, updated)"""
+
 class Database:
-    def __init__(self, dbfilename):
+    '''The database of known screens. Use in a with-block; the connection stays open for the entire block.
+       If <readOnly> is set, the database is opened read-only, which is faster for just looking up a screen. If it turns out that we have to write
+       after all, the database is re-opened for writing.'''
+    def __init__(self, dbfilename, readOnly = False):
         self._create = False
         assert(os.path.isdir(os.path.dirname(dbfilename)))
         if not os.path.isfile(dbfilename):
@@ -16,22 +55,113 @@ class Database:
             # database will be created on __enter__ because we need a dbconnection for it
             self._create = True
         self._dbfilename = dbfilename
+        self._readOnly = readOnly
         self._connection = None
+        self._lock = threading.RLock()
+        self._seen = {} # maps (table, key) to the last_seen of the rows we looked up, see flushSeen
     def __enter__(self):
-        self._connection = sqlite3.connect(self._dbfilename)
+        with tracing.span("db-open", readOnly = self._readOnly), self._lock:
+            self._open()
+        return self
+    def _open(self):
+        if self._readOnly:
+            if self._create:
+                return # nothing to read, and we may not create the file
+            self._connection = sqlite3.connect("file:%s?mode=ro" % urllib.parse.quote(self._dbfilename), uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            self._c().execute("""PRAGMA mmap_size=1048576""") # the file is small, read it directly from the page cache
+            if not self._hasMeta():
+                # another lilass is just creating it
+                self._makeWritable()
+                return
+            dbversion = self._checkVersion()
+            if dbversion < CURRENT_VERSION:
+                # needs to be migrated first
+                self._makeWritable()
+            return
+        self._connection = sqlite3.connect(self._dbfilename, timeout=BUSY_TIMEOUT, check_same_thread=False) # may be opened in the background, see pipeline
         c = self._c()
+        c.execute("""PRAGMA journal_mode=WAL""") # cheaper commits, and readers do not block the writer
+        c.execute("""PRAGMA synchronous=NORMAL""") # safe with WAL
+        c.execute("""PRAGMA mmap_size=1048576""")
+        # another lilass may have created the file, but not the tables yet (or may be creating it right now)
+        self._create = not self._hasMeta()
+        if self._create:
+            c.execute("""BEGIN IMMEDIATE""")
+            if self._hasMeta():
+                # another lilass created it in the meantime
+                self._connection.commit()
+                self._create = False
         if self._create:
             c.execute("""CREATE TABLE meta (key text, value text, PRIMARY KEY(key))""")
-            c.execute("""INSERT INTO meta VALUES ('version', '1')""")
-            c.execute("""CREATE TABLE known_configs (edid blob, resinternal text, resexternal text, mode text, ext_is_primary integer, PRIMARY KEY(edid))""")
-            # edid in binary format
-            # resindernal, resexternal = "1024x768" or NULL if display is off
-            # mode: the enum text of screen.RelativeScreenPosition or NULL if one display is off
-        else: # check compatibility
-            dbversion = int(self._getMeta("version"))
-            if dbversion > 1:
-                raise InvalidDBFile("Database is too new: Version %d. Please update lilass." % dbversion)
-        return self
+            c.execute("""INSERT INTO meta VALUES ('version', ?)""", (str(CURRENT_VERSION),))
+            self._createConfigTable(c)
+            self._createLayoutTable(c)
+            self._connection.commit()
+            self._create = False
+        else:
+            dbversion = self._checkVersion()
+            if dbversion < CURRENT_VERSION:
+                # migrate all or nothing; take the write lock right away, so that we wait for other writers instead of failing later
+                c.execute("""BEGIN IMMEDIATE""")
+                dbversion = self._checkVersion() # another lilass may have migrated in the meantime
+            while dbversion < CURRENT_VERSION:
+                _migrations[dbversion](self, c)
+                dbversion += 1
+                c.execute("""UPDATE meta SET value=? WHERE key='version'""", (str(dbversion),))
+            self._connection.commit()
+    def _hasMeta(self):
+        return self._c().execute("""SELECT count(*) FROM sqlite_master WHERE type='table' AND name='meta'""").fetchone()[0] > 0
+    def _checkVersion(self):
+        dbversion = int(self._getMeta("version"))
+        if dbversion > CURRENT_VERSION:
+            raise InvalidDBFile("Database is too new: Version %d. Please update lilass." % dbversion)
+        return dbversion
+    def _createConfigTable(self, c):
+        c.execute("""CREATE TABLE known_configs (fingerprint text, edid blob, resinternal text, resexternal text, mode text, ext_is_primary integer, updated real NOT NULL DEFAULT 0, last_seen real NOT NULL DEFAULT 0, use_count integer NOT NULL DEFAULT 0, PRIMARY KEY(fingerprint))""")
+        # fingerprint: see edidFingerprint
+        # edid in binary format
+        # resindernal, resexternal = "1024x768" or NULL if display is off
+        # mode: the enum text of screen.RelativeScreenPosition or NULL if one display is off
+        # updated: when the row was written (seconds since the epoch), 0 if unknown
+        # last_seen: when the screen was last looked up, but only updated every SEEN_INTERVAL (see flushSeen); 0 if never
+        # use_count: how often last_seen was updated, i.e. roughly on how many days the screen was used
+    def _createLayoutTable(self, c):
+        c.execute("""CREATE TABLE known_layouts (screens text, layout text, updated real NOT NULL DEFAULT 0, last_seen real NOT NULL DEFAULT 0, use_count integer NOT NULL DEFAULT 0, PRIMARY KEY(screens))""")
+        # screens: the sorted keys of all connected screens, see layout.layoutKey
+        # layout: the placements as JSON, see layout.forDatabase
+        # updated, last_seen, use_count: see known_configs
+    def _migrateFrom1(self, c):
+        # version 1 used the full EDID as key
+        c.execute("""ALTER TABLE known_configs RENAME TO known_configs_v1""")
+        self._createConfigTable(c)
+        rows = c.execute("""SELECT edid, resinternal, resexternal, mode, ext_is_primary FROM known_configs_v1""").fetchall()
+        c.executemany(_replaceConfig, ((edidFingerprint(row[0]),) + tuple(row) + (0,) for row in rows))
+        c.execute("""DROP TABLE known_configs_v1""")
+    def _migrateFrom2(self, c):
+        # version 2 did not know about layouts with more than two screens
+        self._createLayoutTable(c)
+    def _migrateFrom3(self, c):
+        # version 3 did not record when a row was written (the tables created by the migrations above already have the column)
+        for table in ("known_configs", "known_layouts"):
+            if "updated" not in [row[1] for row in c.execute("""PRAGMA table_info(%s)""" % table)]:
+                c.execute("""ALTER TABLE %s ADD COLUMN updated real NOT NULL DEFAULT 0""" % table)
+    def _migrateFrom4(self, c):
+        # version 4 did not track which screens are still in use; we do not know when the existing rows were used last, so
+        # they all get a fresh start
+        for table, key in _tables:
+            columns = [row[1] for row in c.execute("""PRAGMA table_info(%s)""" % table)]
+            if "last_seen" not in columns:
+                c.execute("""ALTER TABLE %s ADD COLUMN last_seen real NOT NULL DEFAULT 0""" % table)
+                c.execute("""ALTER TABLE %s ADD COLUMN use_count integer NOT NULL DEFAULT 0""" % table)
+            c.execute("""UPDATE %s SET last_seen=?""" % table, (time.time(),))
+    def _makeWritable(self):
+        if not self._readOnly:
+            return
+        if self._connection:
+            self._connection.close()
+            self._connection = None
+        self._readOnly = False
+        self._open()
     def _getMeta(self, key):
         c = self._c()
         c.execute("""SELECT value FROM meta WHERE key=?""", (key,))
@@ -42,31 +172,190 @@ class Database:
         assert len(got) == 1
         return got[0]
     def putConfig(self, extconn_edid, conf):
-        c = self._c()
-        b_edid = unhexlify(extconn_edid)
-        intres = conf.intResolution.forDatabase() if conf.intResolution else None
-        extres = conf.extResolution.forDatabase() if conf.extResolution else None
-        mode = conf.relPosition.text if conf.relPosition else None
-        extprim = int(conf.extIsPrimary) # False => 0, True => 1
-        c.execute("""INSERT OR REPLACE INTO known_configs VALUES (?,?,?,?,?)""", (b_edid, intres, extres, mode, extprim))
+        with self._lock: # the connection may be shared by several threads, see multiseat
+            self._makeWritable()
+            extconn_edid = toEdid(extconn_edid) # an Edid, or its hex text
+            intres = conf.intResolution.forDatabase() if conf.intResolution else None
+            extres = conf.extResolution.forDatabase() if conf.extResolution else None
+            mode = conf.relPosition.text if conf.relPosition else None
+            extprim = int(conf.extIsPrimary) # False => 0, True => 1
+            self._connection.execute(_replaceConfig, (extconn_edid.fingerprint(), extconn_edid.data, intres, extres, mode, extprim, time.time()))
+            self._connection.commit() # the database may stay open for a long time (e.g. in daemon mode)
     def getConfig(self, extconn_edid):
-        c = self._c()
-        b_edid = unhexlify(extconn_edid)
-        c.execute("""SELECT * FROM known_configs WHERE edid=?""", (b_edid,))
-        result = c.fetchone()
-        if result is None:
-            return None
-        assert c.fetchone() is None # uniqueness
-        _, intres, extres, mode, extprim = result
-        intres = Resolution.fromDatabase(intres) # this method is safe for NULLs
-        extres = Resolution.fromDatabase(extres)
-        mode = RelativeScreenPosition(mode) if mode else None
-        extprim = bool(extprim) # 0 => False, 1 => True
-        return ScreenSetup(intres, extres, mode, extprim)
-    def __exit__(self, type, value, tb):
-        if self._connection:
+        with self._lock:
+            if self._connection is None:
+                assert self._readOnly and self._create
+                return None # the database does not exist yet
+            fingerprint = toEdid(extconn_edid).fingerprint()
+            result = self._connection.execute(_selectConfig, (fingerprint,)).fetchone()
+            if result is None:
+                return None
+            tracing.count("db-rows-read")
+            intres, extres, mode, extprim, self._seen[("known_configs", fingerprint)] = result
+            intres = Resolution.fromDatabase(intres) # this method is safe for NULLs
+            extres = Resolution.fromDatabase(extres)
+            mode = RelativeScreenPosition(mode) if mode else None
+            extprim = bool(extprim) # 0 => False, 1 => True
+            return ScreenSetup(intres, extres, mode, extprim)
+    def putLayout(self, screens, layout):
+        with self._lock:
+            self._makeWritable()
+            self._connection.execute(_replaceLayout, (screens, layout, time.time()))
             self._connection.commit()
-            self._connection.close()
+    def getLayout(self, screens):
+        with self._lock:
+            if self._connection is None:
+                assert self._readOnly and self._create
+                return None # the database does not exist yet
+            result = self._connection.execute(_selectLayout, (screens,)).fetchone()
+            if result is None:
+                return None
+            tracing.count("db-rows-read")
+            self._seen[("known_layouts", screens)] = result[1]
+            return result[0]
+    def flushSeen(self, now = None):
+        '''Record that the rows looked up so far were used. Call this after applying the setup: it only writes if some row was
+           not seen for SEEN_INTERVAL, but then it has to re-open a read-only database.'''
+        if now is None:
+            now = time.time()
+        with self._lock:
+            due = [(table, key) for (table, key), lastSeen in self._seen.items() if now - lastSeen >= SEEN_INTERVAL]
+            self._seen.clear()
+            if not due:
+                return
+            self._makeWritable()
+            for table, key in due:
+                self._connection.execute("""UPDATE %s SET last_seen=?, use_count=use_count+1 WHERE %s=?""" % (table, dict(_tables)[table]), (now, key))
+            self._connection.commit()
+            tracing.count("db-rows-seen", len(due))
+    def evict(self, maxRows = MAX_ROWS, maxAge = None, now = None):
+        '''Delete the rows not used for <maxAge> seconds, and then the least recently used ones until every table has at most
+           <maxRows> rows (of two rows last used on the same day, the one used less often goes first). None means no bound.
+           Returns the number of rows deleted.'''
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._connection is None:
+                return 0
+            self._makeWritable()
+            before = self._connection.total_changes
+            c = self._c()
+            c.execute("""BEGIN IMMEDIATE""")
+            for table, key in _tables:
+                if maxAge is not None:
+                    c.execute("""DELETE FROM %s WHERE %s < ?""" % (table, _recency), (now - maxAge,))
+                if maxRows is not None:
+                    c.execute("""DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s ORDER BY CAST(%s / %d AS integer), use_count, %s LIMIT max(0, (SELECT count(*) FROM %s) - ?))"""
+                              % (table, table, _recency, SEEN_INTERVAL, _recency, table), (maxRows,))
+            self._connection.commit()
+            evicted = self._connection.total_changes - before
+            tracing.count("db-rows-evicted", evicted)
+            return evicted
+    def compact(self):
+        '''Give the space of deleted rows back to the file system, and update the statistics of the query planner. This takes a
+           while and blocks other lilass runs, so do not do it while someone waits for their screens.'''
+        with self._lock:
+            if self._connection is None:
+                return
+            self._makeWritable()
+            with tracing.span("db-compact"):
+                self._connection.execute("""ANALYZE""")
+                self._connection.execute("""VACUUM""")
+                self._connection.execute("""PRAGMA wal_checkpoint(TRUNCATE)""")
+    def maintain(self, maxRows = MAX_ROWS, maxAge = None, interval = MAINTENANCE_INTERVAL, now = None):
+        '''Evict and compact (see evict and compact) if that was not done for <interval> seconds. Returns the number of rows
+           deleted, or None if it was not time yet.'''
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._connection is None:
+                return None
+            try:
+                last = float(self._getMeta("maintained"))
+            except KeyError:
+                last = 0
+            if now - last < interval:
+                return None
+            evicted = self.evict(maxRows, maxAge, now)
+            self._connection.execute("""INSERT OR REPLACE INTO meta VALUES ('maintained', ?)""", (str(now),))
+            self._connection.commit()
+            self.compact()
+            return evicted
+    def exportRows(self, batchSize = 1000):
+        '''Yields all rows as dicts that can be turned into JSON, see importRows'''
+        if self._connection is None:
+            return # the database does not exist yet
+        for table, kind, columns in (("known_configs", "config", _configColumns), ("known_layouts", "layout", _layoutColumns)):
+            cursor = self._c()
+            with self._lock:
+                cursor.execute("""SELECT %s FROM %s ORDER BY %s""" % (", ".join(columns), table, columns[0]))
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batchSize)
+                if not rows:
+                    break
+                for row in rows:
+                    result = dict(zip(columns, row))
+                    result["type"] = kind
+                    if kind == "config":
+                        result["edid"] = result["edid"].hex()
+                    yield result
+    def importRows(self, rows, policy = "newest", batchSize = 1000):
+        '''Writes the <rows> (dicts as returned by exportRows), <batchSize> of them in one transaction. <policy> says what to do if
+           there already is a row for the same screen(s), see _conflictPolicies. Returns the number of rows written and skipped.
+           The rows written count as seen now, so that evict() does not throw them away right after they were imported.'''
+        if policy not in _conflictPolicies:
+            raise Exception("Unknown conflict policy %s, must be one of: %s" % (policy, ", ".join(_conflictPolicies)))
+        statements = {
+            "config": _importStatement("known_configs", _configColumns + ("last_seen",), "fingerprint", policy),
+            "layout": _importStatement("known_layouts", _layoutColumns + ("last_seen",), "screens", policy),
+        }
+        now = time.time()
+        written = total = 0
+        rows = iter(rows)
+        with self._lock:
+            self._makeWritable()
+        while True:
+            batch = {"config": [], "layout": []}
+            count = 0
+            for row in rows:
+                if row.get("type") == "config":
+                    edid = Edid.fromHex(row["edid"])
+                    batch["config"].append((edid.fingerprint(), edid.data, row["resinternal"], row["resexternal"], row["mode"],
+                                            int(row["ext_is_primary"]), row.get("updated", 0), now))
+                elif row.get("type") == "layout":
+                    batch["layout"].append(tuple(row.get(col, 0) if col == "updated" else row[col] for col in _layoutColumns) + (now,))
+                else:
+                    raise InvalidDBFile("Unknown row type: %s" % row.get("type"))
+                count += 1
+                if count >= batchSize:
+                    break
+            if not count:
+                return (written, total - written)
+            with self._lock:
+                before = self._connection.total_changes
+                c = self._c()
+                c.execute("""BEGIN IMMEDIATE""")
+                for kind, values in batch.items():
+                    c.executemany(statements[kind], values)
+                self._connection.commit()
+                written += self._connection.total_changes - before
+            total += count
+            tracing.count("db-rows-imported", count)
+    def __exit__(self, type, value, tb):
+        with self._lock:
+            if self._connection:
+                self._connection.commit()
+                self._connection.close()
+                self._connection = None
     def _c(self):
         assert(self._connection)
         return self._connection.cursor()
+
+# maps a database version to the function migrating it to the next version
+_migrations = {
+    1: Database._migrateFrom1,
+    2: Database._migrateFrom2,
+    3: Database._migrateFrom3,
+    4: Database._migrateFrom4,
+}
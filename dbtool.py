@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Export, import and merge databases of known screens, e.g. to give new laptops the setups for all conference-room screens,
+# or to collect what the laptops learned in a master copy:
+#   ./dbtool.py export -o screens.jsonl                       (the database of the current user)
+#   ./dbtool.py import screens.jsonl --conflict local
+#   ./dbtool.py merge master.sqlite laptop1.sqlite laptop2.sqlite screens.jsonl
+#   ./dbtool.py maintain --max-rows 200 --max-age 365          (lilass does this once a week, with the limits from its config)
+
+'''
+The exchange format has one JSON object per line and row, so it can be streamed, concatenated and filtered with the usual tools:
+
+  {"type": "config", "edid": "00ffffffffffff00...", "resinternal": "1366x768", "resexternal": "1920x1200", "mode": "left of",
+   "ext_is_primary": 0, "updated": 1700000000.0, "fingerprint": "DEL-a07a-..."}
+  {"type": "layout", "screens": "...", "layout": "[...]", "updated": 1700000000.0}
+
+"updated" is when the row was written (0 if that is unknown), and decides which row wins with --conflict newest. The
+fingerprint is only informational, it is computed from the EDID on import.
+'''
+import argparse, contextlib, json, os, sys, sqlite3, tempfile, urllib.parse
+import database, util
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+def defaultDatabase():
+    return os.path.join(util.getDataDirectory(), "collected_data.sqlite")
+
+def readJsonLines(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def isDatabase(path):
+    with open(path, "rb") as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+@contextlib.contextmanager
+def readDatabase(path):
+    '''Opens a copy of the database in <path>: an older database has to be upgraded before we can read it, but we do not want
+       to change it'''
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "copy.sqlite")
+        with contextlib.closing(sqlite3.connect("file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(path)), uri=True)) as source, \
+             contextlib.closing(sqlite3.connect(copy)) as target:
+            source.backup(target) # also picks up what is still in the write-ahead log
+        with database.Database(copy, readOnly = True) as db:
+            yield db
+
+def importSource(db, path, policy, batchSize):
+    '''Import a database file or a JSON-lines file (- for stdin) into <db>; returns the number of rows written and skipped'''
+    if path == "-":
+        return db.importRows(readJsonLines(sys.stdin), policy, batchSize)
+    if isDatabase(path):
+        with readDatabase(path) as source:
+            return db.importRows(source.exportRows(batchSize), policy, batchSize)
+    with open(path) as f:
+        return db.importRows(readJsonLines(f), policy, batchSize)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export, import and merge databases of known screens')
+    parser.add_argument("-d", "--database", default=None,
+                        help="The database to work on (default: the one lilass uses)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Number of rows written in one transaction")
+    subparsers = parser.add_subparsers(dest="command")
+    exportParser = subparsers.add_parser("export", help="Write all rows as JSON lines")
+    exportParser.add_argument("-o", "--output",
+                              help="The file to write to (default: stdout)")
+    for name, help in (("import", "Import JSON-lines files or databases into the database"),
+                       ("merge", "Combine several JSON-lines files or databases into TARGET")):
+        subparser = subparsers.add_parser(name, help=help)
+        if name == "merge":
+            subparser.add_argument("target", metavar="TARGET",
+                                   help="The database to merge into; it is created if it does not exist")
+        subparser.add_argument("sources", nargs="+", metavar="SOURCE",
+                               help="JSON-lines files (- for stdin) or databases; later ones are imported after earlier ones")
+        subparser.add_argument("--conflict", choices=database._conflictPolicies, default="newest",
+                               help="Which row to keep if both have one for the same screen: the one written last (default), the one "
+                                    "that is already there, or the imported one")
+    maintainParser = subparsers.add_parser("maintain", help="Forget screens that were not used for a while, and compact the database")
+    maintainParser.add_argument("--max-rows", type=int, default=database.MAX_ROWS,
+                                help="Keep at most this many screens (and layouts), the ones used most recently (default: %d)" % database.MAX_ROWS)
+    maintainParser.add_argument("--max-age", type=int, metavar="DAYS",
+                                help="Forget the screens not used for this many days")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("Please give a command")
+
+    if args.command == "merge":
+        path = args.target
+    else:
+        path = args.database or defaultDatabase()
+    path = os.path.abspath(path)
+    if args.command == "export":
+        if not os.path.exists(path):
+            sys.exit("Database %s does not exist" % path)
+        with readDatabase(path) as db, (open(args.output, "w") if args.output else sys.stdout) as out:
+            for row in db.exportRows(args.batch_size):
+                out.write(json.dumps(row) + "\n")
+    elif args.command == "maintain":
+        if not os.path.exists(path):
+            sys.exit("Database %s does not exist" % path)
+        with database.Database(path) as db:
+            evicted = db.maintain(args.max_rows, args.max_age * 24*60*60 if args.max_age is not None else None, interval = 0)
+        print("%d rows deleted" % evicted, file=sys.stderr)
+    else:
+        util.mkdirP(os.path.dirname(path))
+        with database.Database(path) as db:
+            for source in args.sources:
+                written, skipped = importSource(db, source, args.conflict, args.batch_size)
+                print("%s: %d rows written, %d kept as they were" % (source, written, skipped), file=sys.stderr)
@@ -0,0 +1,186 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# The EDID a screen sends to describe itself. Connectors carry it as an Edid object, which keeps the bytes once and decodes
+# them when asked.
+
+'''
+Layout of an EDID (see the VESA E-EDID standard): a base block of 128 bytes, followed by as many extension blocks of 128 bytes as
+byte 126 says. Every block ends with a checksum byte, which makes the sum of the block 0 (mod 256).
+
+  0-7    header 00 ff ff ff ff ff ff 00
+  8-9    manufacturer: three letters of 5 bits each (big-endian)
+  10-11  product code (little-endian)
+  12-15  serial number (little-endian)
+  21-22  physical size in cm
+  54-125 four descriptors of 18 bytes: a detailed timing if the first two bytes (the pixel clock) are not 0, otherwise a
+         display descriptor (0xfc: the monitor name, 0xff: the serial number as text)
+  126    number of extension blocks
+'''
+import collections, hashlib, struct
+from binascii import unhexlify
+
+BLOCK_SIZE = 128
+HEADER = b"\x00\xff\xff\xff\xff\xff\xff\x00"
+
+# a detailed timing: the resolution (width, height), the refresh rate in Hz, and the physical size in mm (0 if unknown)
+DetailedTiming = collections.namedtuple("DetailedTiming", ["width", "height", "refreshRate", "widthMm", "heightMm"])
+
+def _detailedTiming(d):
+    clock = struct.unpack_from("<H", d, 0)[0] * 10000 # in Hz
+    width, hblank = d[2] | ((d[4] & 0xf0) << 4), d[3] | ((d[4] & 0x0f) << 8)
+    height, vblank = d[5] | ((d[7] & 0xf0) << 4), d[6] | ((d[7] & 0x0f) << 8)
+    widthMm, heightMm = d[12] | ((d[14] & 0xf0) << 4), d[13] | ((d[14] & 0x0f) << 8)
+    total = (width + hblank) * (height + vblank)
+    refreshRate = clock / total if total else 0
+    if d[17] & 0x80: # interlaced: the timing describes a field, i.e., half of the lines
+        height *= 2
+    return DetailedTiming(width, height, refreshRate, widthMm, heightMm)
+
+def _descriptorText(d):
+    return d[5:18].split(b"\n", 1)[0].decode("latin-1").rstrip()
+
+class Edid:
+    '''The EDID of a screen, given as bytes. Everything is decoded on first use.'''
+    __slots__ = ("data", "_hex", "_fingerprint", "_decoded")
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self._hex = None
+        self._fingerprint = None
+        self._decoded = None
+
+    @staticmethod
+    def fromHex(text):
+        '''Parses the EDID as hex text (str or bytes), as xrandr prints it'''
+        return Edid(unhexlify(text))
+
+    def hex(self):
+        if self._hex is None:
+            self._hex = self.data.hex()
+        return self._hex
+
+    def __eq__(self, other):
+        return isinstance(other, Edid) and self.data == other.data
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "<Edid %s>" % self.fingerprint()
+
+    def fingerprint(self):
+        '''A compact key: vendor, product code and serial number (to make it readable), and a hash of the entire EDID (to make it unique)'''
+        if self._fingerprint is None:
+            if len(self.data) >= 16:
+                vendor, product, serial = self.vendor(), self.product(), self.serial()
+            else:
+                vendor, product, serial = "???", 0, 0
+            self._fingerprint = "%s-%04x-%08x-%s" % (vendor, product, serial, hashlib.sha1(self.data).hexdigest()[:16])
+        return self._fingerprint
+
+    # the decoded base block
+
+    def _decode(self):
+        if self._decoded is None:
+            d = self.data
+            timings, texts = [], {}
+            for offset in range(54, 126 if len(d) >= 126 else 54, 18): # nothing to decode in a truncated EDID
+                descriptor = d[offset:offset+18]
+                if descriptor[0] or descriptor[1]:
+                    timings.append(_detailedTiming(descriptor))
+                elif descriptor[3] in (0xfc, 0xff, 0xfe):
+                    texts.setdefault(descriptor[3], _descriptorText(descriptor))
+            self._decoded = (timings, texts)
+        return self._decoded
+
+    # Truncated EDIDs (e.g. from a flaky cable) are decoded as far as they go; what is missing is None. We never reject an EDID
+    # because of its checksums: some screens get them wrong, and their EDID still identifies them. isValid only reports it
+    # (see audit.py).
+
+    def isValid(self):
+        '''Whether this looks like an EDID at all: the header is there, and the checksums of all blocks are correct'''
+        return self.data.startswith(HEADER) and self.checksumValid()
+
+    def checksumValid(self):
+        d = self.data
+        return len(d) >= BLOCK_SIZE and len(d) % BLOCK_SIZE == 0 and all(sum(d[i:i+BLOCK_SIZE]) & 0xff == 0 for i in range(0, len(d), BLOCK_SIZE))
+
+    def vendor(self):
+        '''The three-letter manufacturer ID, e.g. "DEL"'''
+        if len(self.data) < 10:
+            return None
+        manufacturer = (self.data[8] << 8) | self.data[9]
+        return "".join(chr(64 + ((manufacturer >> shift) & 0x1f)) for shift in (10, 5, 0))
+
+    def product(self):
+        return struct.unpack_from("<H", self.data, 10)[0] if len(self.data) >= 12 else None
+
+    def serial(self):
+        return struct.unpack_from("<I", self.data, 12)[0] if len(self.data) >= 16 else None
+
+    def name(self):
+        '''The monitor name, or None if the EDID does not say'''
+        return self._decode()[1].get(0xfc)
+
+    def serialText(self):
+        '''The serial number as text, or None if the EDID does not say'''
+        return self._decode()[1].get(0xff)
+
+    def detailedTimings(self):
+        '''The detailed timings of the base block; the first one is the native mode of the screen'''
+        return self._decode()[0]
+
+    def nativeTiming(self):
+        '''The detailed timing of the native (preferred) mode, or None'''
+        timings = self.detailedTimings()
+        return timings[0] if timings else None
+
+    def physicalSize(self):
+        '''The size of the screen as (width, height) in mm, or None if unknown (e.g. a projector)'''
+        native = self.nativeTiming()
+        if native is not None and native.widthMm and native.heightMm:
+            return (native.widthMm, native.heightMm)
+        if len(self.data) > 22 and self.data[21] and self.data[22]:
+            return (self.data[21] * 10, self.data[22] * 10) # only in cm
+        return None
+
+    # extension blocks
+
+    def extensionCount(self):
+        '''The number of extension blocks, as the base block says'''
+        return self.data[126] if len(self.data) > 126 else 0
+
+    def extensionBlocks(self):
+        '''The extension blocks that are actually there (the probe may have cut off some), each as bytes'''
+        return [self.data[i:i+BLOCK_SIZE] for i in range(BLOCK_SIZE, len(self.data) - BLOCK_SIZE + 1, BLOCK_SIZE)]
+
+    def extensionTags(self):
+        '''The types of the extension blocks, e.g. 0x02 for CEA-861'''
+        return [block[0] for block in self.extensionBlocks()]
+
+def toEdid(value):
+    '''Accepts an Edid, its bytes, or its hex text'''
+    if value is None or isinstance(value, Edid):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return Edid(value)
+    return Edid.fromHex(value)
@@ -28,32 +28,56 @@ def setup(internalResolutions, externalResolutions):
     The user should be asked about his display setup preferences.
     The function returns None if the user cancelled, and an instance of dsl.ScreenSetup otherwise.
 '''
-import collections
+import collections, importlib, importlib.util, shutil
+import tracing
 
-from qt_frontend import QtFrontend
-from cli_frontend import CLIFrontend
-from zenity_frontend import ZenityFrontend
+# Importing a frontend may load a whole GUI toolkit, and constructing it may connect to the X server. Both are only done when the
+# frontend is actually needed, so that the common case (applying a known setup without asking) does not pay for them.
 
-
-# list of available frontends
+# list of available frontends: maps names to the module and class implementing them, and a cheap check for their availability
 frontends = collections.OrderedDict()
-frontends["qt"] = QtFrontend
-frontends["zenity"] = ZenityFrontend
-frontends["cli"] = CLIFrontend
+frontends["qt"] = ("qt_frontend", "QtFrontend", lambda: importlib.util.find_spec("PyQt5") is not None)
+frontends["zenity"] = ("zenity_frontend", "ZenityFrontend", lambda: shutil.which("zenity") is not None)
+frontends["cli"] = ("cli_frontend", "CLIFrontend", lambda: True)
+
+_available = {} # cache for the availability checks
+def isAvailable(name):
+    if name not in _available:
+        _available[name] = frontends[name][2]()
+    return _available[name]
+
+class LazyFrontend:
+    '''Stands in for the frontend with the given name, and creates it on first use'''
+    def __init__(self, name):
+        self.name = name
+        self._frontend = None
+
+    def get(self):
+        if self._frontend is None:
+            moduleName, className, _ = frontends[self.name]
+            with tracing.span("frontend-load", frontend = self.name):
+                self._frontend = getattr(importlib.import_module(moduleName), className)() # call constructor
+        return self._frontend
+
+    def error(self, message):
+        self.get().error(message)
+
+    def setup(self, situation):
+        return self.get().setup(situation)
 
 # get a frontend
 def getFrontend(name = None):
     # by name
     if name is not None:
         if name in frontends:
-            if frontends[name].isAvailable():
-                return frontends[name]() # call constructor
+            if isAvailable(name):
+                return LazyFrontend(name)
             else:
                 raise Exception("Frontend %s not available" % name)
         # frontend not found
         raise Exception("Frontend %s not found" % name)
     # auto-detect
-    for frontend in frontends.values():
-        if frontend.isAvailable():
-            return frontend() # call constructor
+    for name in frontends:
+        if isAvailable(name):
+            return LazyFrontend(name)
     raise Exception("No frontend is available - this should not happen")
@@ -0,0 +1,218 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Setups for any number of screens (e.g. a laptop in a dock with several external screens), as opposed to the
+# one internal and one external screen of a screen.ScreenSetup.
+
+'''
+A layout is a list of placements, one for every screen that is to be on:
+
+  Placement("eDP-1", Resolution(1920, 1080), None, None)
+  Placement("DP-1-1", Resolution(2560, 1440), RelativeScreenPosition.RIGHT, "eDP-1")
+  Placement("DP-1-2", None, RelativeScreenPosition.RIGHT, "DP-1-1")
+
+The first screen is the primary one. A resolution of None means the preferred resolution of the screen. solve() computes the
+absolute positions, which are applied in a single xrandr call: That is one modeset and one framebuffer resize, no matter how
+many screens there are.
+
+On the command line, a placement is written as NAME[@WxH][:POSITION:OTHER], e.g. "DP-1-2:right:DP-1-1".
+In the database, layouts are stored by the set of connected screens (see layoutKey), with the connector names replaced by the
+screens' keys, so the layout is found again if the screens are plugged into different connectors.
+'''
+import collections, json
+from screen import Resolution, RelativeScreenPosition
+
+Placement = collections.namedtuple("Placement", ["name", "resolution", "relPosition", "relativeTo"])
+
+class Layout:
+    '''A setup for any number of screens'''
+    def __init__(self, placements):
+        self.placements = list(placements)
+        if not self.placements:
+            raise Exception("A layout needs at least one screen.")
+        names = set()
+        for p in self.placements:
+            if p.name in names:
+                raise Exception("Screen %s is part of the layout more than once." % p.name)
+            names.add(p.name)
+            if (p.relPosition is None) != (p.relativeTo is None):
+                raise Exception("Screen %s needs both a position and another screen to be relative to." % p.name)
+        for p in self.placements:
+            if p.relativeTo is not None and p.relativeTo not in names:
+                raise Exception("Screen %s is placed relative to %s, which is not part of the layout." % (p.name, p.relativeTo))
+
+    def primary(self):
+        return self.placements[0].name
+
+    def resolutions(self, situation):
+        '''Maps the connector names to the resolution they are going to use'''
+        result = collections.OrderedDict()
+        for p in self.placements:
+            connector = situation.connectorByName(p.name)
+            if connector is None or not connector.isConnected():
+                raise Exception("There is no screen connected to %s." % p.name)
+            if p.resolution is None:
+                result[p.name] = connector.getPreferredResolution()
+            elif p.resolution in connector.getResolutionList():
+                result[p.name] = p.resolution
+            else:
+                raise Exception("Screen %s does not support %s." % (p.name, p.resolution))
+        return result
+
+    def isPossible(self, situation):
+        '''Whether all screens of the layout are connected, and support the resolutions it wants'''
+        for p in self.placements:
+            connector = situation.connectorByName(p.name)
+            if connector is None or not connector.isConnected():
+                return False
+            if p.resolution is not None and p.resolution not in connector.getResolutionList():
+                return False
+        return True
+
+    def solve(self, situation):
+        '''Computes the absolute positions: Maps the connector names to (x, y), such that the top-left corner is at (0, 0)'''
+        return solve(self.placements, self.resolutions(situation))
+
+    def targetState(self, situation):
+        '''What the connectors should be doing, see ScreenSituation.targetState'''
+        resolutions = self.resolutions(situation)
+        positions = solve(self.placements, resolutions)
+        target = dict((c.name, None) for c in situation.connectors)
+        for name, position in positions.items():
+            target[name] = (resolutions[name], position, name == self.primary())
+        return target
+
+    def __str__(self):
+        return ", ".join(formatPlacement(p) for p in self.placements)
+
+def _overlaps(a, b):
+    (ax, ay, aw, ah), (bx, by, bw, bh) = a, b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
+
+def solve(placements, resolutions):
+    '''Computes the absolute positions of the <placements>, given the resolution of every screen. A screen placed next to another one
+       is moved further in that direction until it does not overlap with any screen placed before, so "A left of C" and "B left of C"
+       puts B left of A.'''
+    rects = collections.OrderedDict() # maps names to (x, y, width, height)
+    pending = list(placements)
+    while pending:
+        progress = False
+        for p in list(pending):
+            w, h = resolutions[p.name].toTuple()
+            if p.relativeTo is None:
+                # right of everything placed so far
+                x, y = max([0] + [rx + rw for (rx, ry, rw, rh) in rects.values()]), 0
+            elif p.relativeTo in rects:
+                rx, ry, rw, rh = rects[p.relativeTo]
+                x, y = {
+                        RelativeScreenPosition.LEFT  : (rx - w, ry),
+                        RelativeScreenPosition.RIGHT : (rx + rw, ry),
+                        RelativeScreenPosition.ABOVE : (rx, ry - h),
+                        RelativeScreenPosition.BELOW : (rx, ry + rh),
+                        RelativeScreenPosition.MIRROR: (rx, ry),
+                    }[p.relPosition]
+            else:
+                continue # wait for the other screen to be placed
+            if p.relPosition != RelativeScreenPosition.MIRROR:
+                moved = True
+                while moved:
+                    moved = False
+                    for (ox, oy, ow, oh) in rects.values():
+                        if not _overlaps((x, y, w, h), (ox, oy, ow, oh)):
+                            continue
+                        if p.relPosition == RelativeScreenPosition.LEFT:
+                            x = ox - w
+                        elif p.relPosition == RelativeScreenPosition.ABOVE:
+                            y = oy - h
+                        elif p.relPosition == RelativeScreenPosition.BELOW:
+                            y = oy + oh
+                        else: # RIGHT, or no position at all
+                            x = ox + ow
+                        moved = True
+            rects[p.name] = (x, y, w, h)
+            pending.remove(p)
+            progress = True
+        if not progress:
+            raise Exception("The positions of %s depend on each other." % ", ".join(p.name for p in pending))
+    # move everything to the top-left corner
+    minX = min(x for (x, y, w, h) in rects.values())
+    minY = min(y for (x, y, w, h) in rects.values())
+    # keep the order of the placements
+    return collections.OrderedDict((p.name, (rects[p.name][0] - minX, rects[p.name][1] - minY)) for p in placements)
+
+## parsing and formatting
+
+def _relPosByName(name):
+    for relPos in RelativeScreenPosition:
+        if relPos.name.lower() == name:
+            return relPos
+    raise Exception("Unknown position %s, must be one of: %s" % (name, ", ".join(r.name.lower() for r in RelativeScreenPosition)))
+
+def parsePlacement(spec):
+    '''Parses NAME[@WxH][:POSITION:OTHER]'''
+    parts = spec.split(":")
+    if len(parts) not in (1, 3):
+        raise Exception("Invalid screen placement %s, must be NAME[@WxH][:POSITION:OTHER]" % spec)
+    name, sep, resolution = parts[0].partition("@")
+    resolution = Resolution.fromDatabase(resolution) if sep else None
+    if len(parts) == 1:
+        return Placement(name, resolution, None, None)
+    return Placement(name, resolution, _relPosByName(parts[1]), parts[2])
+
+def formatPlacement(p):
+    result = p.name
+    if p.resolution is not None:
+        result += "@" + p.resolution.forXrandr()
+    if p.relPosition is not None:
+        result += ":%s:%s" % (p.relPosition.name.lower(), p.relativeTo)
+    return result
+
+## the database
+
+def screenKey(connector):
+    '''Identifies the screen connected to <connector>: By its EDID if it has one, and by the connector name otherwise'''
+    if connector.edid:
+        return connector.edid.fingerprint()
+    return "connector:" + connector.name
+
+def screenKeys(connectors):
+    '''Maps the names of the <connectors> to the keys of their screens. Identical screens (e.g. two screens of the same model,
+       whose EDIDs often do not have a serial number) are told apart by counting them in the order of the connector names.'''
+    keys = {}
+    counts = collections.Counter()
+    for c in sorted(connectors, key=lambda c: c.name):
+        key = screenKey(c)
+        counts[key] += 1
+        keys[c.name] = key if counts[key] == 1 else "%s#%d" % (key, counts[key])
+    return keys
+
+def layoutKey(connectors):
+    '''The key of a set of connected screens in the database'''
+    return ",".join(sorted(screenKeys(connectors).values()))
+
+def forDatabase(layout, situation):
+    '''Returns the key and the text to store the layout in the database'''
+    keys = screenKeys(situation.connectedConnectors())
+    text = json.dumps([[keys[p.name], p.resolution.forDatabase() if p.resolution else None,
+                        p.relPosition.text if p.relPosition else None, keys[p.relativeTo] if p.relativeTo else None] for p in layout.placements])
+    return (layoutKey(situation.connectedConnectors()), text)
+
+def fromDatabase(text, situation):
+    '''Turns the text from the database back into a Layout for the given situation'''
+    names = dict((key, name) for (name, key) in screenKeys(situation.connectedConnectors()).items())
+    return Layout(Placement(names[key], Resolution.fromDatabase(res), RelativeScreenPosition(relPos) if relPos else None, names.get(relativeTo))
+                  for (key, res, relPos, relativeTo) in json.loads(text))
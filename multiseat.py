@@ -0,0 +1,76 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Set up the screens of several X displays at once, e.g. on a machine with one seat (and X server) per user. The displays
+# are handled by a bounded pool of threads: most of the time is spent waiting for the X servers, so they overlap nicely.
+
+'''
+Every display is handled like a silent run of lilass: probe, look up the database, apply. Nobody can be asked, as we would not
+know on which seat to ask, so a screen that is neither known nor covered by -r/-e/-i counts as a failure of that seat.
+All seats share one Database (which serializes the access of the threads); the displays are locked like a single run would
+(see coordination), so that a lilass started by x-on-resize on one of the seats waits for us.
+'''
+import argparse, collections, subprocess
+import policy, probe, pipeline, coordination, tracing, backlight
+
+# how to talk to the X server of a seat: <probe> finds the connectors, <runXrandr> applies an xrandr call (a list of arguments),
+# <backlight> makes sure the backlight is on
+Seat = collections.namedtuple("Seat", ["display", "probe", "runXrandr", "backlight"])
+# what happened on a seat: the setup that was applied, or the exception that stopped us
+SeatResult = collections.namedtuple("SeatResult", ["display", "setup", "error"])
+
+def xSeat(display, probeName = None):
+    '''The seat of the X server at <display>'''
+    def runXrandr(args):
+        subprocess.check_call(args[:1] + ["--display", display] + args[1:])
+    return Seat(display, probe.getProbe(probeName, display), runXrandr, lambda: backlight.turnOn(display))
+
+class _NoQuestions:
+    '''The frontend for seats: We cannot ask anybody.'''
+    def __init__(self, display):
+        self._display = display
+    def setup(self, situation):
+        raise Exception("The screen connected to %s of %s is not known; use -r, -e or -i to say what to do with new screens." % (situation.externalConnector, self._display))
+
+def setupSeat(seat, situationFor, cmdArgs, db = None, lockDirectory = None):
+    '''Probe, choose and apply for one seat; returns the setup. <situationFor> makes a ScreenSituation from a probe.'''
+    situation = situationFor(seat.probe)
+    setup = policy.chooseSetup(situation, cmdArgs, _NoQuestions(seat.display), db)
+    with coordination.RunLock(seat.display, lockDirectory):
+        policy.applySetup(situation, setup, runXrandr = seat.runXrandr, backlight = seat.backlight)
+    return setup
+
+def setupSeats(seats, situationFor, cmdArgs, db = None, workers = 4, lockDirectory = None):
+    '''Set up all <seats>, at most <workers> at the same time. Returns a SeatResult for each seat, in the same order.'''
+    silentArgs = argparse.Namespace(**vars(cmdArgs))
+    silentArgs.silent = True
+    with tracing.span("seats", seats = len(seats), workers = workers):
+        results = pipeline.runBounded("seat", lambda seat: setupSeat(seat, situationFor, silentArgs, db, lockDirectory), seats, workers)
+    return [SeatResult(seat.display, setup, error) for seat, (setup, error) in zip(seats, results)]
+
+def report(results):
+    '''Print what happened on all seats, and return the number of seats that failed'''
+    failed = 0
+    for result in results:
+        if result.error is not None:
+            print("%s: FAILED: %s" % (result.display, result.error))
+            failed += 1
+        else:
+            print("%s: %s" % (result.display, result.setup))
+    print("%d of %d displays set up." % (len(results) - failed, len(results)))
+    return failed
@@ -0,0 +1,103 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Run the steps of a lilass run that do not depend on each other at the same time, so that a run takes about as long as its
+# slowest chain of steps (usually: probe the screens, then apply the setup) instead of the sum of all steps.
+# Most steps wait for a process or for the disk, so threads are good enough. (We do not use concurrent.futures: it imports
+# logging, which takes longer than what we would gain.)
+
+import threading
+import tracing
+
+class Step:
+    '''Calls <func> in its own thread, with the results of the steps in <deps> as arguments, once these are done'''
+    def __init__(self, name, func, deps = ()):
+        self.name = name
+        self._func = func
+        self._deps = list(deps)
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="lilass-"+name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            args = [dep.result() for dep in self._deps]
+            with tracing.span(self.name, thread = True):
+                self._result = self._func(*args)
+        except BaseException as e:
+            self._error = e # raised in the thread asking for the result
+
+    def wait(self):
+        '''Wait for the step to be done, without caring about its result'''
+        self._thread.join()
+
+    def result(self):
+        '''Wait for the step, and return its result (or raise its exception)'''
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class Pipeline:
+    '''A set of steps with dependencies between them. Every step starts as soon as the steps it depends on are done.'''
+    def __init__(self):
+        self._steps = {}
+
+    def add(self, name, func, *deps):
+        '''Add a step calling <func> with the results of the steps named in <deps>'''
+        assert name not in self._steps
+        self._steps[name] = Step(name, func, (self._steps[dep] for dep in deps))
+        return self._steps[name]
+
+    def __getitem__(self, name):
+        return self._steps[name]
+
+    def __contains__(self, name):
+        return name in self._steps
+
+    def result(self, name):
+        return self._steps[name].result()
+
+def background(name, func):
+    '''Run <func> in the background; call result() on the returned Step to wait for it'''
+    return Step(name, func)
+
+def runBounded(name, func, items, workers):
+    '''Calls <func> for each of the <items>, with at most <workers> calls running at the same time. Returns a list of
+       (result, exception) pairs in the order of the <items>; one of them is None.'''
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(range(len(items)))
+    lock = threading.Lock()
+    def worker():
+        while True:
+            with lock:
+                i = next(pending, None)
+            if i is None:
+                return
+            try:
+                with tracing.span(name, thread = True, item = str(items[i])):
+                    results[i] = (func(items[i]), None)
+            except Exception as e:
+                results[i] = (None, e)
+    threads = [threading.Thread(target=worker, name="lilass-"+name, daemon=True) for _ in range(max(1, min(workers, len(items))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
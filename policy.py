@@ -0,0 +1,159 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# This file decides which ScreenSetup to use in a given ScreenSituation, and applies it.
+# It is shared by the one-shot lilass run and the resident modes.
+
+import subprocess
+import screen, layout, pipeline, tracing
+from backlight import getBacklight
+
+# how do we filter the RelativeScreenPosition for the CLI?
+relPosFilter = str.lower
+
+def relPosChoices():
+    return list(map(relPosFilter, screen.RelativeScreenPosition.__members__.keys()))
+
+def relPosByName(name):
+    # figure out the desired RelativeScreenPosition... what a bad hack...
+    relPos = list(filter(lambda relPosItem: relPosFilter(relPosItem[0]) == name, screen.RelativeScreenPosition.__members__.items()))
+    assert len(relPos) == 1, "CLI argument is ambiguous"
+    return relPos[0][1]
+
+# Figure out the layout.Layout to use, if a layout was given on the command line, or if there are several external screens and
+# we know what to do with them. Returns None to use a ScreenSetup. Like for a single external screen, -r/-e/-i only say what to
+# do if we do not know the screens.
+def chooseLayout(situation, cmdArgs, db = None):
+    if cmdArgs.layout:
+        chosen = layout.Layout(map(layout.parsePlacement, cmdArgs.layout))
+        chosen.targetState(situation) # check whether this fits the screens we have
+        if db is not None and len(situation.connectedConnectors()) > 2:
+            with tracing.span("db-store"):
+                db.putLayout(*layout.forDatabase(chosen, situation))
+        return chosen
+    if db is None or len(situation.connectedConnectors()) <= 2:
+        return None
+    with tracing.span("db-lookup", layout = True):
+        stored = db.getLayout(layout.layoutKey(situation.connectedConnectors()))
+    if stored is None:
+        return None
+    chosen = layout.fromDatabase(stored, situation)
+    if not chosen.isPossible(situation):
+        # e.g. a mode that the screens do not offer any more
+        print("Known screens, but the previous layout is not possible any more:", chosen)
+        return None
+    print("Known screens, previous layout:", chosen)
+    return chosen
+
+# Figure out the ScreenSetup (or layout.Layout) to use. <cmdArgs> are the parsed command-line arguments, <db> is an open Database or None
+# if the database is not to be used. Returns None if the user canceled.
+def chooseSetup(situation, cmdArgs, frontend, db = None):
+    setup = chooseLayout(situation, cmdArgs, db)
+    if setup is not None:
+        return setup
+    if situation.externalConnector is not None:
+        # There's an external screen connected that we may want to use.
+        # Fetch info about this screen from the database.
+        if db is not None:
+            with tracing.span("db-lookup"):
+                situation.fetchDBInfo(db)
+        # what to we do?
+        have_default_conf = bool(cmdArgs.external_only or cmdArgs.internal_only or cmdArgs.rel_position)
+        no_ui = bool(have_default_conf or (situation.previousSetup and cmdArgs.silent))
+        if not no_ui:
+            # ask the user what to do
+            with tracing.span("ask-user"):
+                setup = frontend.setup(situation)
+            if setup is None: return None # the user canceled
+            if db is not None:
+                # persists this to disk
+                with tracing.span("db-store"):
+                    situation.putDBInfo(db, setup)
+        elif situation.previousSetup:
+            # apply the old setup again
+            setup = situation.previousSetup
+        # use default config from CLI
+        elif cmdArgs.external_only:
+            setup = screen.ScreenSetup(intResolution = None, extResolution = situation.externalConnector.getPreferredResolution())
+        elif cmdArgs.rel_position is not None:
+            # construct automatically, based on CLI arguments
+            relPos = relPosByName(cmdArgs.rel_position)
+            # now we construct the ScreenSetup
+            if relPos == screen.RelativeScreenPosition.MIRROR:
+                res = situation.commonResolutions()[0]
+                setup = screen.ScreenSetup(res, res, relPos)
+            else:
+                setup = screen.ScreenSetup(intResolution = situation.internalConnector.getPreferredResolution(),
+                                           extResolution = situation.externalConnector.getPreferredResolution(),
+                                           relPosition = relPos)
+        # cmdArgs.internal_only: fall-through
+    if setup is None:
+        assert cmdArgs.internal_only or situation.externalConnector is None
+        # Nothing chosen yet? Use first resolution of internal connector.
+        setup = screen.ScreenSetup(intResolution = situation.internalConnector.getPreferredResolution(), extResolution = None)
+    return setup
+
+# Describe what the connectors are currently doing, one line per connector
+def describeState(connectors):
+    lines = []
+    for c in connectors:
+        if not c.isConnected():
+            state = "disconnected"
+        elif not c.currentStateKnown:
+            state = "connected, state unknown"
+        elif c.currentResolution is None:
+            state = "off"
+        else:
+            state = "%s at %dx%d" % (c.currentResolution, c.currentPosition[0], c.currentPosition[1])
+            if c.isPrimary:
+                state += ", primary"
+        lines.append("%s: %s" % (c.name, state))
+    return "\n".join(lines)
+
+# What the connectors should be doing for the given setup (a ScreenSetup or a layout.Layout), see ScreenSituation.targetState
+def targetState(situation, setup):
+    if isinstance(setup, layout.Layout):
+        return setup.targetState(situation)
+    return situation.targetState(setup)
+
+# Apply the given setup (a ScreenSetup or a layout.Layout): call xrandr, and fix up the backlight.
+# <runXrandr> and <backlight> do the actual work, they are replaced when running against a simulated X server.
+def applySetup(situation, setup, runXrandr = subprocess.check_call, backlight = None):
+    applyTarget(situation.connectors, situation.internalConnector.name, targetState(situation, setup), runXrandr, backlight)
+
+# Bring the <connectors> into the <target> state (see ScreenSituation.targetState). This does not need a ScreenSituation, so that
+# a setup from the replay cache can be applied right after probing.
+def applyTarget(connectors, internalName, target, runXrandr = subprocess.check_call, backlight = None):
+    internalOnly = [name for name, want in target.items() if want is not None] == [internalName]
+    if internalOnly and backlight is None:
+        # the brightness does not depend on the screen setup, so we read it while xrandr is busy (that is cheap with sysfs, but
+        # may mean starting xbacklight)
+        device = pipeline.background("backlight-get", lambda: getBacklight().read())
+        backlight = lambda: device.result().turnOn()
+    # call xrandr
+    xrandrCall = screen.xrandrCall(connectors, target)
+    if xrandrCall is None:
+        print("The screens are already set up like this, nothing to do.")
+    else:
+        print("Call that will be made:",xrandrCall)
+        with tracing.span("apply"):
+            runXrandr(xrandrCall)
+
+    # make sure the internal screen is really, *really* turned on if there is no external screen
+    if internalOnly:
+        with tracing.span("backlight"):
+            backlight()
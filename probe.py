@@ -0,0 +1,255 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# This file abstracts away how we find out which connectors there are, and what is connected to them.
+
+'''
+A probe backend implements:
+
+def getConnectors(self, current = False):
+    Returns a list of screen.Connector objects, one for every (non-virtual) output of the X screen.
+    If <current> is set, only the state the X server already knows is returned, without polling the hardware for changes
+    (which can take a long time, as all EDIDs have to be re-read).
+
+@staticmethod
+def isAvailable():
+    Returns whether the backend can be used on this system.
+'''
+import collections, os
+import screen, xrandr_parser
+from edid import Edid
+
+class XrandrProbe:
+    '''Runs `xrandr -q --verbose` and parses its output'''
+    def __init__(self, display = None):
+        self._display = display
+
+    def xrandrArgs(self, current = False):
+        args = ["xrandr"]
+        if self._display is not None:
+            args += ["--display", self._display]
+        args += ["-q", "--verbose"]
+        if current:
+            args.append("--current")
+        return args
+
+    def getConnectors(self, current = False):
+        # decoding all of it at once and parsing str is faster than parsing the bytes line by line
+        return xrandr_parser.parse(screen.processOutput(*self.xrandrArgs(current)).split("\n"))
+
+    @staticmethod
+    def isAvailable():
+        return True # we rely on xrandr anyway to apply the setup
+
+class RandRProbe:
+    '''Talks to the X server directly, using the RandR extension via xcffib. Requests are sent in batches before
+       waiting for the first reply, so this takes three round-trips in total, and no process has to be spawned.'''
+    def __init__(self, display = None):
+        self._display = display
+
+    def getConnectors(self, current = False):
+        import xcffib, xcffib.randr, xcffib.xproto
+        conn = xcffib.connect(display=self._display)
+        try:
+            randr = conn(xcffib.randr.key)
+            randr.QueryVersion(1, 3).reply() # 1.3 for GetScreenResourcesCurrent
+            root = conn.get_setup().roots[conn.pref_screen].root
+            # first round-trip: the screen resources, the atom for the EDID property, and the primary output
+            resourcesCookie = randr.GetScreenResourcesCurrent(root) if current else randr.GetScreenResources(root)
+            edidAtomCookie = conn.core.InternAtom(True, len("EDID"), "EDID")
+            primaryCookie = randr.GetOutputPrimary(root)
+            resources = resourcesCookie.reply()
+            edidAtom = edidAtomCookie.reply().atom # 0 if no output has an EDID
+            primary = primaryCookie.reply().output
+            modes = dict((m.id, screen.Resolution(m.width, m.height)) for m in resources.modes)
+            refreshRates = dict((m.id, m.dot_clock / (m.htotal * m.vtotal)) for m in resources.modes if m.htotal and m.vtotal)
+            # second round-trip: information and EDID about all outputs
+            outputs = []
+            for output in resources.outputs:
+                infoCookie = randr.GetOutputInfo(output, resources.config_timestamp)
+                edidCookie = randr.GetOutputProperty(output, edidAtom, xcffib.xproto.GetPropertyType.Any, 0, 128, False, False) if edidAtom else None
+                outputs.append((infoCookie, edidCookie))
+            connectors = []
+            crtcs = [] # connectors that are currently on, and the cookies for their CRTC info
+            for output, (infoCookie, edidCookie) in zip(resources.outputs, outputs):
+                info = infoCookie.reply()
+                edid = edidCookie.reply() if edidCookie is not None else None
+                connector = screen.Connector(info.name.to_string())
+                if connector.name.startswith("VIRTUAL"):
+                    continue # skip "VIRTUAL" connectors
+                connectors.append(connector)
+                connector.reportedConnected = (info.connection == xcffib.randr.Connection.Connected)
+                connector.isPrimary = (output == primary)
+                if info.crtc:
+                    connector.crtc = info.crtc
+                    crtcs.append((connector, randr.GetCrtcInfo(info.crtc, resources.config_timestamp)))
+                if info.connection != xcffib.randr.Connection.Connected:
+                    continue # like xrandr, we do not list modes of disconnected outputs
+                for idx, modeId in enumerate(info.modes):
+                    resolution = modes[modeId]
+                    connector.addResolution(resolution, refreshRates.get(modeId))
+                    if idx == 0 and info.num_preferred > 0: # the preferred modes come first
+                        connector.setPreferredResolution(resolution)
+                if edid is not None and edid.num_items > 0:
+                    connector.edid = Edid(bytes(edid.data))
+            # third round-trip: what the enabled connectors are currently doing
+            for connector, crtcCookie in crtcs:
+                crtc = crtcCookie.reply()
+                if crtc.mode in modes:
+                    connector.currentResolution = modes[crtc.mode]
+                    connector.currentPosition = (crtc.x, crtc.y)
+            return connectors
+        finally:
+            conn.disconnect()
+
+    @staticmethod
+    def isAvailable():
+        if not os.environ.get("DISPLAY"):
+            return False
+        try:
+            import xcffib, xcffib.randr
+            return True
+        except ImportError:
+            return False
+
+class PrefetchedProbe:
+    '''Hands out connectors that <probe> was already asked for in the background, and asks <probe> for anything else.
+       <connectors> is a function returning the list of connectors obtained with the given value of <current>.'''
+    def __init__(self, probe, current, connectors):
+        self._probe = probe
+        self._current = current
+        self._connectors = connectors
+
+    def getConnectors(self, current = False):
+        if current == self._current and self._connectors is not None:
+            connectors, self._connectors = self._connectors, None # only use them once, afterwards the state may have changed
+            return connectors()
+        return self._probe.getConnectors(current)
+
+# the connector types of the kernel (as they appear in /sys/class/drm), and how the X drivers call them
+_drmTypeNames = {
+    # kernel name: (modesetting driver, intel driver)
+    "VGA": ("VGA", "VGA"),
+    "DVI-I": ("DVI-I", "DVI"),
+    "DVI-D": ("DVI-D", "DVI"),
+    "DVI-A": ("DVI-A", "DVI"),
+    "Composite": ("Composite", "TV"),
+    "SVIDEO": ("S-video", "TV"),
+    "LVDS": ("LVDS", "LVDS"),
+    "Component": ("CTV", "TV"),
+    "DIN": ("DIN", "TV"),
+    "DP": ("DP", "DP"),
+    "HDMI-A": ("HDMI", "HDMI"),
+    "HDMI-B": ("HDMI-B", "HDMI"),
+    "TV": ("TV", "TV"),
+    "eDP": ("eDP", "eDP"),
+    "Virtual": ("Virtual", "VIRTUAL"),
+    "DSI": ("DSI", "DSI"),
+    "DPI": ("DPI", "DPI"),
+}
+# connector types that are always built into the machine
+drmInternalTypes = {"LVDS", "eDP", "DSI"}
+
+def drmConnectorName(drmName, naming = "modesetting"):
+    '''Maps the name of a DRM connector in sysfs (e.g. "card0-HDMI-A-1") to its RandR output name ("HDMI-1" for the modesetting driver,
+       "HDMI1" for the intel driver). Returns (name, kernel connector type), or (None, None) if this is not a connector.'''
+    card, sep, rest = drmName.partition("-")
+    if not sep or not card.startswith("card"):
+        return (None, None)
+    drmType, sep, index = rest.rpartition("-")
+    if not sep or not index.isdigit() or drmType not in _drmTypeNames:
+        return (None, None)
+    if naming == "intel":
+        return (_drmTypeNames[drmType][1] + index, drmType)
+    return (_drmTypeNames[drmType][0] + "-" + index, drmType)
+
+class SysfsProbe:
+    '''Reads the connector state the kernel exports in /sys/class/drm: Just a few file reads, no process and no connection to the X server.
+       The kernel updates this on hotplug, so there is nothing to re-probe. sysfs does not tell which mode a connector is currently using,
+       so the setup is always applied completely.
+       <naming> is the naming scheme of the X driver, "modesetting" or "intel". DisplayPort MST connectors get other names in X, they cannot be matched.
+       sysfs knows nothing about X displays, so this cannot probe a particular <display>: all of them would get the same connectors.'''
+    def __init__(self, display = None, root = "/sys/class/drm", naming = "modesetting"):
+        assert naming in ("modesetting", "intel")
+        if display is not None:
+            raise Exception("The sysfs probe cannot tell the screens of display %s from those of other displays" % display)
+        self._root = root
+        self._naming = naming
+
+    def _read(self, path, mode = "r"):
+        try:
+            with open(path, mode) as f:
+                return f.read()
+        except OSError:
+            return None # the file may be missing, or not readable for us
+
+    def getConnectors(self, current = False):
+        connectors = []
+        for drmName in sorted(os.listdir(self._root)):
+            name, drmType = drmConnectorName(drmName, self._naming)
+            if name is None or drmType == "Virtual":
+                continue
+            path = os.path.join(self._root, drmName)
+            status = self._read(os.path.join(path, "status"))
+            if status is None:
+                continue
+            connector = screen.Connector(name)
+            connector.isInternal = drmType in drmInternalTypes
+            connector.currentStateKnown = False
+            connector.reportedConnected = (status.strip() == "connected")
+            connectors.append(connector)
+            if not connector.reportedConnected:
+                continue
+            for idx, mode in enumerate((self._read(os.path.join(path, "modes")) or "").split()):
+                width, sep, height = mode.rstrip("i").partition("x") # "i" marks interlaced modes
+                if not sep or not width.isdigit() or not height.isdigit():
+                    continue
+                resolution = screen.Resolution(int(width), int(height))
+                connector.addResolution(resolution)
+                if idx == 0: # the kernel lists the preferred mode first
+                    connector.setPreferredResolution(resolution)
+            edid = self._read(os.path.join(path, "edid"), "rb")
+            if edid:
+                connector.edid = Edid(edid)
+        return connectors
+
+    @staticmethod
+    def isAvailable():
+        return os.path.isdir("/sys/class/drm")
+
+# list of available probe backends, in order of preference
+probes = collections.OrderedDict()
+probes["randr"] = RandRProbe
+probes["xrandr"] = XrandrProbe
+probes["sysfs"] = SysfsProbe # only when asked for, as the names may not match those of the X driver (auto-detection stops at xrandr)
+
+# get a probe backend
+def getProbe(name = None, display = None):
+    # by name
+    if name is not None:
+        if name in probes:
+            if probes[name].isAvailable():
+                return probes[name](display) # call constructor
+            else:
+                raise Exception("Probe backend %s not available" % name)
+        # backend not found
+        raise Exception("Probe backend %s not found" % name)
+    # auto-detect
+    for probe in probes.values():
+        if probe.isAvailable():
+            return probe(display) # call constructor
+    raise Exception("No probe backend is available - this should not happen")
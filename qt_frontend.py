@@ -14,20 +14,61 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
-import sys, os
+import sys, os, hashlib
 from screen import RelativeScreenPosition, ScreenSetup
+import util
+
+uiFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qt_dialogue.ui')
+qtVersion = None # set below, if PyQt is installed
+
+# The dialog is compiled to Python code in the cache directory, which is a lot faster to load than parsing the .ui file every time.
+# The name of the compiled file says which .ui file and which PyQt it was made from: modification times do not tell (e.g. after
+# checking out an older version), and several versions of lilass may share the cache.
+def compiledUiFile():
+    h = hashlib.sha1()
+    with open(uiFile, "rb") as f:
+        h.update(f.read())
+    h.update(str(qtVersion).encode("utf-8"))
+    return os.path.join(util.getCacheDirectory(), 'qt_dialogue_ui_%s.py' % h.hexdigest()[:16])
+
+# returns the class generated for the dialog, or None if there is no compiled form that is up-to-date
+def loadCompiledUi():
+    import importlib.util
+    path = compiledUiFile()
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location("qt_dialogue_ui", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Ui_Dialog
 
 try:
     # Be fine with PyQt4 not being installed
     from PyQt5 import QtCore, QtWidgets, uic
+    qtVersion = QtCore.PYQT_VERSION_STR
+
+    def compileUi():
+        path = compiledUiFile()
+        util.mkdirP(os.path.dirname(path))
+        tmpName = "%s.%d" % (path, os.getpid())
+        with open(tmpName, "w") as f:
+            uic.compileUi(uiFile, f)
+        os.replace(tmpName, path) # a lilass running at the same time must not see a half-written file
 
     class PositionSelection(QtWidgets.QDialog):
-        def __init__(self, situation):
+        def __init__(self, situation, useCompiledUi = True):
             # set up main window
             super(PositionSelection, self).__init__()
             self._situation = situation
-            uifile = os.path.join(os.path.dirname(__file__), 'qt_dialogue.ui')
-            uic.loadUi(uifile, self)
+            Ui = loadCompiledUi() if useCompiledUi else None
+            if Ui is not None:
+                ui = Ui()
+                ui.setupUi(self)
+                for name, widget in vars(ui).items(): # make the widgets accessible like uic.loadUi does
+                    setattr(self, name, widget)
+            else:
+                uic.loadUi(uiFile, self)
+            self._compileUi = useCompiledUi and Ui is None # compile it for the next time, once the user is done
             
             # fill relative position box
             for pos in RelativeScreenPosition:
@@ -62,6 +103,7 @@ try:
                 self._extDefaultRes = situation.externalConnector.getPreferredResolution()
                 self._mirrorDefaultRes = None
 
+            self._boxContents = {} # maps the names of the resolution boxes to what was last put into them
             # connect the update function
             self.intEnabled.toggled.connect(self.updateEnabledControls)
             self.extEnabled.toggled.connect(self.updateEnabledControls)
@@ -75,6 +117,12 @@ try:
             return self.relPos.itemData(idx)
         
         def fillResolutionBox(self, box, resolutions, select = None):
+            # the situation hands out the same tuple every time, so we can tell when the box already shows these resolutions
+            if self._boxContents.get(box.objectName()) is resolutions:
+                if select in resolutions:
+                    box.setCurrentIndex(resolutions.index(select))
+                return
+            self._boxContents[box.objectName()] = resolutions
             # if the count did not change, update in-place (this avoids flicker)
             if box.count() == len(resolutions):
                 for idx, res in enumerate(resolutions):
@@ -125,6 +173,11 @@ try:
         
         def run(self):
             self.exec_()
+            if self._compileUi:
+                try:
+                    compileUi()
+                except Exception as e:
+                    print("Could not compile the dialog:", e)
             if not self.result(): return None
             intRes = self.intRes.itemData(self.intRes.currentIndex()) if self.intEnabled.isChecked() else None
             extRes = self.extRes.itemData(self.extRes.currentIndex()) if self.extEnabled.isChecked() else None
@@ -148,9 +201,6 @@ class QtFrontend:
     
     @staticmethod
     def isAvailable():
-        try:
-            import PyQt5
-            return True
-        except ImportError:
-            return False
+        import importlib.util
+        return importlib.util.find_spec("PyQt5") is not None
 
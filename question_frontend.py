@@ -19,6 +19,7 @@
 from screen import RelativeScreenPosition, ScreenSetup, processOutputIt
 
 from enum import Enum
+import collections
 
 class OperationMode(Enum):
     INTERNAL_ONLY = ("Use internal display only")
@@ -31,15 +32,36 @@ class OperationMode(Enum):
         # description
         self.text = text
 
+class FormNotSupported(Exception):
+    '''Raised by userChooseAll if the form cannot be shown after all'''
+    pass
+
+# one question of a form: <choices> are shown to the user, the corresponding element of <returns> is the answer
+Question = collections.namedtuple("Question", ["name", "title", "choices", "returns"])
+
 class QuestionFrontend:
+    # Frontends that can show several questions at once (see userChooseAll) set this. They ask for the entire setup with a single
+    # form, the others ask one question after the other.
+    hasForms = False
+
     def userChoose (self, title, choices, returns, fallback):
         raise Exception("The abstract method 'userChoose' has not been implemented by %s"%str(self.__class__))
 
+    def userChooseAll (self, title, questions):
+        '''Shows all <questions> at once. Returns a dict mapping the question names to the answers, or None if the user canceled.
+           Questions the user did not answer get their first choice.'''
+        raise Exception("The abstract method 'userChooseAll' has not been implemented by %s"%str(self.__class__))
+
     def selectResolution(self, displayname, availablemodes):
         modedescs = list(map(str, availablemodes))
         return self.userChoose("Select resolution for %s"%displayname, modedescs, availablemodes, None)
 
     def setup (self, situation):
+        if self.hasForms:
+            try:
+                return self.setupWithForm(situation)
+            except FormNotSupported:
+                self.hasForms = False # ask one question after the other from now on
         if situation.previousSetup:
             applyPrevious = self.userChoose("This display is known. The last setup for it was like this:\n%s.\nApply the last used configuration?" % str(situation.previousSetup), ("Apply last setup", "Enter different setup"), (True,False), None)
             if applyPrevious is None:
@@ -88,3 +110,47 @@ class QuestionFrontend:
             if extprim is None:
                 return None
             return ScreenSetup(intres,extres,relpos,extprim)
+
+    def formQuestions (self, situation):
+        '''The questions of the form asking for the entire setup; some of them are ignored depending on the operation mode'''
+        modes = list(OperationMode)
+        modedescs = list(map(lambda x: x.text, modes))
+        if situation.previousSetup:
+            # the default
+            modes.insert(0, None)
+            modedescs.insert(0, "Use the last setup (%s)" % str(situation.previousSetup))
+        relscrpositions = list(RelativeScreenPosition)
+        commonres = situation.commonResolutions()
+        if not commonres:
+            relscrpositions.remove(RelativeScreenPosition.MIRROR)
+        questions = [
+            Question("mode", "Display setup", modedescs, modes),
+            Question("relpos", "Position of external screen", list(map(lambda x: x.text+" internal screen", relscrpositions)), relscrpositions),
+            Question("intres", "Resolution of the internal screen", list(map(str, situation.internalConnector.getResolutionList())), situation.internalConnector.getResolutionList()),
+            Question("extres", "Resolution of the external screen", list(map(str, situation.externalConnector.getResolutionList())), situation.externalConnector.getResolutionList()),
+        ]
+        if commonres:
+            questions.append(Question("commonres", "Resolution when mirroring", list(map(str, commonres)), commonres))
+        questions.append(Question("extprim", "Primary screen", ["Internal screen is primary","External screen is primary"], [False,True]))
+        return questions
+
+    def setupFromAnswers (self, situation, answers):
+        '''Turns the answers to the formQuestions into a ScreenSetup'''
+        operationmode = answers["mode"]
+        if operationmode is None:
+            return situation.previousSetup
+        elif operationmode is OperationMode.INTERNAL_ONLY:
+            return ScreenSetup(answers["intres"], None, None, False)
+        elif operationmode is OperationMode.EXTERNAL_ONLY:
+            return ScreenSetup(None, answers["extres"], None, True)
+        assert operationmode is OperationMode.USE_BOTH
+        relpos = answers["relpos"]
+        if relpos == RelativeScreenPosition.MIRROR:
+            return ScreenSetup(answers["commonres"], answers["commonres"], relpos, False)
+        return ScreenSetup(answers["intres"], answers["extres"], relpos, answers["extprim"])
+
+    def setupWithForm (self, situation):
+        answers = self.userChooseAll("Display setup", self.formQuestions(situation))
+        if answers is None:
+            return None
+        return self.setupFromAnswers(situation, answers)
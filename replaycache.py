@@ -0,0 +1,122 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# A silent run for screens we have seen before usually ends up making the same xrandr call as last time. The replay cache
+# remembers, for every combination of connected screens, what the connectors were set to, so that the next run can go straight
+# from probing to applying: no database, no config file, no mode lists.
+
+'''
+The cache is a small JSON file mapping a fingerprint of the hardware (connector names, what is connected, the EDIDs) and of the
+command-line options that influence the choice to the target state of the connectors (see ScreenSituation.targetState). We
+store the target state rather than the xrandr call itself, so that connectors that are already set up correctly are still left
+alone (see screen.xrandrCall).
+
+Every entry was chosen based on the database and the config file, so the cache also records the modification times and sizes
+of these files (the "stamp"). If any of them changed, e.g. because putDBInfo stored a new setup, the entire cache is dropped.
+Entries can also expire after a while, so that every now and then a run goes through the database again (which records that
+the screens are still in use, see Database.flushSeen).
+'''
+import json, os, hashlib, time
+from screen import Resolution
+
+VERSION = 1
+MAX_ENTRIES = 32
+
+def fingerprint(connectors, options = ()):
+    '''Identifies the connected hardware (and the <options> that influence what we do with it)'''
+    h = hashlib.sha1()
+    h.update(repr(tuple(options)).encode())
+    for c in sorted(connectors, key=lambda c: c.name):
+        # a connector reported as connected without modes is stale state of the X server (see ScreenSituation._isStale), which
+        # never matches an entry: we only store what we got after re-probing
+        h.update(("\n%s %d %d %s" % (c.name, c.reportedConnected, c.isConnected(), c.edid.fingerprint() if c.edid else None)).encode())
+    return h.hexdigest()
+
+def _encodeTarget(target):
+    return dict((name, None if want is None else [want[0].forDatabase(), list(want[1]), want[2]]) for name, want in target.items())
+
+def _decodeTarget(data):
+    return dict((name, None if want is None else (Resolution.fromDatabase(want[0]), tuple(want[1]), want[2])) for name, want in data.items())
+
+class ReplayCache:
+    '''The cache in <filename>. The entries depend on the files in <dependencies> (which need not exist); <options> are the
+       command-line options that influence the choice of the setup.'''
+    def __init__(self, filename, dependencies, options = (), maxAge = None):
+        self._filename = filename
+        self._dependencies = list(dependencies)
+        self._options = tuple(options)
+        self._maxAge = maxAge # in seconds, None if entries do not expire
+        self._stamp = None # taken on lookup, and again when storing
+
+    def _currentStamp(self):
+        stamp = []
+        for path in self._dependencies:
+            try:
+                st = os.stat(path)
+                stamp.append([path, st.st_mtime_ns, st.st_size])
+            except FileNotFoundError:
+                stamp.append([path, None, None])
+        return stamp
+
+    def _load(self):
+        try:
+            with open(self._filename) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if data.get("version") != VERSION or data.get("stamp") != self._stamp:
+            return {} # outdated
+        return data["entries"]
+
+    def _save(self, entries):
+        tmpName = "%s.%d" % (self._filename, os.getpid())
+        with open(tmpName, "w") as f:
+            json.dump({"version": VERSION, "stamp": self._stamp, "entries": entries}, f)
+        os.replace(tmpName, self._filename) # never leave a half-written cache behind
+
+    def lookup(self, connectors):
+        '''Returns the name of the internal connector and the target state stored for the <connectors> (as returned by the
+           probe), or None'''
+        self._stamp = self._currentStamp()
+        data = self._load().get(fingerprint(connectors, self._options))
+        if data is None:
+            return None
+        if self._maxAge is not None and not (0 <= time.time() - data.get("stored", 0) < self._maxAge):
+            return None
+        target = _decodeTarget(data["target"])
+        if set(target.keys()) != set(c.name for c in connectors):
+            return None
+        return (data["internal"], target)
+
+    def store(self, connectors, internalName, target):
+        '''Remember the <target> state chosen for the <connectors>, with <internalName> being the internal one. Call this once
+           the run is done with the files the cache depends on, so that the entry is not outdated by the run's own changes.'''
+        self._stamp = self._currentStamp()
+        entries = self._load() # empty if the files changed since the other entries were stored
+        key = fingerprint(connectors, self._options)
+        entries.pop(key, None)
+        entries[key] = {"internal": internalName, "target": _encodeTarget(target), "stored": time.time()} # the most recently used come last
+        while len(entries) > MAX_ENTRIES:
+            del entries[next(iter(entries))]
+        self._save(entries)
+
+    def drop(self, connectors):
+        '''Forget what is stored for the <connectors>'''
+        entries = self._load()
+        if entries.pop(fingerprint(connectors, self._options), None) is not None:
+            self._save(entries)
@@ -16,19 +16,24 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
 
-import re, subprocess
+import subprocess
 from enum import Enum
+import tracing
 
 ## utility functions
 
 # execute a process, return output as iterator, throw exception if there was an error
 # you *must* iterate to the end if you use this!
+# if <decode> is False, the lines are returned as bytes
 def processOutputGen(*args):
     with subprocess.Popen(args, stdout=subprocess.PIPE) as p:
         for line in p.stdout:
             yield line.decode("utf-8")
     if p.returncode != 0:
         raise Exception("Error executing "+str(args))
+def processOutput(*args):
+    '''The entire output as one str'''
+    return subprocess.check_output(args).decode("utf-8")
 def processOutputIt(*args):
     return list(processOutputGen(*args)) # list() iterates over the generator
 
@@ -58,10 +63,24 @@ class RelativeScreenPosition(Enum):
         return self.text
 
 class Resolution:
-    '''Represents a resolution of a screen'''
-    def __init__(self, width, height):
-        self.width = width
-        self.height = height
+    '''Represents a resolution of a screen. There is only one object per resolution: Connectors with hundreds of modes
+       mostly share the same few dozen resolutions, and comparing them becomes cheap.'''
+    __slots__ = ("width", "height", "_hash", "_str")
+    _interned = {} # maps (width, height) to the Resolution object
+    
+    def __new__(cls, width, height):
+        self = cls._interned.get((width, height))
+        if self is None:
+            self = object.__new__(cls)
+            self.width = width
+            self.height = height
+            self._hash = hash(("Resolution",width,height))
+            self._str = None # computed on first use
+            cls._interned[(width, height)] = self
+        return self
+    
+    def __reduce__(self):
+        return (Resolution, (self.width, self.height)) # make copies go through __new__, too
     
     @classmethod
     def fromDatabase(cls, dbstr):
@@ -69,7 +88,7 @@ class Resolution:
             return None
         parts = dbstr.split("x")
         if len(parts) != 2:
-            raise ValueError(xrandrstr)
+            raise ValueError(dbstr)
         return Resolution(*map(int,parts))
     
     def forDatabase(self):
@@ -82,6 +101,8 @@ class Resolution:
         return (self.width, self.height)
     
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Resolution):
             return False
         return self.width == other.width and self.height == other.height
@@ -90,20 +111,23 @@ class Resolution:
         return not self.__eq__(other)
     
     def __hash__(self):
-        return hash(("Resolution",self.width,self.height))
+        return self._hash
     
-    def __str__(self):
-        # get ratio
+    def aspectRatio(self):
         ratio = int(round(16.0*self.height/self.width))
         if ratio == 11: # 16:10.66 = 3:2
-            strRatio = "3:2"
+            return "3:2"
         elif ratio == 12: # 16:12 = 4:3
-            strRatio = '4:3'
+            return '4:3'
         elif ratio == 13: # 16:12.8 = 5:4
-            strRatio = '5:4'
+            return '5:4'
         else: # let's just hope this will never be 14 or more...
-            strRatio = '16:%d' % ratio
-        return '%dx%d (%s)' %(self.width, self.height, strRatio)
+            return '16:%d' % ratio
+    
+    def __str__(self):
+        if self._str is None:
+            self._str = '%dx%d (%s)' %(self.width, self.height, self.aspectRatio())
+        return self._str
     
     def __repr__(self):
         return 'screen.Resolution('+self.forXrandr()+')'
@@ -111,6 +135,10 @@ class Resolution:
     def pixelCount(self):
         return self.width * self.height
 
+    def sortKey(self):
+        '''Key to sort resolutions from the largest to the smallest'''
+        return (-self.width * self.height, -self.width)
+
 
 class ScreenSetup:
     '''Represents a screen configuration (relative to some notion of an "internal" and an "external" screen): Which screens are enabled with which resolution, how
@@ -125,31 +153,22 @@ class ScreenSetup:
         self.relPosition = relPosition
         self.extIsPrimary = extIsPrimary or self.intResolution is None # external is always primary if it is the only one
     
-    def getInternalArgs(self):
+    def getPositions(self):
+        '''Returns the absolute positions (x, y) of the internal and the external screen (None for a disabled screen). The screens are aligned
+           at their top or left edge, like xrandr does for --left-of etc.'''
         if self.intResolution is None:
-            return ["--off"]
-        args = ["--mode", self.intResolution.forXrandr()] # set internal screen to desired resolution
-        if not self.extIsPrimary:
-            args.append('--primary')
-        return args
-    
-    def getExternalArgs(self, intName):
+            return (None, (0, 0))
         if self.extResolution is None:
-            return ["--off"]
-        args = ["--mode", self.extResolution.forXrandr()] # set external screen to desired resolution
-        if self.extIsPrimary:
-            args.append('--primary')
-        if self.intResolution is None:
-            return args
-        # set position
-        args += [{
-                RelativeScreenPosition.LEFT  : '--left-of',
-                RelativeScreenPosition.RIGHT : '--right-of',
-                RelativeScreenPosition.ABOVE : '--above',
-                RelativeScreenPosition.BELOW : '--below',
-                RelativeScreenPosition.MIRROR: '--same-as',
-            }[self.relPosition], intName]
-        return args
+            return ((0, 0), None)
+        intWidth, intHeight = self.intResolution.toTuple()
+        extWidth, extHeight = self.extResolution.toTuple()
+        return {
+                RelativeScreenPosition.LEFT  : ((extWidth, 0), (0, 0)),
+                RelativeScreenPosition.RIGHT : ((0, 0), (intWidth, 0)),
+                RelativeScreenPosition.ABOVE : ((0, extHeight), (0, 0)),
+                RelativeScreenPosition.BELOW : ((0, 0), (0, intHeight)),
+                RelativeScreenPosition.MIRROR: ((0, 0), (0, 0)),
+            }[self.relPosition]
     
     def __str__(self):
         if self.intResolution is None:
@@ -161,11 +180,23 @@ class ScreenSetup:
 class Connector:
     def __init__(self, name=None):
         self.name = name # connector name, e.g. "HDMI1"
-        self.edid = None # EDID string for the connector, or None if disconnected / unavailable
+        self.edid = None # edid.Edid of the screen, or None if disconnected / unavailable
+        self.reportedConnected = False # whether the X server says something is connected (which may be stale, see ScreenSituation)
         self._resolutions = set() # set of Resolution objects, empty if disconnected
         self._preferredResolution = None
+        self._refreshRateList = [] # pairs of a Resolution and a refresh rate it is available with
+        self._sortedResolutions = None # the mode index, see _modeIndex
+        self._resolutionsByRatio = None
+        self._refreshRates = None
         self.previousResolution = None
         self.hasLastResolution = False
+        # what the connector is currently doing
+        self.currentResolution = None # None if the connector is off
+        self.currentPosition = None # (x, y) if the connector is on
+        self.isPrimary = False
+        self.crtc = None # the CRTC driving the connector, None if unknown
+        self.currentStateKnown = True # False if the probe cannot tell what the connector is currently doing
+        self.isInternal = None # whether this is a built-in panel, None if the probe does not know
     
     def __str__(self):
         return str(self.name)
@@ -177,27 +208,81 @@ class Connector:
         # It is very possible not to have an EDID even for a connected connector
         return len(self._resolutions) > 0
     
-    def addResolution(self, resolution):
+    def addResolution(self, resolution, refreshRate = None):
         assert isinstance(resolution, Resolution)
         self._resolutions.add(resolution)
+        if refreshRate is not None:
+            self.addRefreshRate(resolution, refreshRate)
+        self._sortedResolutions = None # the mode index has to be rebuilt
     
-    def appendToEdid(self, s):
-        if self.edid is None:
-            self.edid = s
-        else:
-            self.edid += s
+    def addRefreshRate(self, resolution, refreshRate):
+        self._refreshRateList.append((resolution, refreshRate)) # sorted out when the mode index is built
+        self._sortedResolutions = None
     
     def setPreferredResolution(self, resolution):
         assert isinstance(resolution, Resolution) and resolution in self._resolutions
         self._preferredResolution = resolution
     
+    # The mode index is built on first use, i.e., once the probe is done adding modes, and then used for all queries.
+    def _modeIndex(self):
+        if self._sortedResolutions is None:
+            self._sortedResolutions = tuple(sorted(self._resolutions, key=Resolution.sortKey))
+            self._resolutionsByRatio = {}
+            for r in self._sortedResolutions:
+                self._resolutionsByRatio.setdefault(r.aspectRatio(), []).append(r)
+            self._refreshRates = {}
+            for r, refreshRate in self._refreshRateList:
+                self._refreshRates.setdefault(r, set()).add(round(refreshRate, 2))
+        return self._sortedResolutions
+    
     def getPreferredResolution(self):
         if self._preferredResolution is not None:
             return self._preferredResolution
-        return self.getResolutionList()[0] # prefer the largest resolution
+        # the probe did not say; the screen's native mode is the first detailed timing in its EDID
+        native = self.edid.nativeTiming() if self.edid is not None else None
+        if native is not None:
+            resolution = Resolution(native.width, native.height)
+            if resolution in self._resolutions:
+                return resolution
+        return self._modeIndex()[0] # prefer the largest resolution
     
     def getResolutionList(self):
-        return sorted(self._resolutions, key=lambda r: -r.pixelCount())
+        '''All resolutions, the largest first. The tuple is shared by all callers.'''
+        return self._modeIndex()
+    
+    def getResolutionsByRatio(self):
+        '''Maps aspect ratios (like "16:9") to the list of resolutions with that ratio, the largest first'''
+        self._modeIndex()
+        return self._resolutionsByRatio
+    
+    def getRefreshRates(self, resolution):
+        '''The refresh rates (in Hz) the resolution is available with, the highest first. Empty if the probe does not know them.'''
+        self._modeIndex()
+        return sorted(self._refreshRates.get(resolution, ()), reverse=True)
+
+# compute the xrandr call that brings the <connectors> into the <target> state (see ScreenSituation.targetState), or None if
+# they are already set up like that
+def xrandrCall(connectors, target):
+    # only touch what needs to be changed: that avoids a modeset, which makes the screens go black for a moment
+    connectorArgs = []
+    for c in connectors:
+        want = target[c.name]
+        if want is None:
+            if c.currentResolution is not None or not c.currentStateKnown:
+                connectorArgs += ["--output", c.name, "--off"]
+            continue
+        resolution, position, primary = want
+        if c.currentStateKnown and c.currentResolution == resolution and c.currentPosition == position and (c.isPrimary or not primary):
+            continue # nothing to do
+        connectorArgs += ["--output", c.name, "--mode", resolution.forXrandr(), "--pos", "%dx%d" % position]
+        if primary:
+            connectorArgs.append("--primary")
+    if not connectorArgs:
+        return None
+    # setting the final screen size right away avoids xrandr resizing the screen several times
+    width = max(pos[0] + res.width for (res, pos, _) in filter(None, target.values()))
+    height = max(pos[1] + res.height for (res, pos, _) in filter(None, target.values()))
+    return ["xrandr", "--fb", "%dx%d" % (width, height)] + connectorArgs
 
 class ScreenSituation:
     connectors = None # contains all the Connector objects
@@ -206,14 +291,44 @@ class ScreenSituation:
     previousSetup = None # None or the ScreenSetup used the last time this external screen was connected
     
     '''Represents the "screen situation" a machine can be in: Which connectors exist, which resolutions do they have, what are the names for the internal and external screen'''
-    def __init__(self, internalConnectorNames, externalConnectorNames = None, xrandrSource = None):
+    def __init__(self, internalConnectorNames, externalConnectorNames = None, xrandrSource = None, probe = None, fastProbe = False):
         '''Both arguments are lists of connector names. The first one which exists and has a screen attached is chosen for that class. <externalConnectorNames> can be None to
-           just choose any remaining connector.'''
+           just choose any remaining connector. <internalConnectorNames> can be None to use the connectors the probe knows to be internal, or the
+           common names of internal connectors if it does not know.
+           The connectors are obtained by parsing <xrandrSource> (an iterable of lines of `xrandr -q --verbose` output) if given, and from <probe> otherwise.
+           <probe> defaults to running xrandr. If <fastProbe> is set, the probe first asks for the state the X server already knows, and only
+           makes the hardware re-probe all connectors if that state looks stale.'''
+        self._commonResolutions = {} # maps pairs of connectors to their common resolutions
+        if internalConnectorNames is not None:
+            internalConnectorNames = list(internalConnectorNames) # we may iterate this more than once
         # which connectors are there?
-        self.connectors = []
-        self._getXrandrInformation(xrandrSource)
+        self.probeMode = None # how we found out: "current" (cached state of the X server) or "full" (hardware was re-probed)
+        if xrandrSource is not None:
+            import xrandr_parser
+            self.connectors = xrandr_parser.parse(xrandrSource)
+        else:
+            if probe is None:
+                import probe as probeModule
+                probe = probeModule.XrandrProbe()
+            if fastProbe:
+                with tracing.span("probe", mode = "current"):
+                    self.connectors = probe.getConnectors(current = True)
+                self.probeMode = "current"
+                if self._isStale(internalConnectorNames):
+                    with tracing.span("probe", mode = "full"):
+                        self.connectors = probe.getConnectors()
+                    self.probeMode = "full"
+            else:
+                with tracing.span("probe", mode = "full"):
+                    self.connectors = probe.getConnectors()
+                self.probeMode = "full"
+            print("Probe mode:",self.probeMode)
+        if tracing.isEnabled():
+            tracing.count("connectors", len(self.connectors))
+            for c in self.connectors:
+                tracing.value("modes", len(c.getResolutionList()), connector = c.name)
         # figure out which is the internal connector
-        self.internalConnector = self._findAvailableConnector(internalConnectorNames)
+        self.internalConnector = self._findAvailableConnector(self._internalNames(internalConnectorNames))
         if self.internalConnector is None:
             raise Exception("Could not automatically find internal connector, please use (or fix) ~/.dsl.conf to specify it manually.")
         print("Detected internal connector:",self.internalConnector)
@@ -226,51 +341,25 @@ class ScreenSituation:
             raise Exception("Internal and external connector are the same. This must not happen. Please fix ~/.dsl.conf.");
         print("Detected external connector:",self.externalConnector)
     
-    # Run xrandr and fill the dict of connector names mapped to lists of available resolutions.
-    def _getXrandrInformation(self, xrandrSource = None):
-        connector = None # current connector
-        readingEdid = False
-        if xrandrSource is None:
-            xrandrSource = processOutputGen("xrandr", "-q", "--verbose")
-        for line in xrandrSource:
-            if readingEdid:
-                m = re.match(r'^\s*([0-9a-f]+)\s*$', line)
-                if m is not None:
-                    connector.appendToEdid(m.group(1))
-                    continue
-                else:
-                    readingEdid = False
-                    # fallthrough to the rest of the loop for parsing of this line
-            # screen?
-            m = re.search(r'^Screen [0-9]+: ', line)
-            if m is not None: # ignore this line
-                connector = None
-                continue
-            # new connector?
-            m = re.search(r'^([\w\-]+) (dis)?connected ', line)
-            if m is not None:
-                connector = Connector(m.group(1))
-                assert not any(c.name == connector.name for c in self.connectors), "Duplicate connector {}".format(connector.name)
-                if not connector.name.startswith("VIRTUAL"):
-                    # skip "VIRTUAL" connectors
-                    self.connectors.append(connector)
-                continue
-            # new resolution?
-            m = re.search(r'^\s*([\d]+)x([\d]+)', line)
-            if m is not None:
-                resolution = Resolution(int(m.group(1)), int(m.group(2)))
-                assert connector is not None
-                connector.addResolution(resolution)
-                if re.search(r' [+]preferred\b', line):
-                    connector.setPreferredResolution(resolution)
-                continue
-            # EDID?
-            m = re.search(r'^\s*EDID:\s*$', line)
-            if m is not None:
-                readingEdid = True
+    # check whether the cached state of the X server is obviously outdated: something is connected, but we do not know which modes it has, or
+    # an external screen is connected but we do not know its EDID
+    def _isStale(self, internalConnectorNames):
+        internalConnectorNames = self._internalNames(internalConnectorNames)
+        for c in self.connectors:
+            if not c.reportedConnected:
                 continue
-            # unknown line
-            # not fatal, e.g. xrandr shows strange stuff when a display is enabled, but not connected; --verbose adds a whole lot of other weird stuff
+            if not c.isConnected():
+                return True
+            if c.edid is None and c.name not in internalConnectorNames:
+                return True
+        return False
+    
+    # the names of the internal connectors: those given, or those the probe says are internal, or those with a typical name
+    def _internalNames(self, internalConnectorNames):
+        if internalConnectorNames is not None:
+            return set(internalConnectorNames)
+        commonNames = set(commonInternalConnectorNames())
+        return set(c.name for c in self.connectors if (c.isInternal if c.isInternal is not None else c.name in commonNames))
     
     # return the first available connector from those listed in <tryConnectorNames>, skipping disabled connectors
     def _findAvailableConnector(self, tryConnectorNames):
@@ -278,36 +367,62 @@ class ScreenSituation:
             return c
         return None
     
-    # return resolutions available for both internal and external screen
+    def connectorByName(self, name):
+        for c in self.connectors:
+            if c.name == name:
+                return c
+        return None
+    
+    # return all connectors that have a screen attached
+    def connectedConnectors(self):
+        return [c for c in self.connectors if c.isConnected()]
+    
+    # return resolutions available for both internal and external screen, the largest first
     def commonResolutions(self):
         assert self.externalConnector is not None, "Common resolutions may only be queried if there is an external screen connected."
-        internalRes = self.internalConnector.getResolutionList()
-        externalRes = self.externalConnector.getResolutionList()
-        return sorted(set(externalRes).intersection(internalRes), key=lambda r: -r.pixelCount())
+        key = (self.internalConnector, self.externalConnector)
+        if key not in self._commonResolutions:
+            internalRes = set(self.internalConnector.getResolutionList())
+            self._commonResolutions[key] = tuple(r for r in self.externalConnector.getResolutionList() if r in internalRes) # already sorted
+        return self._commonResolutions[key]
     
-    # compute the xrandr call
-    def forXrandr(self, setup):
-        # turn all screens off
-        connectorArgs = {} # maps connector names to xrand arguments
-        for c in self.connectors:
-            connectorArgs[c.name] = ["--off"]
-        # set arguments for the relevant ones
-        connectorArgs[self.internalConnector.name] = setup.getInternalArgs()
+    # compute what the connectors should be doing for the given setup: maps connector names to None (off) or (resolution, position, primary)
+    def targetState(self, setup):
+        target = dict((c.name, None) for c in self.connectors)
+        intPos, extPos = setup.getPositions()
+        if setup.intResolution is not None:
+            target[self.internalConnector.name] = (setup.intResolution, intPos, not setup.extIsPrimary or setup.extResolution is None)
         if self.externalConnector is not None:
-            connectorArgs[self.externalConnector.name] = setup.getExternalArgs(self.internalConnector.name)
+            if setup.extResolution is not None:
+                target[self.externalConnector.name] = (setup.extResolution, extPos, setup.extIsPrimary)
         else:
             assert setup.extResolution is None, "There's no external screen to set a resolution for"
-        # now compose the arguments
-        call = ["xrandr"]
-        for name in connectorArgs:
-            call += ["--output", name] + connectorArgs[name]
-        return call
-
+        return target
+    
+    # compute the xrandr call, or None if all connectors are already set up as desired
+    def forXrandr(self, setup):
+        return self.xrandrCall(self.targetState(setup))
+    
+    # compute the xrandr call that brings the connectors to the given target state (see targetState), or None if there is nothing to do
+    def xrandrCall(self, target):
+        return xrandrCall(self.connectors, target)
+    
+    # check whether the connectors support the resolutions of the setup
+    def _isPossible(self, setup):
+        for connector, resolution in ((self.internalConnector, setup.intResolution), (self.externalConnector, setup.extResolution)):
+            if resolution is not None and resolution not in connector.getResolutionList():
+                return False
+        return True
+    
     def fetchDBInfo(self, db):
         if self.externalConnector and self.externalConnector.edid:
             self.previousSetup = db.getConfig(self.externalConnector.edid) # may also return None
         else:
             self.previousSetup = None
+        if self.previousSetup and not self._isPossible(self.previousSetup):
+            # e.g. the same screen was used with another internal screen
+            print("Known screen, but the previous setup is not possible any more:", self.previousSetup)
+            self.previousSetup = None
         if self.previousSetup:
             print("Known screen, previous setup:", self.previousSetup)
             self.externalConnector.previousResolution = self.previousSetup.extResolution
@@ -0,0 +1,167 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+# Resident command server: `lilass --server` keeps the config, the database and all modules loaded, and handles requests of
+# other lilass runs (e.g. from keybindings: `lilass -r mirror`, `lilass -i`) sent over a Unix socket. Those runs only have to
+# start the interpreter and forward their command line, which saves the imports and the setup of a normal run.
+
+'''
+The socket is $XDG_RUNTIME_DIR/lilass/lilass-<display>.sock, so only the user can connect, and every X display has its own
+server. The protocol is one JSON object per line and connection:
+
+  request:  {"argv": ["-r", "mirror"]}
+  response: {"handled": true, "exit": 0, "stdout": "...", "stderr": "..."}
+
+The server only handles runs that do not ask anything (see canHandle). If it turns out that it would have to ask after all
+(an unknown screen, without -r/-e/-i), it answers {"handled": false}, and the client does the run itself. So does the client if
+no server is running.
+
+This module is imported by every lilass run before anything else, so the client side must stay cheap: It imports nothing
+until it found a socket to talk to.
+'''
+import os, sys
+
+# options that are never forwarded: we are the server, or the run would not finish (or would not be like a normal run)
+_ownOptions = {"--server", "--no-server", "--daemon", "--displays", "-h", "--help"}
+
+def socketPath(display = None):
+    if display is None:
+        display = os.environ.get("DISPLAY", "")
+    d = os.environ.get("XDG_RUNTIME_DIR")
+    if not d:
+        return None # there is no safe place for the socket
+    return os.path.join(d, "lilass", "lilass-%s.sock" % display.replace("/", "_"))
+
+## client side
+
+def forward(argv, path = None, timeout = 60):
+    '''Send the command line <argv> to the server, if one is running. Prints what the server printed, and returns the exit code;
+       returns None if the run has to be done in this process.'''
+    if any(arg.split("=", 1)[0] in _ownOptions for arg in argv):
+        return None
+    if path is None:
+        path = socketPath()
+    if path is None or not os.path.exists(path):
+        return None
+    import socket, json
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(path)
+            s.sendall(json.dumps({"argv": list(argv)}).encode("utf-8") + b"\n")
+            with s.makefile("rb") as f:
+                response = json.loads(f.readline().decode("utf-8"))
+    except (OSError, ValueError):
+        # a stale socket (the server is gone), a server that takes too long, or one that died before answering
+        return None
+    if not response.get("handled"):
+        return None
+    sys.stdout.write(response.get("stdout", ""))
+    sys.stderr.write(response.get("stderr", ""))
+    return response.get("exit", 0)
+
+## server side
+
+class NeedsUser(Exception):
+    '''Raised by a request handler if the run has to ask the user; the client then does the run itself'''
+    pass
+
+class NoQuestions:
+    '''The frontend of the server: It does not ask, but sends the run back to the client.'''
+    def setup(self, situation):
+        raise NeedsUser()
+
+    def error(self, message):
+        print(message, file=sys.stderr)
+
+def canHandle(cmdArgs):
+    '''Whether a run with these command-line arguments can be done by the server: it must not ask anything, and must not depend
+       on being a separate process'''
+    if cmdArgs.trace or cmdArgs.probe or cmdArgs.frontend:
+        return False
+    # forward() only looks for the full option names, argparse also accepts abbreviations
+    if cmdArgs.server or cmdArgs.daemon or cmdArgs.displays or not cmdArgs.use_server:
+        return False
+    return bool(cmdArgs.query or cmdArgs.silent or cmdArgs.rel_position or cmdArgs.external_only or cmdArgs.internal_only or cmdArgs.layout)
+
+class Server:
+    '''Listens at <path> and calls <handle> with the argv of every request. <handle> returns the exit code, or None if the
+       request cannot be handled here; it may print, which is sent to the client.'''
+    def __init__(self, path, handle):
+        import socket
+        self._path = path
+        self._handle = handle
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        if os.path.exists(path):
+            if forward(["--query"], path, timeout = 5) is not None:
+                raise Exception("Another lilass server is already running at %s." % path)
+            os.unlink(path) # left behind by a server that did not exit cleanly
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        os.chmod(path, 0o600)
+        self._socket.listen(8)
+
+    def close(self):
+        self._socket.close()
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def _respond(self, request):
+        import io, contextlib
+        out, err = io.StringIO(), io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                code = self._handle(list(request["argv"]))
+        except NeedsUser:
+            return {"handled": False}
+        except SystemExit as e: # e.g. argparse did not like the arguments
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            err.write("%s\n" % e)
+            code = 1
+        if code is None:
+            return {"handled": False}
+        return {"handled": True, "exit": code, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+    def handleOne(self):
+        '''Wait for a request, and answer it'''
+        import json
+        conn, _ = self._socket.accept()
+        try:
+            with conn, conn.makefile("rb") as f:
+                try:
+                    request = json.loads(f.readline().decode("utf-8"))
+                except ValueError:
+                    return # not one of ours
+                conn.sendall(json.dumps(self._respond(request)).encode("utf-8") + b"\n")
+        except OSError:
+            pass # the client went away, e.g. because it gave up waiting; that is no reason for us to stop
+
+    def run(self):
+        '''Handle requests until we are killed'''
+        print("Listening at", self._path)
+        while True:
+            self.handleOne()
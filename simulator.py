@@ -0,0 +1,323 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# A simulated X server, to run the entire lilass flow (probe, database, apply) without a real one, and to replay recorded
+# sequences of screens being plugged in and out.
+
+'''
+The simulator keeps a model of the outputs: which screen (EDID and modes) is connected, and what the output is currently
+doing. It is a probe backend (it prints what `xrandr -q --verbose` would print), and it applies xrandr calls to its model
+like the X server would, failing like xrandr does for calls the hardware cannot do.
+
+A hotplug trace is a file with one JSON object per line (empty lines and lines starting with # are ignored):
+
+  {"event": "plug", "output": "HDMI-1", "screen": 1001}       a screen is connected; screens are identified by the
+                                                              serial number of their (synthetic) EDID
+  {"event": "unplug", "output": "HDMI-1"}
+  {"event": "dock", "screens": {"DP-1-1": 2001, "DP-1-2": 2002}}
+  {"event": "undock"}                                         unplugs all screens connected by the last dock event
+
+Every event can have a "time" (seconds since the start of the recording), which the replay ignores. Monitor flapping (a
+screen that keeps disconnecting, e.g. due to a bad cable) is just a quick sequence of unplug and plug events.
+'''
+import argparse, json, random, subprocess, time
+from binascii import hexlify
+import screen, synthetic, xrandr_parser, daemon, policy
+
+def simulatedScreen(serial):
+    '''The EDID and the modes (the preferred one first) of the screen with the given serial number'''
+    native = synthetic.standardResolutions[serial % 5] # from 3840x2160 to 1600x900
+    modes = [res for res in synthetic.standardResolutions if res[0] <= native[0] and res[1] <= native[1]]
+    return (synthetic.edid(serial, native = native, extensions = 1), modes)
+
+class SimulatedOutput:
+    def __init__(self, name, screen = None):
+        self.name = name
+        self.edid = None # bytes, or None if nothing is connected
+        self.modes = [] # list of (width, height), the preferred one first
+        self.current = None # ((width, height), (x, y)) if the output is on
+        if screen is not None:
+            self.plug(*screen)
+
+    def plug(self, edid, modes):
+        self.edid = edid
+        self.modes = list(modes)
+
+    def unplug(self):
+        # like the X server, we keep the output on until someone turns it off
+        self.edid = None
+        self.modes = []
+
+    def isConnected(self):
+        return bool(self.modes)
+
+class Simulator:
+    '''A simulated X server with the given outputs; the internal one has a screen connected. At most <crtcs> outputs can be on at the same time.'''
+    def __init__(self, internal = "eDP-1", outputs = ("HDMI-1", "DP-1", "DP-1-1", "DP-1-2", "DP-1-3"), crtcs = 3, maxSize = 16384):
+        self.outputs = [SimulatedOutput(internal, (synthetic.edid(0, native = (1920, 1080), extensions = 0), [(1920, 1080), (1600, 900), (1366, 768), (1280, 720)]))]
+        self.outputs += [SimulatedOutput(name) for name in outputs]
+        self.outputs[0].current = ((1920, 1080), (0, 0))
+        self.primary = internal
+        self.fb = (1920, 1080)
+        self.crtcs = crtcs
+        self.maxSize = maxSize
+        self.docked = [] # the outputs connected by the last dock event
+        self.backlightOn = True
+        # statistics
+        self.xrandrCalls = 0
+        self.modesets = 0 # number of outputs changed by xrandr calls
+
+    def output(self, name):
+        for o in self.outputs:
+            if o.name == name:
+                return o
+        raise KeyError(name)
+
+    ## the probe backend
+
+    def xrandrLines(self):
+        '''What `xrandr -q --verbose` prints'''
+        lines = ["Screen 0: minimum 8 x 8, current %d x %d, maximum %d x %d\n" % (self.fb + (self.maxSize, self.maxSize))]
+        for idx, o in enumerate(self.outputs):
+            line = "%s %s " % (o.name, "connected" if o.isConnected() else "disconnected")
+            if o.name == self.primary:
+                line += "primary "
+            if o.current is not None:
+                (w, h), (x, y) = o.current
+                line += "%dx%d+%d+%d (0x%x) " % (w, h, x, y, 0x100)
+            lines.append(line + "normal (normal left inverted right x axis y axis) 0mm x 0mm\n")
+            lines += ["\tIdentifier: 0x%x\n" % (0x40 + idx), "\tTimestamp:  139526085\n", "\tSubpixel:   unknown\n"]
+            if o.current is not None:
+                lines.append("\tCRTC:       %d\n" % idx)
+            if o.edid is not None:
+                lines.append("\tEDID: \n")
+                data = hexlify(o.edid).decode("ascii")
+                lines += ["\t\t%s\n" % data[i:i+32] for i in range(0, len(data), 32)]
+            for modeIdx, (w, h) in enumerate(o.modes):
+                flags = ""
+                if o.current is not None and o.current[0] == (w, h):
+                    flags += " *current"
+                if modeIdx == 0:
+                    flags += " +preferred"
+                lines.append("  %dx%d (0x%x) %.3fMHz +HSync -VSync%s\n" % (w, h, 0x100 + modeIdx, (w + 160) * (h + 35) * 60 / 1e6, flags))
+                lines.append("        h: width  %4d start %4d end %4d total %4d skew    0 clock  %.2fKHz\n" % (w, w + 48, w + 80, w + 160, (h + 35) * 60 / 1000))
+                lines.append("        v: height %4d start %4d end %4d total %4d           clock  60.00Hz\n" % (h, h + 3, h + 9, h + 35))
+        return lines
+
+    def getConnectors(self, current = False):
+        # the X server re-probes on hotplug, so there is no difference between the cached and the current state
+        return xrandr_parser.parse(self.xrandrLines())
+
+    @staticmethod
+    def isAvailable():
+        return True
+
+    ## applying xrandr calls
+
+    def _fail(self, args, message):
+        raise subprocess.CalledProcessError(1, args, output = message)
+
+    def runXrandr(self, args):
+        '''Applies an xrandr call to the model, like subprocess.check_call(args) would with a real X server'''
+        assert args[0] == "xrandr"
+        self.xrandrCalls += 1
+        fb = self.fb
+        changes = {} # maps output names to their new state (like SimulatedOutput.current)
+        primary = self.primary
+        output = None
+        i = 1
+        def value():
+            if i + 1 >= len(args):
+                self._fail(args, "%s needs an argument" % args[i])
+            return args[i + 1]
+        def size(text):
+            try:
+                w, h = text.split("x")
+                return (int(w), int(h))
+            except ValueError:
+                self._fail(args, "invalid size %s" % text)
+        while i < len(args):
+            arg = args[i]
+            if arg == "--fb":
+                fb = size(value())
+                i += 2
+            elif arg == "--output":
+                try:
+                    output = self.output(value())
+                except KeyError:
+                    self._fail(args, "warning: output %s not found" % value())
+                changes.setdefault(output.name, output.current)
+                i += 2
+            elif output is None:
+                self._fail(args, "%s needs an --output" % arg)
+            elif arg == "--off":
+                changes[output.name] = None
+                i += 1
+            elif arg in ("--mode", "--pos"):
+                current = changes[output.name]
+                mode, pos = current if current is not None else (None, (0, 0))
+                if arg == "--mode":
+                    mode = size(value())
+                    if mode not in output.modes:
+                        self._fail(args, "cannot find mode %s" % value())
+                else:
+                    pos = size(value())
+                changes[output.name] = (mode, pos)
+                i += 2
+            elif arg == "--auto":
+                if not output.isConnected():
+                    changes[output.name] = None
+                else:
+                    current = changes[output.name]
+                    changes[output.name] = (output.modes[0], current[1] if current is not None else (0, 0))
+                i += 1
+            elif arg == "--primary":
+                primary = output.name
+                i += 1
+            else:
+                self._fail(args, "unrecognized option %s" % arg)
+        # check whether the hardware can do this
+        state = dict((o.name, changes.get(o.name, o.current)) for o in self.outputs)
+        for name, current in state.items():
+            if current is None:
+                continue
+            (w, h), (x, y) = current
+            if current[0] is None:
+                self._fail(args, "output %s has no mode" % name)
+            if x + w > fb[0] or y + h > fb[1]:
+                self._fail(args, "output %s does not fit into the screen of size %dx%d" % (name, fb[0], fb[1]))
+        if len([s for s in state.values() if s is not None]) > self.crtcs:
+            self._fail(args, "cannot find crtc")
+        if fb[0] > self.maxSize or fb[1] > self.maxSize:
+            self._fail(args, "screen cannot be larger than %dx%d" % (self.maxSize, self.maxSize))
+        # apply it
+        for o in self.outputs:
+            if o.name in changes and changes[o.name] != o.current:
+                o.current = changes[o.name]
+                self.modesets += 1
+        self.fb = fb
+        self.primary = primary if primary is not None and state[primary] is not None else None
+
+    def turnOnBacklight(self):
+        self.backlightOn = True
+
+    def state(self):
+        '''Maps the output names to None (off) or (resolution, position, primary), like ScreenSituation.targetState'''
+        return dict((o.name, None if o.current is None else (screen.Resolution(*o.current[0]), o.current[1], o.name == self.primary)) for o in self.outputs)
+
+    ## hotplug events
+
+    def handleEvent(self, event):
+        kind = event["event"]
+        if kind == "plug":
+            self.output(event["output"]).plug(*simulatedScreen(event["screen"]))
+        elif kind == "unplug":
+            self.output(event["output"]).unplug()
+        elif kind == "dock":
+            for name, serial in sorted(event["screens"].items()):
+                self.output(name).plug(*simulatedScreen(serial))
+            self.docked = sorted(event["screens"].keys())
+        elif kind == "undock":
+            for name in self.docked:
+                self.output(name).unplug()
+            self.docked = []
+        else:
+            raise Exception("Unknown event %s" % kind)
+
+## traces
+
+def loadTrace(file):
+    '''Reads a hotplug trace from a file object'''
+    for line in file:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        yield json.loads(line)
+
+def dumpTrace(events, file):
+    for event in events:
+        file.write(json.dumps(event, sort_keys=True) + "\n")
+
+def randomTrace(count, seed = 0, ports = ("HDMI-1", "DP-1"), dock = ("DP-1-1", "DP-1-2", "DP-1-3"), screens = 20):
+    '''A trace of <count> events: screens being plugged in and out of <ports>, docking and undocking with up to two screens on
+       the <dock> outputs (the third one stays free, since there are just three CRTCs), and flapping monitors.'''
+    rnd = random.Random(seed)
+    plugged = {} # maps ports to screens
+    docked = False
+    events = []
+    while len(events) < count:
+        choice = rnd.random()
+        if choice < 0.2:
+            if docked:
+                events.append({"event": "undock"})
+            else:
+                outputs = rnd.sample(dock[:2], rnd.randint(1, 2))
+                events.append({"event": "dock", "screens": dict((o, 1000 + rnd.randrange(screens)) for o in outputs)})
+            docked = not docked
+        elif choice < 0.3 and plugged:
+            # flapping: the screen goes away and comes back a few times
+            port = rnd.choice(sorted(plugged.keys()))
+            for i in range(rnd.randint(2, 4)):
+                events += [{"event": "unplug", "output": port}, {"event": "plug", "output": port, "screen": plugged[port]}]
+        else:
+            port = rnd.choice(ports)
+            if port in plugged:
+                events.append({"event": "unplug", "output": port})
+                del plugged[port]
+            else:
+                plugged[port] = 1000 + rnd.randrange(screens)
+                events.append({"event": "plug", "output": port, "screen": plugged[port]})
+    for i, event in enumerate(events[:count]):
+        event["time"] = i * 0.5
+    return events[:count]
+
+## replay
+
+class _NoFrontend:
+    def setup(self, situation):
+        raise Exception("Cannot ask the user during a replay, please give a default setup")
+
+    def error(self, message):
+        raise Exception(message)
+
+def replayArgs(**args):
+    '''The command-line arguments for a replay: `lilass -s -r right`, unless overwritten by <args>'''
+    result = argparse.Namespace(silent = True, rel_position = "right", external_only = False, internal_only = False, layout = None)
+    for key, value in args.items():
+        setattr(result, key, value)
+    return result
+
+def replay(events, simulator, cmdArgs = None, db = None):
+    '''Replays the hotplug <events> through the daemon's event handling, the database <db> (if not None) and the apply path, and checks
+       that the simulator ends up in the state lilass wanted after every event. Returns the time every event took, in seconds.'''
+    if cmdArgs is None:
+        cmdArgs = replayArgs()
+    def handler(situation):
+        setup = policy.chooseSetup(situation, cmdArgs, _NoFrontend(), db)
+        policy.applySetup(situation, setup, runXrandr = simulator.runXrandr, backlight = simulator.turnOnBacklight)
+        expected = policy.targetState(situation, setup)
+        if simulator.state() != expected:
+            raise Exception("Simulator is in state %s, but lilass wanted %s" % (simulator.state(), expected))
+    d = daemon.Daemon(lambda: screen.ScreenSituation(None, probe = simulator, fastProbe = True), handler)
+    times = []
+    for event in [None] + list(events):
+        start = time.perf_counter()
+        if event is not None:
+            simulator.handleEvent(event)
+        d.handleEvent(daemon.HotplugEvent(event.get("output") if event else None, None))
+        times.append(time.perf_counter() - start)
+    return times[1:] # without the initial setup
@@ -0,0 +1,107 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Generate synthetic test data: EDIDs and `xrandr -q --verbose` dumps of arbitrary size.
+
+import struct
+from binascii import hexlify
+
+# the resolutions real screens usually have, so that synthetic screens have some in common
+standardResolutions = [(3840, 2160), (2560, 1440), (1920, 1200), (1920, 1080), (1680, 1050), (1600, 900), (1366, 768),
+                       (1280, 1024), (1280, 800), (1280, 720), (1024, 768), (800, 600), (640, 480)]
+
+def _checksum(block):
+    return bytes(block) + bytes([(-sum(block)) & 0xff])
+
+def _detailedTiming(width, height, widthMm, heightMm):
+    hblank, vblank, hsync, hsyncWidth, vsync, vsyncWidth = 160, 35, 48, 32, 3, 6
+    clock = (width + hblank) * (height + vblank) * 60 // 10000 # in units of 10kHz, for 60Hz
+    return struct.pack("<H", clock) + bytes([
+        width & 0xff, hblank & 0xff, ((width >> 8) << 4) | (hblank >> 8),
+        height & 0xff, vblank & 0xff, ((height >> 8) << 4) | (vblank >> 8),
+        hsync & 0xff, hsyncWidth & 0xff, ((vsync & 0xf) << 4) | (vsyncWidth & 0xf),
+        ((hsync >> 8) << 6) | ((hsyncWidth >> 8) << 4) | ((vsync >> 4) << 2) | (vsyncWidth >> 4),
+        widthMm & 0xff, heightMm & 0xff, ((widthMm >> 8) << 4) | (heightMm >> 8),
+        0, 0, 0x18])
+
+def _textDescriptor(tag, text):
+    text = text.encode("ascii")[:13]
+    if len(text) < 13:
+        text += b"\n" + b" " * (12 - len(text))
+    return bytes([0, 0, 0, tag, 0]) + text
+
+def edid(serial, name = "LiLaSS Test", vendor = "LLS", product = 0x1234, native = (1920, 1200), size = (520, 320), extensions = 1):
+    '''Returns the bytes of a valid EDID (128 bytes, plus 128 bytes for every extension block)'''
+    manufacturer = ((ord(vendor[0]) - 64) << 10) | ((ord(vendor[1]) - 64) << 5) | (ord(vendor[2]) - 64)
+    block = struct.pack(">Q", 0x00ffffffffffff00) + struct.pack(">H", manufacturer) + struct.pack("<HI", product, serial & 0xffffffff)
+    block += bytes([1, 25, 1, 4, 0x80, size[0] // 10, size[1] // 10, 120, 0x0a])
+    block += bytes([0xee, 0x95, 0xa3, 0x54, 0x4c, 0x99, 0x26, 0x0f, 0x50, 0x54]) # chromaticity
+    block += bytes([0x21, 0x08, 0x00]) + b"\x01\x01" * 8 # established and standard timings
+    block += _detailedTiming(native[0], native[1], size[0], size[1])
+    block += _textDescriptor(0xfc, name)
+    block += _textDescriptor(0xff, "%d" % serial)
+    block += bytes([0, 0, 0, 0x10]) + bytes(14) # dummy descriptor
+    block += bytes([extensions])
+    result = _checksum(block)
+    for i in range(extensions):
+        # a CEA-861 extension block without data blocks, listing one more detailed timing
+        ext = bytes([0x02, 0x03, 4, 0]) + _detailedTiming(1920, 1080, size[0], size[1])
+        result += _checksum(ext + bytes(127 - len(ext)))
+    return result
+
+def modeList(count):
+    '''Returns <count> distinct resolutions, starting with the standard ones'''
+    result = list(standardResolutions[:count])
+    width = 640
+    while len(result) < count:
+        width += 8
+        res = (width, width * 9 // 16)
+        if res not in result:
+            result.append(res)
+    return result
+
+def xrandrDump(connectors = 8, modes = 300, extensions = 1, connected = None, internal = "eDP-1"):
+    '''Returns the lines of a `xrandr -q --verbose` dump with an internal screen and <connectors> external connectors called DP-1-<n>.
+       <connected> is the number of those that have a screen connected (default: all of them).'''
+    if connected is None:
+        connected = connectors
+    lines = ["Screen 0: minimum 8 x 8, current 1920 x 1080, maximum 32767 x 32767\n"]
+    outputs = [(internal, True, modeList(min(modes, 30)), 0)]
+    for i in range(connectors):
+        outputs.append(("DP-1-%d" % i, i < connected, modeList(modes), 1000 + i))
+    for name, isConnected, resolutions, serial in outputs:
+        if not isConnected:
+            lines.append("%s disconnected (normal left inverted right x axis y axis)\n" % name)
+            lines += ["\tIdentifier: 0x%x\n" % (0x40 + serial % 1000), "\tTimestamp:  139526085\n", "\tSubpixel:   unknown\n", "\tClones:    \n",
+                      "\tCRTCs:      0 1 2\n"]
+            continue
+        width, height = resolutions[0]
+        lines.append("%s connected %dx%d+0+0 (0x%x) normal (normal left inverted right x axis y axis) 520mm x 320mm\n" % (name, width, height, 0x100))
+        lines += ["\tIdentifier: 0x%x\n" % (0x40 + serial % 1000), "\tTimestamp:  139526085\n", "\tSubpixel:   unknown\n", "\tClones:    \n",
+                  "\tCRTC:       0\n", "\tCRTCs:      0 1 2\n",
+                  "\tTransform:  1.000000 0.000000 0.000000\n", "\t            0.000000 1.000000 0.000000\n", "\t            0.000000 0.000000 1.000000\n",
+                  "\t           filter: \n", "\tEDID: \n"]
+        data = hexlify(edid(serial, native = (width, height), extensions = extensions if serial else 0)).decode("ascii")
+        lines += ["\t\t%s\n" % data[i:i+32] for i in range(0, len(data), 32)]
+        lines += ["\tBroadcast RGB: Automatic \n", "\t\tsupported: Automatic, Full, Limited 16:235\n",
+                  "\taudio: auto \n", "\t\tsupported: force-dvi, off, auto, on\n"]
+        for idx, (w, h) in enumerate(resolutions):
+            flags = " *current +preferred" if idx == 0 else ""
+            lines.append("  %dx%d (0x%x) %.3fMHz +HSync -VSync%s\n" % (w, h, 0x100 + idx, (w + 160) * (h + 35) * 60 / 1e6, flags))
+            lines.append("        h: width  %4d start %4d end %4d total %4d skew    0 clock  %.2fKHz\n" % (w, w + 48, w + 80, w + 160, (h + 35) * 60 / 1000))
+            lines.append("        v: height %4d start %4d end %4d total %4d           clock  60.00Hz\n" % (h, h + 3, h + 9, h + 35))
+    return lines
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import unittest
-import screen
-import os
+import screen, edid, daemon, probe, xrandr_parser, synthetic, gui, benchmark, tracing, database, layout, simulator, pipeline, coordination, replaycache, multiseat, backlight, server
+import os, sys, subprocess, json, tempfile, sqlite3, threading, contextlib, io, time, argparse
 
 class TestResolutions(unittest.TestCase):
 
@@ -14,6 +14,22 @@ class TestResolutions(unittest.TestCase):
         self.assertEqual(str(screen.Resolution(1920, 1200)), '1920x1200 (16:10)')
         self.assertEqual(str(screen.Resolution(720, 480)), '720x480 (3:2)')
 
+    def test_mode_index(self):
+        # resolutions are interned
+        self.assertIs(screen.Resolution(1920, 1080), screen.Resolution.fromDatabase("1920x1080"))
+        with open(os.path.join('xrandr-tests', 'with-extern')) as file:
+            s = screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = file)
+        hdmi = s.externalConnector
+        self.assertIs(hdmi.getResolutionList(), hdmi.getResolutionList())
+        self.assertEqual(hdmi.getResolutionList()[0], screen.Resolution(1920, 1200))
+        self.assertEqual(hdmi.getResolutionsByRatio()['16:10'][0], screen.Resolution(1920, 1200))
+        self.assertEqual(hdmi.getRefreshRates(screen.Resolution(1920, 1200)), [59.95])
+        # the common resolutions are computed once, and sorted
+        common = s.commonResolutions()
+        self.assertIs(common, s.commonResolutions())
+        self.assertEqual(list(common), sorted(common, key=screen.Resolution.sortKey))
+        self.assertTrue(all(r in s.internalConnector.getResolutionList() for r in common))
+
     def test_xrandr(self):
         internalConnectors = list(screen.commonInternalConnectorNames())
         for file in os.listdir('xrandr-tests'):
@@ -22,5 +38,905 @@ class TestResolutions(unittest.TestCase):
                 s = screen.ScreenSituation(internalConnectors, xrandrSource = file)
                 del(s)
 
+class TestParser(unittest.TestCase):
+
+    def test_fixtures(self):
+        # str and bytes input must give the same result
+        for file in os.listdir('xrandr-tests'):
+            with open(os.path.join('xrandr-tests', file)) as f:
+                fromStr = xrandr_parser.parse(f)
+            with open(os.path.join('xrandr-tests', file), 'rb') as f:
+                fromBytes = xrandr_parser.parse(f)
+            self.assertEqual(list(map(repr, fromStr)), list(map(repr, fromBytes)))
+        # check what we got for a screen with EDID
+        with open(os.path.join('xrandr-tests', 'with-extern'), 'rb') as f:
+            connectors = xrandr_parser.parse(f)
+        self.assertEqual([c.name for c in connectors], ['LVDS1', 'DP1', 'HDMI1', 'VGA1'])
+        self.assertEqual([c.isConnected() for c in connectors], [True, False, True, False])
+        hdmi = connectors[2]
+        self.assertEqual(hdmi.getPreferredResolution(), screen.Resolution(1920, 1200))
+        self.assertEqual(len(hdmi.getResolutionList()), 10)
+        self.assertEqual(len(hdmi.edid), 128)
+        self.assertTrue(hdmi.edid.hex().startswith('00ffffffffffff0010ac7aa04c374c32'))
+        self.assertTrue(hdmi.edid.hex().endswith('00323d1e5311000a2020202020200050'))
+        self.assertEqual(connectors[0].getPreferredResolution(), screen.Resolution(1366, 768))
+
+    def test_synthetic(self):
+        connectors = xrandr_parser.parse(synthetic.xrandrDump(connectors = 3, modes = 50, extensions = 2, connected = 2))
+        self.assertEqual([c.name for c in connectors], ['eDP-1', 'DP-1-0', 'DP-1-1', 'DP-1-2'])
+        self.assertEqual([c.isConnected() for c in connectors], [True, True, True, False])
+        self.assertEqual(len(connectors[1].getResolutionList()), 50)
+        self.assertEqual(len(connectors[1].edid), 3*128)
+
+class TestEdid(unittest.TestCase):
+
+    def test_decode(self):
+        with open(os.path.join('xrandr-tests', 'with-extern')) as f:
+            dell = xrandr_parser.parse(f)[2].edid
+        self.assertTrue(dell.isValid())
+        self.assertEqual((dell.vendor(), dell.name(), dell.physicalSize()), ("DEL", "DELL U2412M", (518, 324)))
+        self.assertEqual(dell.nativeTiming()[:2], (1920, 1200))
+        self.assertEqual(round(dell.nativeTiming().refreshRate, 2), 59.95)
+        # synthetic EDIDs of 256 bytes and more
+        for extensions in (1, 2, 5):
+            e = edid.Edid(synthetic.edid(4711, name = "Synthetic", vendor = "SYN", product = 0x42, native = (2560, 1440), size = (600, 340), extensions = extensions))
+            self.assertEqual(len(e), 128 * (extensions + 1))
+            self.assertTrue(e.isValid())
+            self.assertEqual((e.vendor(), e.product(), e.serial(), e.name(), e.serialText()), ("SYN", 0x42, 4711, "Synthetic", "4711"))
+            self.assertEqual((e.nativeTiming()[:2], e.physicalSize()), ((2560, 1440), (600, 340)))
+            self.assertEqual((e.extensionCount(), e.extensionTags()), (extensions, [0x02] * extensions))
+            self.assertEqual(e.fingerprint(), database.edidFingerprint(e.data))
+            self.assertEqual(edid.Edid.fromHex(e.hex()), e)
+        # broken ones
+        data = bytearray(synthetic.edid(1))
+        data[20] ^= 1
+        self.assertFalse(edid.Edid(data).checksumValid())
+        truncated = edid.Edid(synthetic.edid(1)[:100])
+        self.assertEqual((truncated.isValid(), truncated.nativeTiming(), truncated.name()), (False, None, None))
+        # truncated ones decode as far as they go
+        truncated = edid.Edid(synthetic.edid(1, size = (600, 340))[:100])
+        self.assertEqual((truncated.nativeTiming(), truncated.name(), truncated.physicalSize()), (None, None, (600, 340)))
+        for length in (0, 5, 11, 20):
+            truncated = edid.Edid(synthetic.edid(1)[:length])
+            self.assertFalse(truncated.isValid())
+            self.assertEqual((truncated.physicalSize(), truncated.nativeTiming(), truncated.extensionTags()), (None, None, []))
+            self.assertEqual(truncated.vendor() is None, length < 10)
+            self.assertEqual(truncated.fingerprint().startswith("???-0000-00000000-"), length < 16)
+
+    def test_preferred_fallback(self):
+        # without a preferred mode from the probe, the native mode in the EDID wins over the largest one
+        c = screen.Connector("DP-1")
+        c.edid = edid.Edid(synthetic.edid(1, native = (1920, 1080)))
+        for res in [(3840, 2160), (1920, 1080), (1280, 720)]:
+            c.addResolution(screen.Resolution(*res))
+        self.assertEqual(c.getPreferredResolution(), screen.Resolution(1920, 1080))
+        c.edid = edid.Edid(synthetic.edid(1, native = (1600, 900)))
+        self.assertEqual(c.getPreferredResolution(), screen.Resolution(3840, 2160)) # not one of the modes
+
+class TestApply(unittest.TestCase):
+
+    def test_incremental(self):
+        with open(os.path.join('xrandr-tests', 'with-extern')) as file:
+            s = screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = file)
+        hdmi = s.externalConnector
+        self.assertEqual((hdmi.currentResolution, hdmi.currentPosition, hdmi.isPrimary, hdmi.crtc), (screen.Resolution(1920, 1200), (0, 0), True, 0))
+        R, P = screen.Resolution, screen.RelativeScreenPosition
+        # that is what we have already
+        self.assertIsNone(s.forXrandr(screen.ScreenSetup(None, R(1920, 1200))))
+        # only the internal screen has to be changed
+        self.assertEqual(s.forXrandr(screen.ScreenSetup(R(1366, 768), R(1920, 1200), P.LEFT)),
+                         ['xrandr', '--fb', '3286x1200', '--output', 'LVDS1', '--mode', '1366x768', '--pos', '1920x0'])
+        self.assertEqual(s.forXrandr(screen.ScreenSetup(R(1366, 768), R(1920, 1200), P.BELOW, False)),
+                         ['xrandr', '--fb', '1920x1968', '--output', 'LVDS1', '--mode', '1366x768', '--pos', '0x0', '--primary',
+                          '--output', 'HDMI1', '--mode', '1920x1200', '--pos', '0x768'])
+        self.assertEqual(s.forXrandr(screen.ScreenSetup(R(1366, 768), None)),
+                         ['xrandr', '--fb', '1366x768', '--output', 'LVDS1', '--mode', '1366x768', '--pos', '0x0', '--primary', '--output', 'HDMI1', '--off'])
+
+class TestProbe(unittest.TestCase):
+
+    def test_backend(self):
+        class FileProbe:
+            def getConnectors(self):
+                with open(os.path.join('xrandr-tests', 'with-extern')) as file:
+                    return xrandr_parser.parse(file)
+        s = screen.ScreenSituation(list(screen.commonInternalConnectorNames()), probe = FileProbe())
+        self.assertEqual(s.externalConnector.name, 'HDMI1')
+        self.assertEqual(probe.getProbe('xrandr', ':1').xrandrArgs(), ['xrandr', '--display', ':1', '-q', '--verbose'])
+
+    def test_fast_probe(self):
+        class FileProbe:
+            def __init__(self, current, full):
+                self.files = {True: current, False: full}
+                self.calls = []
+            def getConnectors(self, current = False):
+                self.calls.append(current)
+                with open(os.path.join('xrandr-tests', self.files[current])) as file:
+                    return xrandr_parser.parse(file)
+        internalConnectors = list(screen.commonInternalConnectorNames())
+        # cached state is fine
+        p = FileProbe('with-extern', 'with-extern')
+        s = screen.ScreenSituation(screen.commonInternalConnectorNames(), probe = p, fastProbe = True)
+        self.assertEqual((s.probeMode, p.calls), ('current', [True]))
+        # cached state has a connected external screen without EDID, so we re-probe
+        p = FileProbe('no-EDID', 'with-extern')
+        s = screen.ScreenSituation(internalConnectors, probe = p, fastProbe = True)
+        self.assertEqual((s.probeMode, p.calls), ('full', [True, False]))
+        self.assertEqual(s.externalConnector.name, 'HDMI1')
+
+    def test_sysfs(self):
+        with tempfile.TemporaryDirectory() as root:
+            def connector(name, status, modes = (), edid = b""):
+                os.mkdir(os.path.join(root, name))
+                for file, content in (("status", status + "\n"), ("enabled", "disabled\n"), ("modes", "".join(m + "\n" for m in modes))):
+                    with open(os.path.join(root, name, file), "w") as f:
+                        f.write(content)
+                with open(os.path.join(root, name, "edid"), "wb") as f:
+                    f.write(edid)
+            os.mkdir(os.path.join(root, "card0")) # not a connector
+            connector("card0-eDP-1", "connected", ["1920x1080", "1280x720"])
+            connector("card0-HDMI-A-1", "connected", ["2560x1440", "1920x1080", "1920x1080i"], synthetic.edid(42))
+            connector("card0-DP-1", "disconnected")
+            self.assertEqual([c.name for c in probe.SysfsProbe(root = root, naming = "intel").getConnectors()], ['DP1', 'HDMI1', 'eDP1'])
+            s = screen.ScreenSituation(None, probe = probe.SysfsProbe(root = root))
+            self.assertEqual((s.internalConnector.name, s.externalConnector.name), ('eDP-1', 'HDMI-1'))
+            self.assertEqual(s.externalConnector.getPreferredResolution(), screen.Resolution(2560, 1440))
+            self.assertEqual(s.externalConnector.edid.data, synthetic.edid(42))
+            # we do not know what the connectors are doing, so everything is set
+            self.assertEqual(s.forXrandr(screen.ScreenSetup(screen.Resolution(1920, 1080), None)),
+                             ['xrandr', '--fb', '1920x1080', '--output', 'DP-1', '--off', '--output', 'HDMI-1', '--off',
+                              '--output', 'eDP-1', '--mode', '1920x1080', '--pos', '0x0', '--primary'])
+
+class TestLayout(unittest.TestCase):
+
+    def test_solve(self):
+        R, P = screen.Resolution, screen.RelativeScreenPosition
+        resolutions = {"A": R(1920, 1080), "B": R(2560, 1440), "C": R(1280, 1024), "D": R(1920, 1080)}
+        placements = [layout.Placement("A", None, None, None), layout.Placement("B", None, P.RIGHT, "A"),
+                      layout.Placement("C", None, P.LEFT, "A"), layout.Placement("D", None, P.LEFT, "A")]
+        # D is pushed past C, and everything is moved to (0, 0)
+        self.assertEqual(dict(layout.solve(placements, resolutions)), {"D": (0, 0), "C": (1920, 0), "A": (3200, 0), "B": (5120, 0)})
+        with self.assertRaises(Exception):
+            layout.Layout([layout.Placement("A", None, P.LEFT, "B"), layout.Placement("B", None, P.LEFT, "A")]).solve(None)
+
+    def test_apply(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            s = screen.ScreenSituation(["eDP-1"], xrandrSource = synthetic.xrandrDump(connectors = 3, modes = 20))
+            l = layout.Layout(map(layout.parsePlacement, ["DP-1-0", "eDP-1@1280x720:below:DP-1-0", "DP-1-1@1920x1080:right:DP-1-0"]))
+            self.assertEqual(str(l), "DP-1-0, eDP-1@1280x720:below:DP-1-0, DP-1-1@1920x1080:right:DP-1-0")
+            # one call for everything; DP-1-0 already shows its preferred mode at (0, 0), but it becomes primary
+            self.assertEqual(s.xrandrCall(l.targetState(s)),
+                             ['xrandr', '--fb', '5760x2880', '--output', 'eDP-1', '--mode', '1280x720', '--pos', '0x2160',
+                              '--output', 'DP-1-0', '--mode', '3840x2160', '--pos', '0x0', '--primary',
+                              '--output', 'DP-1-1', '--mode', '1920x1080', '--pos', '3840x0', '--output', 'DP-1-2', '--off'])
+            # the layout is stored by the set of screens
+            with database.Database(os.path.join(tmp, "collected_data.sqlite")) as db:
+                db.putLayout(*layout.forDatabase(l, s))
+                stored = db.getLayout(layout.layoutKey(reversed(s.connectedConnectors())))
+            self.assertEqual(str(layout.fromDatabase(stored, s)), str(l))
+
+    def test_stored(self):
+        import policy
+        with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            s = screen.ScreenSituation(["eDP-1"], xrandrSource = synthetic.xrandrDump(connectors = 3, modes = 20))
+            args = lambda **kwargs: argparse.Namespace(**dict(dict(layout=None, external_only=False, internal_only=False, rel_position=None), **kwargs))
+            l = layout.Layout(map(layout.parsePlacement, ["DP-1-0", "eDP-1@1280x720:below:DP-1-0", "DP-1-1:right:DP-1-0"]))
+            with database.Database(os.path.join(tmp, "collected_data.sqlite")) as db:
+                db.putLayout(*layout.forDatabase(l, s))
+                # -r/-e/-i are only for screens we do not know (e.g. `lilass -s -r mirror` from x-on-resize)
+                for kwargs in ({}, dict(rel_position="mirror"), dict(internal_only=True)):
+                    self.assertEqual(str(policy.chooseLayout(s, args(**kwargs), db)), str(l))
+                # a mode that is gone: the stored layout is ignored
+                db.putLayout(*layout.forDatabase(layout.Layout(map(layout.parsePlacement, ["DP-1-0", "eDP-1@1234x567:below:DP-1-0", "DP-1-1:right:DP-1-0"])), s))
+                self.assertIsNone(policy.chooseLayout(s, args(), db))
+
+    def test_identical_screens(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            s = screen.ScreenSituation(["eDP-1"], xrandrSource = synthetic.xrandrDump(connectors = 3, modes = 20))
+            # two screens of the same model, without serial numbers
+            for name in ("DP-1-0", "DP-1-1"):
+                s.connectorByName(name).edid = edid.Edid(synthetic.edid(0))
+            self.assertEqual(len(set(layout.screenKeys(s.connectedConnectors()).values())), len(s.connectedConnectors()))
+            l = layout.Layout(map(layout.parsePlacement, ["DP-1-1", "eDP-1:below:DP-1-1", "DP-1-0:right:DP-1-1"]))
+            with database.Database(os.path.join(tmp, "collected_data.sqlite")) as db:
+                db.putLayout(*layout.forDatabase(l, s))
+                stored = db.getLayout(layout.layoutKey(reversed(s.connectedConnectors())))
+            self.assertEqual(str(layout.fromDatabase(stored, s)), str(l))
+
+class TestSimulator(unittest.TestCase):
+
+    def test_replay(self):
+        events = simulator.randomTrace(300, seed = 1)
+        self.assertEqual(set(e["event"] for e in events), {"plug", "unplug", "dock", "undock"})
+        # traces survive being written to a file
+        with tempfile.TemporaryFile("w+") as f:
+            simulator.dumpTrace(events, f)
+            f.seek(0)
+            self.assertEqual(list(simulator.loadTrace(f)), events)
+        with tempfile.TemporaryDirectory() as tmp:
+            sim = simulator.Simulator()
+            with database.Database(os.path.join(tmp, "collected_data.sqlite")) as db:
+                times = simulator.replay(events, sim, db = db) # raises if the simulator ends up in the wrong state
+            self.assertEqual(len(times), 300)
+            self.assertLess(sim.xrandrCalls, 300)
+        # in the end, the internal screen is on, and the external one on the right
+        state = sim.state()
+        situation = screen.ScreenSituation(None, probe = sim)
+        if situation.externalConnector is not None:
+            intRes, intPos, intPrimary = state["eDP-1"]
+            self.assertEqual(state[situation.externalConnector.name][1], (intRes.width, 0))
+
+    def test_xrandr(self):
+        sim = simulator.Simulator()
+        sim.handleEvent({"event": "dock", "screens": {"DP-1-1": 1001, "DP-1-2": 1002}})
+        sim.handleEvent({"event": "plug", "output": "HDMI-1", "screen": 1003})
+        # a layout in one call
+        s = screen.ScreenSituation(None, probe = sim)
+        l = layout.Layout(map(layout.parsePlacement, ["DP-1-1", "DP-1-2:right:DP-1-1", "eDP-1:below:DP-1-1"]))
+        sim.runXrandr(s.xrandrCall(l.targetState(s)))
+        self.assertEqual(sim.state(), l.targetState(s))
+        self.assertEqual((sim.xrandrCalls, sim.modesets), (1, 3))
+        # but there are only three CRTCs
+        with self.assertRaises(subprocess.CalledProcessError):
+            sim.runXrandr(["xrandr", "--output", "HDMI-1", "--auto"])
+        with self.assertRaises(subprocess.CalledProcessError):
+            sim.runXrandr(["xrandr", "--output", "DP-1-1", "--mode", "1234x567"])
+
+class TestPipeline(unittest.TestCase):
+
+    def test_dependencies(self):
+        order = []
+        release = threading.Event()
+        steps = pipeline.Pipeline()
+        steps.add("slow", lambda: (release.wait(), order.append("slow"), 1)[-1])
+        steps.add("fast", lambda: (order.append("fast"), 2)[-1])
+        steps.add("sum", lambda a, b: a + b, "slow", "fast")
+        steps.add("fail", lambda: 1 // 0)
+        steps.add("after-fail", lambda x: x, "fail")
+        self.assertEqual(steps.result("fast"), 2) # does not wait for the slow one
+        release.set()
+        self.assertEqual(steps.result("sum"), 3)
+        self.assertEqual(order, ["fast", "slow"])
+        with self.assertRaises(ZeroDivisionError):
+            steps.result("after-fail")
+
+    def test_prefetched_probe(self):
+        sim = simulator.Simulator()
+        calls = []
+        def prefetched():
+            calls.append("prefetched")
+            return sim.getConnectors(current = True)
+        p = probe.PrefetchedProbe(sim, True, prefetched)
+        s = screen.ScreenSituation(None, probe = p, fastProbe = True)
+        self.assertEqual((s.probeMode, calls), ('current', ['prefetched']))
+        # the prefetched connectors are only used once
+        p.getConnectors(current = True)
+        self.assertEqual(calls, ['prefetched'])
+
+class TestCoordination(unittest.TestCase):
+
+    def test_hand_off(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            started, release = threading.Event(), threading.Event()
+            calls = []
+            def work():
+                calls.append("work")
+                started.set()
+                release.wait()
+            results = []
+            leader = threading.Thread(target=lambda: results.append(coordination.RunLock(":7", tmp).run(work, lambda: calls.append("rerun"), window = 0.05)))
+            leader.start()
+            started.wait()
+            # a burst of runs while the first one is busy: they all hand off, and are handled by one more round
+            for i in range(5):
+                self.assertFalse(coordination.RunLock(":7", tmp).run(lambda: calls.append("other"), None))
+            release.set()
+            leader.join()
+            self.assertEqual((results, calls), ([True], ["work", "rerun"]))
+            # another display is independent
+            self.assertTrue(coordination.RunLock(":8", tmp).run(lambda: calls.append("other"), None))
+
+    def test_leading_edge(self):
+        # without other requests, the work starts right away, no matter how long the debounce window is
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.monotonic()
+            self.assertTrue(coordination.RunLock(":7", tmp).run(lambda: None, None, window = 5))
+            self.assertLess(time.monotonic() - start, 1)
+
+    def test_other_options(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            started, release = threading.Event(), threading.Event()
+            calls = []
+            def work():
+                calls.append("work")
+                started.set()
+                release.wait()
+            leader = threading.Thread(target=lambda: coordination.RunLock(":7", tmp, key = "mirror").run(work, lambda: calls.append("rerun")))
+            leader.start()
+            started.wait()
+            # a run with other options does not hand off, it waits and does its own work; one with the same options hands off
+            other = threading.Thread(target=lambda: calls.append(coordination.RunLock(":7", tmp, key = "internal").run(lambda: calls.append("internal"), None)))
+            other.start()
+            self.assertFalse(coordination.RunLock(":7", tmp, key = "mirror").run(None, None))
+            time.sleep(0.05)
+            self.assertEqual(calls, ["work"])
+            release.set()
+            leader.join()
+            other.join()
+            self.assertEqual(calls, ["work", "rerun", "internal", True])
+
+    def test_concurrent_database(self):
+        # several runs creating and writing the database at the same time
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "collected_data.sqlite")
+            setup = screen.ScreenSetup(screen.Resolution(1366, 768), screen.Resolution(1920, 1200), screen.RelativeScreenPosition.LEFT)
+            errors = []
+            def run(serial):
+                try:
+                    with database.Database(path) as db:
+                        db.putConfig(synthetic.edid(serial).hex(), setup)
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=run, args=(serial,)) for serial in range(8)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            self.assertEqual(errors, [])
+            with database.Database(path, readOnly = True) as db:
+                self.assertTrue(all(db.getConfig(synthetic.edid(serial).hex()) for serial in range(8)))
+
+class TestReplayCache(unittest.TestCase):
+
+    def test_invalidation(self):
+        with tempfile.TemporaryDirectory() as tmp, open(os.path.join('xrandr-tests', 'with-extern')) as file:
+            s = screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = file)
+            config = os.path.join(tmp, "lilass.conf")
+            cacheFile = os.path.join(tmp, "replay_cache.json")
+            makeCache = lambda options = (): replaycache.ReplayCache(cacheFile, [config, os.path.join(tmp, "missing.sqlite")], options)
+            setup = screen.ScreenSetup(screen.Resolution(1366, 768), screen.Resolution(1920, 1200), screen.RelativeScreenPosition.LEFT)
+            target = s.targetState(setup)
+            cache = makeCache()
+            self.assertIsNone(cache.lookup(s.connectors))
+            cache.store(s.connectors, s.internalConnector.name, target)
+            # the next run replays what we stored, and makes the same call
+            self.assertEqual(makeCache().lookup(s.connectors), ('LVDS1', target))
+            self.assertEqual(screen.xrandrCall(s.connectors, makeCache().lookup(s.connectors)[1]), s.forXrandr(setup))
+            # other options, or another screen, do not match
+            self.assertIsNone(makeCache(("mirror",)).lookup(s.connectors))
+            s.externalConnector.edid = edid.Edid(synthetic.edid(1))
+            self.assertIsNone(makeCache().lookup(s.connectors))
+            s.externalConnector.edid = None
+            makeCache().store(s.connectors, s.internalConnector.name, target)
+            self.assertIsNotNone(makeCache().lookup(s.connectors))
+            # a changed config file drops everything
+            with open(config, "w") as f:
+                f.write("internalConnector=LVDS1\n")
+            self.assertIsNone(makeCache().lookup(s.connectors))
+            # entries can expire
+            cache = replaycache.ReplayCache(cacheFile, [config], maxAge = 60)
+            cache.lookup(s.connectors)
+            cache.store(s.connectors, s.internalConnector.name, target)
+            self.assertIsNotNone(cache.lookup(s.connectors))
+            self.assertIsNone(replaycache.ReplayCache(cacheFile, [config], maxAge = 0).lookup(s.connectors))
+
+    def test_back_to_back(self):
+        # the second of two identical silent runs replays, without opening the database
+        args = argparse.Namespace(connectors = 3, modes = 20, edid_extensions = 1, xrandr_delay = 0, db_rows = 10)
+        fixtures = benchmark.Fixtures(args)
+        try:
+            cmd, env = benchmark.coldStartCommand(fixtures)
+            outputs = []
+            for i in range(3):
+                trace = os.path.join(fixtures.tmp.name, "trace-%d" % i)
+                outputs.append((subprocess.check_output(cmd + ["--trace", trace], env=env).decode("utf-8"), trace))
+            self.assertNotIn("applying the previous setup again", outputs[0][0])
+            for out, trace in outputs[1:]:
+                self.assertIn("applying the previous setup again", out)
+                with open(trace) as f:
+                    self.assertNotIn("db-open", f.read())
+        finally:
+            fixtures.tmp.cleanup()
+
+class TestMultiSeat(unittest.TestCase):
+
+    def test_seats(self):
+        sims = [simulator.Simulator() for i in range(5)]
+        for i, sim in enumerate(sims[:4]):
+            sim.handleEvent({"event": "dock", "screens": {"DP-1-1": 100 + 2*i, "DP-1-2": 101 + 2*i}})
+        seats = [multiseat.Seat(":%d" % i, sim, sim.runXrandr, sim.turnOnBacklight) for i, sim in enumerate(sims)]
+        situationFor = lambda seatProbe: screen.ScreenSituation(None, probe = seatProbe, fastProbe = True)
+        placements = ["eDP-1", "DP-1-1:right:eDP-1", "DP-1-2:right:DP-1-1"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "collected_data.sqlite")
+            with database.Database(path):
+                pass
+            # all seats share a read-only database, which has to become writable to store the layouts
+            with database.Database(path, readOnly = True) as db:
+                results = multiseat.setupSeats(seats, situationFor, simulator.replayArgs(layout = placements, rel_position = None), db, workers = 2, lockDirectory = tmp)
+                self.assertEqual([r.display for r in results], [":0", ":1", ":2", ":3", ":4"])
+                self.assertEqual([r.error is None for r in results], [True] * 4 + [False]) # nothing docked on the last seat
+                for sim in sims[:4]:
+                    (res1, pos1, _), (res2, pos2, _) = sim.state()["DP-1-1"], sim.state()["DP-1-2"]
+                    self.assertEqual(pos2, (pos1[0] + res1.width, 0))
+                # the next time, the stored layouts are used
+                results = multiseat.setupSeats(seats[:4], situationFor, simulator.replayArgs(rel_position = None), db, workers = 3, lockDirectory = tmp)
+                self.assertEqual([str(r.setup) for r in results], [", ".join(placements)] * 4)
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                self.assertEqual(multiseat.report(results), 0)
+
+    def test_sysfs(self):
+        # sysfs is the same for all seats
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(probe.SysfsProbe(root = root).getConnectors(), [])
+            with self.assertRaises(Exception):
+                probe.SysfsProbe(":1", root = root)
+        result = subprocess.run([sys.executable, "lilass", "--displays", ":0", ":1", "--probe", "sysfs"], stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn(b"--probe sysfs", result.stderr)
+
+class TestBacklight(unittest.TestCase):
+
+    def test_sysfs(self):
+        with tempfile.TemporaryDirectory() as root:
+            def device(name, kind, brightness, maxBrightness, power = None):
+                os.makedirs(os.path.join(root, name))
+                files = {"type": kind, "brightness": brightness, "max_brightness": maxBrightness}
+                if power is not None:
+                    files["bl_power"] = power
+                for key, value in files.items():
+                    with open(os.path.join(root, name, key), "w") as f:
+                        f.write("%s\n" % value)
+            def read(name, key):
+                with open(os.path.join(root, name, key)) as f:
+                    return int(f.read())
+            device("intel_backlight", "raw", 0, 1000, 4)
+            self.assertEqual(backlight.findDevice(root), os.path.join(root, "intel_backlight"))
+            device("acpi_video0", "firmware", 0, 15, 4)
+            device("thinkpad_screen", "platform", 0, 100)
+            # firmware wins
+            self.assertEqual(backlight.findDevice(root), os.path.join(root, "acpi_video0"))
+            light = backlight.getBacklight(root = root).read()
+            self.assertEqual(light.brightness(), 0)
+            light.turnOn()
+            self.assertEqual((read("acpi_video0", "brightness"), read("acpi_video0", "bl_power")), (15, 0))
+            self.assertEqual(read("intel_backlight", "brightness"), 0) # untouched
+            # nothing to do if it is on already, even if it is dim
+            with open(os.path.join(root, "acpi_video0", "brightness"), "w") as f:
+                f.write("3\n")
+            backlight.turnOn(root = root)
+            self.assertEqual(read("acpi_video0", "brightness"), 3)
+            # a device we cannot make sense of is left to xbacklight
+            with open(os.path.join(root, "acpi_video0", "brightness"), "w") as f:
+                f.write("")
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                light = backlight.getBacklight(root = root).read()
+            self.assertIsInstance(light._device, backlight.XBacklight)
+        # without a device, and for other X servers, xbacklight is used
+        self.assertIsInstance(backlight.getBacklight(root = os.path.join(root, "missing")), backlight.XBacklight)
+        self.assertIsInstance(backlight.getBacklight(":4711", root = root), backlight.XBacklight)
+
+class TestServer(unittest.TestCase):
+
+    def test_forward(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "lilass", "lilass-test.sock")
+            self.assertIsNone(server.forward(["-s"], path)) # no server running
+            def handle(argv):
+                if argv == ["-s"]:
+                    raise server.NeedsUser()
+                if argv == ["--bad"]:
+                    raise Exception("bad argument")
+                print("handled", *argv)
+                return 0 if argv != ["-x"] else None
+            # a socket left behind by a server that is gone
+            os.makedirs(os.path.dirname(path))
+            import socket
+            socket.socket(socket.AF_UNIX, socket.SOCK_STREAM).bind(path)
+            with server.Server(path, handle) as s:
+                results = []
+                def client(argv):
+                    out = io.StringIO()
+                    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+                        results.append((server.forward(argv, path), out.getvalue()))
+                for argv in (["-r", "mirror"], ["-s"], ["-x"], ["--bad"]):
+                    t = threading.Thread(target=client, args=(argv,))
+                    t.start()
+                    s.handleOne()
+                    t.join()
+                self.assertEqual(results, [(0, "handled -r mirror\n"), (None, ""), (None, ""), (1, "bad argument\n")])
+                # some runs are never forwarded
+                self.assertIsNone(server.forward(["--daemon"], path))
+                # a client that gives up does not take the server down
+                c = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                c.connect(path)
+                c.sendall(b'{"argv": ["-r", "mirror"]}\n')
+                c.close()
+                s.handleOne()
+            # a server that dies before answering: the client does the run itself
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as dead:
+                dead.bind(path)
+                dead.listen(1)
+                t = threading.Thread(target=lambda: results.append(server.forward(["-s"], path)))
+                t.start()
+                dead.accept()[0].close()
+                t.join()
+                self.assertIsNone(results[-1])
+            os.unlink(path)
+            self.assertFalse(os.path.exists(path))
+
+    def test_can_handle(self):
+        def args(**kwargs):
+            values = dict(trace=None, probe=None, frontend=None, server=False, daemon=False, displays=None, use_server=True, query=False,
+                          silent=True, rel_position=None, external_only=False, internal_only=False, layout=None)
+            values.update(kwargs)
+            return argparse.Namespace(**values)
+        self.assertTrue(server.canHandle(args()))
+        self.assertFalse(server.canHandle(args(silent=False)))
+        # e.g. `lilass -s --daem`, which forward() does not recognize
+        for kwargs in (dict(daemon=True), dict(displays=[":0", ":1"]), dict(server=True), dict(use_server=False)):
+            self.assertFalse(server.canHandle(args(**kwargs)), kwargs)
+
+class TestAudit(unittest.TestCase):
+
+    def test_corpus(self):
+        import audit, tarfile
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "dumps.tar.gz")
+            with tarfile.open(archive, "w:gz") as t:
+                for i in range(40):
+                    data = "".join(synthetic.xrandrDump(connectors = 2, modes = 10 + i, connected = i % 3)).encode()
+                    if i == 7:
+                        data = b"not a dump\n"
+                    info = tarfile.TarInfo("dump-%02d" % i)
+                    info.size = len(data)
+                    t.addfile(info, io.BytesIO(data))
+            results = list(audit.audit(audit.readDumps(archive), workers = 2, batchSize = 3, maxPending = 2))
+        self.assertEqual(sorted(r["name"] for r in results), ["dump-%02d" % i for i in range(40)])
+        byName = dict((r["name"], r) for r in results)
+        self.assertIn("internal connector", byName["dump-07"]["error"])
+        self.assertIsNone(byName["dump-00"]["external"])
+        self.assertEqual(byName["dump-01"]["external"]["connector"], "DP-1-0")
+        self.assertTrue(byName["dump-01"]["external"]["edid-valid"])
+        self.assertEqual(set(byName["dump-01"]["setups"].keys()), {"left", "right", "above", "below", "mirror"})
+        # the fixtures, straight from a directory
+        report = audit.Report()
+        for result in audit.audit(audit.readDumps('xrandr-tests'), workers = 1):
+            report.add(result)
+        self.assertEqual((report.dumps, report.withExternal, report.summary()["errors"]), (len(os.listdir('xrandr-tests')), 2, 0))
+        # an EDID with a wrong checksum is used, but reported
+        report = audit.Report()
+        with open(os.path.join('xrandr-tests', 'with-extern')) as f:
+            dump = f.read()
+        result = audit.auditDump("broken", dump.replace("\t\t1b16010380342078", "\t\t1b17010380342078").encode())
+        self.assertFalse(result["external"]["edid-valid"])
+        report.add(result)
+        self.assertEqual(report.summary()["invalid-edids"], 1)
+
+class TestFrontends(unittest.TestCase):
+
+    def test_lazy(self):
+        # the silent path must not load any toolkit
+        out = subprocess.check_output([sys.executable, "-c", benchmark.importScript, "lilass"] + benchmark.toolkitModules)
+        self.assertEqual(json.loads(out.decode("utf-8"))["toolkits"], [])
+        # nor what only other modes need
+        out = subprocess.check_output([sys.executable, "-c", benchmark.importScript, "lilass", "daemon", "multiseat"])
+        self.assertEqual(json.loads(out.decode("utf-8"))["toolkits"], [])
+        # frontends are only constructed when used
+        frontend = gui.getFrontend("cli")
+        self.assertIsNone(frontend._frontend)
+        self.assertEqual(type(frontend.get()).__name__, "CLIFrontend")
+
+    def test_compiled_ui(self):
+        import qt_frontend
+        with tempfile.TemporaryDirectory() as cache:
+            oldCache = os.environ.get("XDG_CACHE_HOME")
+            os.environ["XDG_CACHE_HOME"] = cache
+            try:
+                self.assertIsNone(qt_frontend.loadCompiledUi()) # nothing compiled yet
+                path = qt_frontend.compiledUiFile()
+                os.makedirs(os.path.dirname(path))
+                with open(path, "w") as f:
+                    f.write("class Ui_Dialog:\n    pass\n")
+                self.assertEqual(qt_frontend.loadCompiledUi().__name__, "Ui_Dialog")
+                # another .ui file (e.g. after checking out another version) needs another compiled file, no matter how old it is
+                ui = os.path.join(cache, "qt_dialogue.ui")
+                with open(qt_frontend.uiFile) as f, open(ui, "w") as g:
+                    g.write(f.read().replace("</ui>", "<!-- changed --></ui>"))
+                os.utime(ui, (0, 0))
+                qt_frontend.uiFile = ui
+                self.assertIsNone(qt_frontend.loadCompiledUi())
+            finally:
+                qt_frontend.uiFile = os.path.join(os.path.dirname(os.path.abspath(qt_frontend.__file__)), 'qt_dialogue.ui')
+                if oldCache is None:
+                    del os.environ["XDG_CACHE_HOME"]
+                else:
+                    os.environ["XDG_CACHE_HOME"] = oldCache
+
+    def test_form(self):
+        import question_frontend
+        R, P = screen.Resolution, screen.RelativeScreenPosition
+        class ScriptedFrontend(question_frontend.QuestionFrontend):
+            hasForms = True
+            def __init__(self, answers):
+                self.answers = answers
+                self.forms = 0
+            def userChooseAll(self, title, questions):
+                self.forms += 1
+                if self.answers is None:
+                    raise question_frontend.FormNotSupported()
+                # answer by the text of the choice, like a user would
+                return dict((q.name, q.returns[q.choices.index(self.answers[q.name])] if q.name in self.answers else q.returns[0]) for q in questions)
+            def userChoose(self, title, choices, returns, fallback):
+                return fallback # cancel
+        with open(os.path.join('xrandr-tests', 'with-extern')) as file:
+            s = screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = file)
+        # everything is asked at once
+        frontend = ScriptedFrontend({"mode": "Use both displays", "relpos": "right of internal screen", "intres": str(R(1366, 768)),
+                                     "extprim": "External screen is primary"})
+        self.assertEqual(str(frontend.setup(s)), str(screen.ScreenSetup(R(1366, 768), R(1920, 1200), P.RIGHT, True)))
+        frontend = ScriptedFrontend({"mode": "Use both displays", "relpos": "same as internal screen"})
+        self.assertEqual(frontend.setup(s).intResolution, s.commonResolutions()[0])
+        # the previous setup is the default
+        s.previousSetup = screen.ScreenSetup(None, R(1920, 1200))
+        self.assertIs(ScriptedFrontend({}).setup(s), s.previousSetup)
+        # falls back to one question after the other
+        frontend = ScriptedFrontend(None)
+        self.assertIsNone(frontend.setup(s))
+        self.assertIsNone(frontend.setup(s))
+        self.assertEqual((frontend.forms, frontend.hasForms), (1, False))
+
+class TestTracing(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertFalse(tracing.isEnabled())
+        self.assertIs(tracing.span("a"), tracing.span("b"))
+
+    def test_records(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "trace")
+            tracing.enable(path)
+            try:
+                with tracing.span("test", mode = "x"):
+                    with open(os.path.join('xrandr-tests', 'with-extern')) as file:
+                        screen.ScreenSituation(screen.commonInternalConnectorNames(), xrandrSource = file)
+                tracing.flush()
+            finally:
+                tracing._out.close()
+                tracing._out = None
+            counters = dict(tracing._counters)
+            tracing._counters.clear()
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([r["type"] for r in records], ["run"] + ["value"] * 4 + ["span", "counters"])
+        self.assertEqual((records[-2]["name"], records[-2]["mode"]), ("test", "x"))
+        self.assertEqual(counters, {"xrandr-lines": 160, "connectors": 4})
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "collected_data.sqlite")
+        self.setup = screen.ScreenSetup(screen.Resolution(1366, 768), screen.Resolution(1920, 1200), screen.RelativeScreenPosition.LEFT, False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fingerprint(self):
+        edid = synthetic.edid(4711, vendor = "DEL", product = 0xa07a)
+        self.assertTrue(database.edidFingerprint(edid).startswith("DEL-a07a-00001267-"))
+
+    def test_read_only(self):
+        edid = synthetic.edid(1).hex()
+        # a database that does not exist yet knows nothing, and is not created
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertIsNone(db.getConfig(edid))
+        self.assertFalse(os.path.exists(self.path))
+        # writing makes it writable
+        with database.Database(self.path, readOnly = True) as db:
+            db.putConfig(edid, self.setup)
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertEqual(str(db.getConfig(edid)), str(self.setup))
+            self.assertIsNone(db.getConfig(synthetic.edid(2).hex()))
+
+    def test_migration(self):
+        # create a version 1 database
+        edid = synthetic.edid(1)
+        conn = sqlite3.connect(self.path)
+        conn.execute("""CREATE TABLE meta (key text, value text, PRIMARY KEY(key))""")
+        conn.execute("""INSERT INTO meta VALUES ('version', '1')""")
+        conn.execute("""CREATE TABLE known_configs (edid blob, resinternal text, resexternal text, mode text, ext_is_primary integer, PRIMARY KEY(edid))""")
+        conn.execute("""INSERT INTO known_configs VALUES (?, '1366x768', '1920x1200', 'left of', 0)""", (edid,))
+        conn.commit()
+        conn.close()
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertEqual(str(db.getConfig(edid.hex())), str(self.setup))
+            self.assertEqual(db._getMeta("version"), str(database.CURRENT_VERSION))
+
+    def test_migration_from_3(self):
+        # version 3 did not have the updated column
+        conn = sqlite3.connect(self.path)
+        conn.execute("""CREATE TABLE meta (key text, value text, PRIMARY KEY(key))""")
+        conn.execute("""INSERT INTO meta VALUES ('version', '3')""")
+        conn.execute("""CREATE TABLE known_configs (fingerprint text, edid blob, resinternal text, resexternal text, mode text, ext_is_primary integer, PRIMARY KEY(fingerprint))""")
+        conn.execute("""CREATE TABLE known_layouts (screens text, layout text, PRIMARY KEY(screens))""")
+        conn.execute("""INSERT INTO known_layouts VALUES ('a,b', '[]')""")
+        conn.commit()
+        conn.close()
+        with database.Database(self.path) as db:
+            self.assertEqual(db.getLayout("a,b"), "[]")
+            self.assertEqual([row["updated"] for row in db.exportRows()], [0])
+
+    def test_import(self):
+        edids = [synthetic.edid(i) for i in range(5)]
+        other = screen.ScreenSetup(None, screen.Resolution(1920, 1200), None, True)
+        # the source: every screen with <other>, the first two written before the target's rows, the others after
+        sourcePath = os.path.join(self.tmp.name, "source.sqlite")
+        with database.Database(sourcePath) as source:
+            for e in edids:
+                source.putConfig(e, other)
+            source.putLayout("a,b", "[1]")
+            rows = list(source.exportRows(batchSize = 2))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(json.loads(json.dumps(rows)), rows) # it can be written as JSON
+        for i, row in enumerate(rows[:5]):
+            row["updated"] = 1 if i < 2 else 3
+        rows[5]["updated"] = 3
+        for policy, expected in (("local", [self.setup] * 3 + [other] * 2), ("incoming", [other] * 5), ("newest", [self.setup] * 2 + [other] * 3)):
+            path = os.path.join(self.tmp.name, policy + ".sqlite")
+            with database.Database(path) as db:
+                for e in edids[:3]:
+                    db.putConfig(e, self.setup)
+                db.putLayout("a,b", "[0]")
+                db._connection.execute("""UPDATE known_configs SET updated=2""")
+                db._connection.execute("""UPDATE known_layouts SET updated=2""")
+                db._connection.commit()
+                written, skipped = db.importRows(iter(rows), policy, batchSize = 4)
+                self.assertEqual(written + skipped, 6)
+                self.assertEqual([str(db.getConfig(e)) for e in edids], [str(s) for s in expected], policy)
+                self.assertEqual(db.getLayout("a,b"), "[0]" if policy == "local" else "[1]")
+        with database.Database(self.path) as db:
+            self.assertRaises(database.InvalidDBFile, db.importRows, [{"type": "nonsense"}])
+            self.assertRaises(Exception, db.importRows, rows, "oldest")
+
+    def test_seen(self):
+        edid = synthetic.edid(1)
+        day = database.SEEN_INTERVAL
+        with database.Database(self.path) as db:
+            db.putConfig(edid, self.setup)
+            db.putLayout("a,b", "[]")
+        usage = lambda db: db._connection.execute("""SELECT last_seen, use_count FROM known_configs""").fetchone()
+        # looking up the screen again and again only writes once a day
+        for now, expected in ((10*day, (10*day, 1)), (10.5*day, (10*day, 1)), (11*day, (11*day, 2))):
+            with database.Database(self.path, readOnly = True) as db:
+                db.getConfig(edid)
+                db.getLayout("a,b")
+                db.flushSeen(now)
+                self.assertEqual(usage(db), expected)
+        with database.Database(self.path, readOnly = True) as db:
+            db.flushSeen(20*day) # nothing was looked up
+            self.assertEqual(usage(db), (11*day, 2))
+            self.assertEqual(db._connection.execute("""SELECT last_seen, use_count FROM known_layouts""").fetchone(), (11*day, 2))
+
+    def test_eviction(self):
+        day = database.SEEN_INTERVAL
+        # a synthetic history: screen i was written on day i, and used on the days in uses[i]
+        uses = {0: [50], 1: [], 2: [3, 5], 3: [5], 4: [5, 6], 5: [], 6: [7, 8, 9]}
+        edids = dict((i, synthetic.edid(i)) for i in uses)
+        with database.Database(self.path) as db:
+            db.importRows({"type": "config", "edid": edids[i].hex(), "resinternal": "1366x768", "resexternal": None, "mode": None,
+                           "ext_is_primary": 0, "updated": i*day} for i in uses)
+            db._connection.execute("""UPDATE known_configs SET last_seen=0""") # as if written by lilass back then, not imported today
+            db._connection.commit()
+            for today in range(51):
+                for i in uses:
+                    if today in uses[i]:
+                        db.getConfig(edids[i])
+                db.flushSeen(today*day + 1)
+            known = lambda: [i for i in uses if db.getConfig(edids[i]) is not None]
+            # by age: screen 1 was written on day 1, and never used
+            self.assertEqual(db.evict(maxRows = None, maxAge = 50*day, now = 51.5*day), 1)
+            self.assertEqual(known(), [0, 2, 3, 4, 5, 6])
+            # least recently used first, and for the same day, the least often used: 5 (day 5), 3 (day 5, once), 2 (day 5, twice)
+            self.assertEqual(db.evict(maxRows = 4, now = 51.5*day), 2)
+            self.assertEqual(known(), [0, 2, 4, 6])
+            self.assertEqual(db.evict(maxRows = 1, now = 51.5*day), 3)
+            self.assertEqual(known(), [0])
+            self.assertEqual(db.evict(now = 51.5*day), 0)
+
+    def test_maintain(self):
+        day = database.SEEN_INTERVAL
+        with database.Database(self.path) as db:
+            for i in range(50):
+                db.putConfig(synthetic.edid(i), self.setup)
+            self.assertEqual(db.maintain(maxRows = 10, now = time.time()), 40)
+            # not again for a while
+            self.assertIsNone(db.maintain(maxRows = 5, now = time.time() + day))
+            self.assertEqual(db.maintain(maxRows = 5, now = time.time() + database.MAINTENANCE_INTERVAL), 5)
+            self.assertEqual(db._connection.execute("""SELECT count(*) FROM known_configs""").fetchone()[0], 5)
+        # the space is given back
+        self.assertLessEqual(os.path.getsize(self.path), 8*4096)
+        # a database that does not exist yet is left alone
+        with database.Database(os.path.join(self.tmp.name, "other.sqlite"), readOnly = True) as db:
+            self.assertIsNone(db.maintain())
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, "other.sqlite")))
+
+    def test_import_then_maintain(self):
+        day = database.SEEN_INTERVAL
+        old = time.time() - 400*day
+        with database.Database(self.path) as db:
+            written, skipped = db.importRows({"type": "config", "edid": synthetic.edid(i).hex(), "resinternal": "1366x768", "resexternal": None,
+                                              "mode": None, "ext_is_primary": 0, "updated": old} for i in range(5))
+            self.assertEqual(written, 5)
+            db.putConfig(synthetic.edid(10), self.setup)
+            db._connection.execute("""UPDATE known_configs SET updated=?, last_seen=? WHERE resexternal IS NOT NULL""", (old, old))
+            db._connection.commit()
+            # the screens that were just imported stay, the one not used for 400 days goes
+            self.assertEqual(db.maintain(1000, 365*day), 1)
+            self.assertEqual(len([i for i in range(5) if db.getConfig(synthetic.edid(i)) is not None]), 5)
+            # and they are not the first to go when there are too many
+            self.assertEqual(db.evict(maxRows = 5), 0)
+            db.putConfig(synthetic.edid(10), self.setup)
+            db._connection.execute("""UPDATE known_configs SET updated=?, last_seen=? WHERE resexternal IS NOT NULL""", (old, old))
+            db._connection.commit()
+            self.assertEqual(db.evict(maxRows = 5), 1)
+            self.assertIsNone(db.getConfig(synthetic.edid(10)))
+
+    def test_migration_from_4(self):
+        with database.Database(self.path) as db:
+            db.putConfig(synthetic.edid(1), self.setup)
+            db._connection.execute("""ALTER TABLE known_configs DROP COLUMN last_seen""")
+            db._connection.execute("""ALTER TABLE known_configs DROP COLUMN use_count""")
+            db._connection.execute("""UPDATE meta SET value='4' WHERE key='version'""")
+            db._connection.commit()
+        before = time.time()
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertEqual(str(db.getConfig(synthetic.edid(1))), str(self.setup))
+            lastSeen, useCount = db._connection.execute("""SELECT last_seen, use_count FROM known_configs""").fetchone()
+            self.assertGreaterEqual(lastSeen, before)
+            self.assertEqual(useCount, 0)
+
+    def test_dbtool(self):
+        edid = synthetic.edid(1)
+        sourcePath = os.path.join(self.tmp.name, "source.sqlite")
+        with database.Database(sourcePath) as db:
+            db.putConfig(edid, self.setup)
+        dumpPath = os.path.join(self.tmp.name, "dump.jsonl")
+        tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbtool.py")
+        subprocess.check_call([sys.executable, tool, "-d", sourcePath, "export", "-o", dumpPath])
+        with open(dumpPath) as f:
+            self.assertEqual([json.loads(line)["type"] for line in f], ["config"])
+        # merge a database and an export into a new database
+        subprocess.check_call([sys.executable, tool, "merge", self.path, sourcePath, dumpPath], stderr=subprocess.DEVNULL)
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertEqual(str(db.getConfig(edid)), str(self.setup))
+        # a source with an older schema is not changed
+        oldPath = os.path.join(self.tmp.name, "old.sqlite")
+        conn = sqlite3.connect(oldPath)
+        conn.execute("""CREATE TABLE meta (key text, value text, PRIMARY KEY(key))""")
+        conn.execute("""INSERT INTO meta VALUES ('version', '2')""")
+        conn.execute("""CREATE TABLE known_configs (fingerprint text, edid blob, resinternal text, resexternal text, mode text, ext_is_primary integer, PRIMARY KEY(fingerprint))""")
+        conn.execute("""INSERT INTO known_configs VALUES (?, ?, '1366x768', NULL, NULL, 0)""", (database.edidFingerprint(synthetic.edid(2)), synthetic.edid(2)))
+        conn.commit()
+        conn.close()
+        with open(oldPath, "rb") as f:
+            before = f.read()
+        subprocess.check_call([sys.executable, tool, "merge", self.path, oldPath], stderr=subprocess.DEVNULL)
+        with open(oldPath, "rb") as f:
+            self.assertEqual(f.read(), before)
+        with database.Database(self.path, readOnly = True) as db:
+            self.assertIsNotNone(db.getConfig(synthetic.edid(2)))
+
+class TestDaemon(unittest.TestCase):
+
+    def test_events(self):
+        # probe a sequence of xrandr dumps, and check that only actual changes are handled
+        internalConnectors = list(screen.commonInternalConnectorNames())
+        files = iter(['no-EDID', 'no-EDID', 'with-extern', 'with-extern', 'no-EDID'])
+        def probe():
+            with open(os.path.join('xrandr-tests', next(files))) as file:
+                return screen.ScreenSituation(internalConnectors, xrandrSource = file)
+        handled = []
+        d = daemon.Daemon(probe, lambda situation: handled.append(str(situation.externalConnector)))
+        d.run(daemon.ScriptedEventSource([daemon.HotplugEvent(None, None)] * 4))
+        self.assertEqual(handled, ['VGA1', 'HDMI1', 'VGA1'])
+
 if __name__ == '__main__':
     unittest.main()
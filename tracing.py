@@ -0,0 +1,114 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Timing and counters for the phases of a lilass run, to find out where the time goes.
+
+'''
+Tracing is enabled by `lilass --trace FILE`, or by setting LILASS_TRACE=FILE in the environment. FILE can be "-" for stderr.
+It writes one JSON object per line:
+
+  {"type": "run", "pid": ..., "host": ..., "argv": [...], "time": <wall-clock time of the start>}
+  {"type": "span", "pid": ..., "name": "probe", "start": <seconds since the start>, "duration": <seconds>}
+  {"type": "value", "pid": ..., "name": "modes", "value": 23, "connector": "HDMI1"}
+  {"type": "counters", "pid": ..., "counters": {"xrandr-lines": 296, ...}, "total": <seconds since the start>}
+
+The counters are written when the process exits. When tracing is disabled, all functions here return immediately.
+'''
+import atexit, json, os, sys, threading, time
+
+_start = time.perf_counter()
+_out = None # file to write to, or None if tracing is disabled
+_counters = {}
+_lock = threading.Lock() # the pipeline records spans from several threads
+
+def enable(target):
+    '''Start tracing to the given file name, or stderr for "-"'''
+    global _out
+    if _out is not None:
+        return
+    import socket
+    _out = sys.stderr if target == "-" else open(target, "a")
+    _write({"type": "run", "host": socket.gethostname(), "argv": sys.argv, "time": time.time() - elapsed()})
+    atexit.register(flush)
+
+def isEnabled():
+    return _out is not None
+
+def elapsed():
+    '''Seconds since this module was imported, i.e., since lilass started'''
+    return time.perf_counter() - _start
+
+def _write(record):
+    record["pid"] = os.getpid()
+    line = json.dumps(record) + "\n"
+    with _lock:
+        _out.write(line)
+
+class _Span:
+    def __init__(self, name, fields):
+        self._name = name
+        self._fields = fields
+
+    def __enter__(self):
+        self._begin = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, tb):
+        end = time.perf_counter()
+        record = {"type": "span", "name": self._name, "start": self._begin - _start, "duration": end - self._begin}
+        record.update(self._fields)
+        if type is not None:
+            record["error"] = type.__name__
+        _write(record)
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        pass
+_noSpan = _NoSpan()
+
+def span(name, **fields):
+    '''Use as `with tracing.span("name"):` to record how long the block takes'''
+    if _out is None:
+        return _noSpan
+    return _Span(name, fields)
+
+def count(name, n = 1):
+    '''Add <n> to the counter <name>'''
+    if _out is None:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def value(name, value, **fields):
+    '''Record a single value, e.g. one per connector'''
+    if _out is None:
+        return
+    record = {"type": "value", "name": name, "value": value}
+    record.update(fields)
+    _write(record)
+
+def flush():
+    if _out is None:
+        return
+    _write({"type": "counters", "counters": _counters, "total": elapsed()})
+    _out.flush()
+
+if os.environ.get("LILASS_TRACE"):
+    enable(os.environ["LILASS_TRACE"])
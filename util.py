@@ -21,3 +21,25 @@ def getDataDirectory():
 def mkdirP(path, mode=0o700):
     os.makedirs(path, mode=mode, exist_ok=True)
 
+
+def getCacheDirectory():
+    d = os.environ.get("XDG_CACHE_HOME")
+    if d:
+        return os.path.join(d, "lilass")
+    d = os.path.expanduser("~")
+    if d:
+        return os.path.join(d, ".cache", "lilass")
+    raise Exception("Couldn't find cache directory.")
+
+def getRuntimeDirectory():
+    d = os.environ.get("XDG_RUNTIME_DIR")
+    if d:
+        return os.path.join(d, "lilass")
+    return getCacheDirectory() # not cleaned on reboot, but that does not hurt the files we keep there
+
+def mtime(path):
+    '''The modification time of <path>, or None if it does not exist'''
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,147 @@
+# DSL - easy Display Setup for Laptops
+# Copyright (C) 2012-2015 Ralf Jung <post@ralfj.de>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Parser for the output of `xrandr -q --verbose`.
+
+'''
+The parser is a single pass over the lines, looking at each line only once. Which kind of line we have is decided
+by its first character, so most lines are skipped without running any regular expression:
+
+  "Screen 0: ..."                      screen line, ends the current connector
+  "HDMI1 connected primary ..."        connector line (no indentation)
+  "\\tEDID: "                           property lines (indented by a tab); only the EDID block is read
+  "\\t\\t00ffffffffffff00..."             EDID data, until the first line that is not indented by two tabs
+  "  1920x1200 (0x101) ... +preferred" mode lines (indented by spaces, starting with a digit)
+  "        h: width ..."               mode timing lines (indented by spaces, starting with a letter); the "v:" line has the refresh rate
+
+The input can be an iterable of str or of bytes; bytes are only decoded for the connector names and the EDID. Still, decoding
+the entire output at once and parsing str is faster, so that is what probe.XrandrProbe does.
+
+On a synthetic dump of a DP-MST dock (8 connectors with 300 modes each, 7571 lines), a shared x86 machine measured a median of
+10-13ms per parse for str lines (`benchmark.py parse-str`, about 600k lines per second; 7ms in the best runs), about the same
+including the decoding and splitting the probe does (`parse-output`), and 10-20% more for bytes lines (`parse-bytes`).
+'''
+import re
+import screen, tracing
+from edid import Edid
+
+class _Tokens:
+    '''The constants we need for parsing, as either str or bytes'''
+    def __init__(self, conv):
+        self.screen = conv("Screen ")
+        self.tab = conv("\t")
+        self.edid = conv("EDID:")
+        self.preferred = conv(" +preferred")
+        self.current = conv(" *current")
+        self.primary = conv("primary")
+        self.crtc = conv("\tCRTC:")
+        self.geometry = re.compile(conv(r'(\d+)x(\d+)\+(\d+)\+(\d+)'))
+        self.connected = conv("connected")
+        self.disconnected = conv("disconnected")
+        self.virtual = conv("VIRTUAL")
+        self.mode = re.compile(conv(r'\s*(\d+)x(\d+)'))
+        self.edidLine = conv("\t\t")
+        self.timing = conv("        ")
+        self.vTiming = conv("        v:")
+        self.hz = conv("Hz")
+
+_strTokens = _Tokens(lambda s: s)
+_bytesTokens = _Tokens(lambda s: s.encode("ascii"))
+
+def _decode(s):
+    return s if isinstance(s, str) else s.decode("utf-8")
+
+# Parse the output of `xrandr -q --verbose` (an iterable of lines), and return the list of Connector objects.
+def parse(xrandrSource):
+    connectors = []
+    names = set()
+    connector = None # current connector
+    edid = None # list of chunks of the EDID we are currently reading, or None
+    resolution = None # resolution of the last mode line
+    t = None
+    lineCount = 0
+    for lineCount, line in enumerate(xrandrSource, 1):
+        if t is None:
+            t = _bytesTokens if isinstance(line, bytes) else _strTokens
+        if edid is not None:
+            if line.startswith(t.edidLine):
+                edid.append(line.strip())
+                continue
+            # the EDID block is over
+            connector.edid = Edid.fromHex(t.tab[:0].join(edid))
+            edid = None
+            # fallthrough to the rest of the loop for parsing of this line
+        first = line[:1]
+        if first == t.tab:
+            # a property, we are only interested in the EDID and the CRTC
+            if connector is not None:
+                if line.strip() == t.edid:
+                    edid = []
+                elif line.startswith(t.crtc):
+                    connector.crtc = int(line[len(t.crtc):])
+            continue
+        if first.isspace():
+            # mode line or timing line
+            if line.startswith(t.timing):
+                if resolution is not None and line.startswith(t.vTiming):
+                    # "        v: height 1200 start 1203 end 1209 total 1235           clock  59.95Hz"
+                    clock = line.rsplit(None, 1)[-1]
+                    if clock.endswith(t.hz):
+                        connector.addRefreshRate(resolution, float(clock[:-2]))
+                continue
+            m = t.mode.match(line)
+            if m is not None:
+                resolution = screen.Resolution(int(m.group(1)), int(m.group(2)))
+                assert connector is not None
+                connector.addResolution(resolution)
+                if t.preferred in line:
+                    connector.setPreferredResolution(resolution)
+                if t.current in line:
+                    connector.currentResolution = resolution
+            continue
+        resolution = None
+        if line.startswith(t.screen):
+            # screen line
+            connector = None
+            continue
+        if not first:
+            continue # empty line
+        # new connector?
+        parts = line.split(None, 2)
+        if len(parts) < 2 or parts[1] not in (t.connected, t.disconnected):
+            continue # not a connector, e.g. "unknown connection"; ignore the line
+        connector = screen.Connector(_decode(parts[0]))
+        connector.reportedConnected = parts[1] == t.connected
+        if len(parts) > 2:
+            # what is the connector doing right now? "primary 1920x1200+0+0 (0x101) normal (...)"
+            state = parts[2].split(None, 2)
+            if state and state[0] == t.primary:
+                connector.isPrimary = True
+                state = state[1:]
+            m = t.geometry.match(state[0]) if state else None
+            if m is not None:
+                connector.currentResolution = screen.Resolution(int(m.group(1)), int(m.group(2))) # may be refined by the "*current" mode
+                connector.currentPosition = (int(m.group(3)), int(m.group(4)))
+        assert connector.name not in names, "Duplicate connector {}".format(connector.name)
+        if not parts[0].startswith(t.virtual):
+            # skip "VIRTUAL" connectors
+            names.add(connector.name)
+            connectors.append(connector)
+    if edid is not None:
+        connector.edid = Edid.fromHex(t.tab[:0].join(edid))
+    tracing.count("xrandr-lines", lineCount)
+    return connectors
@@ -17,12 +17,14 @@
 
 # interactive zenity interface, question based
 
-from question_frontend import QuestionFrontend
+from question_frontend import QuestionFrontend, FormNotSupported
 from screen import processOutputIt
 
-import subprocess
+import subprocess, shutil
 
 class ZenityFrontend(QuestionFrontend):
+    hasForms = True # asking everything in one dialog means starting zenity once, instead of up to six times
+
     def error(self, message):
         '''Displays a fatal error to the user'''
         subprocess.check_call(["zenity", "--error", "--text="+message])
@@ -40,11 +42,26 @@ class ZenityFrontend(QuestionFrontend):
         # if the output was empty
         return fallback
 
+    def userChooseAll (self, title, questions):
+        separator = "\t" # neither the choices nor the resolutions contain tabs
+        args = ["zenity", "--forms", "--text="+title, "--separator="+separator]
+        for question in questions:
+            assert not any("|" in choice for choice in question.choices)
+            args += ["--add-combo="+question.title, "--combo-values="+"|".join(question.choices)]
+        p = subprocess.run(args, stdout=subprocess.PIPE)
+        if p.returncode == 1:
+            return None # the user canceled
+        if p.returncode != 0:
+            raise FormNotSupported("zenity failed to show the form (exit code %d), it may be too old" % p.returncode)
+        values = p.stdout.decode("utf-8").rstrip("\n").split(separator)
+        if len(values) != len(questions):
+            raise FormNotSupported("zenity returned %d answers for %d questions" % (len(values), len(questions)))
+        answers = {}
+        for question, value in zip(questions, values):
+            switch = dict(zip(question.choices, question.returns))
+            answers[question.name] = switch.get(value, question.returns[0]) # nothing selected
+        return answers
+
+    @staticmethod
     def isAvailable():
-        try:
-            processOutputIt("zenity", "--version")
-            return True
-        except FileNotFoundError:
-            return False
-        except PermissionError:
-            return False
+        return shutil.which("zenity") is not None